@@ -1,8 +1,23 @@
+import asyncio
 import logging
-from fastapi import APIRouter, Depends, HTTPException
-from app.models.api_dtos import TurnRequest, TurnResponse
+from typing import AsyncIterator, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import StreamingResponse
+from app.models.api_dtos import TurnRequest, TurnResponse, TurnEvent
+from app.models.game_state import GameState
 from app.services.game_engine_service import GameEngineService
-from app.core.deps import get_game_engine_service
+from app.services.state_service import GameStateService
+from app.services.turn_coordinator import (
+    IdempotencyKeyConflictError,
+    TurnCoordinator,
+)
+from app.core.deps import (
+    get_game_engine_service,
+    get_state_service,
+    get_turn_coordinator,
+)
+from app.core.sessions import validate_session_id
+from app.core.token_budget import PromptBudgetError
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -12,28 +27,48 @@ logger = logging.getLogger(__name__)
 async def process_turn(
     turn_request: TurnRequest,
     engine_service: GameEngineService = Depends(get_game_engine_service),
+    coordinator: TurnCoordinator = Depends(get_turn_coordinator),
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key"),
 ) -> TurnResponse:
     """
     Process a single game turn.
 
-    1. Loads the current state from JSON.
+    Turns of one session run one at a time. A request carrying an
+    `Idempotency-Key` header that repeats an in-flight or recently completed
+    turn gets that turn's result instead of starting a new one (409 if the
+    key was used for a different turn).
+
+    1. Loads the current state of the session (from the in-memory cache or JSON).
     2. Analyzes the user's input.
     3. Executes AI logic (Action Selection -> Motivation -> Consequences -> Story Writing).
-    4. Saves the new state and chronology.
+    4. Saves the new state.
     5. Returns the story segment and metadata.
+       The chronology is updated by a background job after the response.
     """
     try:
         logger.info(
             f"API Request: Turn processing for {turn_request.user_character_name}"
         )
 
-        response = engine_service.process_turn(
-            user_character_name=turn_request.user_character_name,
-            user_input=turn_request.user_input,
+        session_id = validate_session_id(turn_request.session_id)
+        response = await coordinator.run(
+            session_id,
+            lambda: engine_service.process_turn(
+                user_character_name=turn_request.user_character_name,
+                user_input=turn_request.user_input,
+                session_id=session_id,
+            ),
+            idempotency_key=idempotency_key,
+            fingerprint=_fingerprint(turn_request),
         )
 
         return response
 
+    except IdempotencyKeyConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except PromptBudgetError as e:
+        logger.error(f"Prompt budget exceeded: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
     except FileNotFoundError:
         raise HTTPException(
             status_code=404,
@@ -47,3 +82,131 @@ async def process_turn(
         raise HTTPException(
             status_code=500, detail="Internal server error during turn processing."
         )
+
+
+def _fingerprint(turn_request: TurnRequest) -> tuple:
+    """Содержимое хода для сверки повторов с одним ключом идемпотентности."""
+    return (turn_request.user_character_name, turn_request.user_input)
+
+
+def _format_sse(event: TurnEvent) -> str:
+    """Форматирует событие хода в кадр Server-Sent Events."""
+    return f"event: {event.event}\ndata: {event.model_dump_json()}\n\n"
+
+
+@router.post("/turn/stream")
+async def process_turn_stream(
+    turn_request: TurnRequest,
+    engine_service: GameEngineService = Depends(get_game_engine_service),
+    coordinator: TurnCoordinator = Depends(get_turn_coordinator),
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key"),
+) -> StreamingResponse:
+    """
+    Streaming variant of /turn (Server-Sent Events).
+
+    Emits `stage` events for each pipeline step, `story_token` events with the
+    story text as it is generated (`story_reset` if a draft was rejected by the
+    verifier), and ends with a `result` event carrying the TurnResponse payload
+    or an `error` event.
+
+    The `Idempotency-Key` header works as for /turn. A retry that attaches
+    to an in-flight turn only receives its final `result` event; with a key
+    the turn keeps running if the client disconnects.
+    """
+    logger.info(
+        f"API Request: Streaming turn processing for {turn_request.user_character_name}"
+    )
+    queue: asyncio.Queue[Optional[TurnEvent]] = asyncio.Queue()
+
+    async def run_turn() -> None:
+        try:
+            session_id = validate_session_id(turn_request.session_id)
+            response = await coordinator.run(
+                session_id,
+                lambda: engine_service.process_turn(
+                    user_character_name=turn_request.user_character_name,
+                    user_input=turn_request.user_input,
+                    session_id=session_id,
+                    on_event=queue.put,
+                ),
+                idempotency_key=idempotency_key,
+                fingerprint=_fingerprint(turn_request),
+            )
+            await queue.put(TurnEvent(event="result", data=response.model_dump()))
+        except IdempotencyKeyConflictError as e:
+            await queue.put(
+                TurnEvent(event="error", data={"status_code": 409, "detail": str(e)})
+            )
+        except PromptBudgetError as e:
+            logger.error(f"Prompt budget exceeded: {e}")
+            await queue.put(
+                TurnEvent(event="error", data={"status_code": 500, "detail": str(e)})
+            )
+        except FileNotFoundError:
+            await queue.put(
+                TurnEvent(
+                    event="error",
+                    data={
+                        "status_code": 404,
+                        "detail": "Game state file not found. Please initialize the game first.",
+                    },
+                )
+            )
+        except ValueError as e:
+            logger.error(f"Validation error: {e}")
+            await queue.put(
+                TurnEvent(event="error", data={"status_code": 400, "detail": str(e)})
+            )
+        except Exception as e:
+            logger.error(f"Internal processing error: {e}", exc_info=True)
+            await queue.put(
+                TurnEvent(
+                    event="error",
+                    data={
+                        "status_code": 500,
+                        "detail": "Internal server error during turn processing.",
+                    },
+                )
+            )
+        finally:
+            await queue.put(None)
+
+    async def event_stream() -> AsyncIterator[str]:
+        task = asyncio.create_task(run_turn())
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                yield _format_sse(event)
+        finally:
+            # Клиент отключился раньше времени — прекращаем обработку хода
+            # (ход с ключом идемпотентности защищен от отмены и доработает)
+            if not task.done():
+                task.cancel()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/sessions/{session_id}/state", response_model=GameState)
+async def get_session_state(
+    session_id: str,
+    state_service: GameStateService = Depends(get_state_service),
+) -> GameState:
+    """
+    Returns the current world state of a session.
+    A session that does not exist yet is created from the initial scenario.
+    """
+    try:
+        return await state_service.load_state(validate_session_id(session_id))
+    except FileNotFoundError:
+        raise HTTPException(
+            status_code=404,
+            detail="Game state file not found. Please initialize the game first.",
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
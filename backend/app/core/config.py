@@ -1,5 +1,6 @@
 import os
 from pathlib import Path
+from typing import Literal, Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -20,14 +21,127 @@ class Settings(BaseSettings):
     OPENAI_API_KEY: str = "not-needed"
     OPENAI_BASE_URL: str = "http://localhost:1234/v1"
 
+    # LLM HTTP connection pool (shared for the whole application lifetime)
+    LLM_MAX_CONNECTIONS: int = 20
+    LLM_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    LLM_KEEPALIVE_EXPIRY: float = 120.0  # seconds an idle connection is kept open
+    LLM_CONNECT_TIMEOUT: float = 5.0
+    LLM_REQUEST_TIMEOUT: float = 300.0  # per-call read/write timeout, seconds
+    LLM_MAX_RETRIES: int = 2
+    # Ask for token usage in the last chunk of streamed calls (stream_options);
+    # disable for servers that reject the parameter
+    LLM_STREAM_USAGE: bool = True
+
+    # Batch dispatcher for non-streaming calls. With LLM_BATCH_WINDOW=0 nothing
+    # waits and only in-flight deduplication applies: a deterministic
+    # (temperature 0) request identical to one already in flight (from any
+    # session) shares its response. A window > 0 enables cross-session batching:
+    # requests to the same model arriving within the window are sent together
+    # (identical ones as one call, with n>1 when sampled) so the server batches
+    # them in one step. It adds up to the window to each call.
+    LLM_BATCH_ENABLED: bool = True
+    LLM_BATCH_WINDOW: float = 0.0  # seconds
+    LLM_BATCH_MAX_SIZE: int = 8
+    LLM_BATCH_USE_N: bool = True  # falls back automatically if the server ignores n
+
+    # Model context window: prompt sections are shrunk by their policies (oldest
+    # chronicle entries, compact state JSON, truncation) to fit LLM_MAX_CONTEXT
+    # minus the tokens reserved for the answer. A prompt that still does not fit
+    # fails the turn, so set this to the context window of the served model.
+    # 0 (default) disables the budget.
+    LLM_MAX_CONTEXT: int = 0
+    LLM_GENERATION_RESERVE: int = 1024
+    # Tokenizer for prompt budgets: a tiktoken encoding (used when tiktoken is
+    # installed) or "approx" for the built-in estimate
+    LLM_TOKENIZER: str = "cl100k_base"
+
+    # JSON agents (action consequences, story verification)
+    LLM_STRUCTURED_OUTPUT: bool = False  # send the JSON schema via response_format
+    LLM_JSON_EARLY_STOP: bool = True  # stream and stop once the object is closed
+
     # Game Settings
     # Files are now expected to be inside the backend directory (or configured via env)
     STATE_FILE_PATH: Path = BASE_DIR / "state.json"
     CHRONOLOGY_FILE_PATH: Path = BASE_DIR / "chronology.txt"
 
+    # Multi-session storage: the default session keeps using the files above,
+    # every other session lives in SESSIONS_DIR/<session_id>/.
+    SESSIONS_DIR: Path = BASE_DIR / "sessions"
+    # Initial world for new sessions. Read-only: the default session saves its
+    # progress to STATE_FILE_PATH, so new sessions never start from it
+    SCENARIO_FILE_PATH: Path = BASE_DIR / "scenario.json"
+
+    # In-memory session state cache with write-behind persistence
+    SESSION_CACHE_SIZE: int = 64
+    SESSION_IDLE_TTL: float = 1800.0  # seconds before an idle session is evicted
+    STATE_FLUSH_INTERVAL: float = 5.0  # seconds between snapshot/eviction passes
+    # Crash-safe state log: snapshots are written after this many log records
+    STATE_SNAPSHOT_EVERY: int = 20
+    STATE_WAL_GROUP_COMMIT_WINDOW: float = 0.002  # seconds to batch fsyncs
+
+    # Session storage backend: "file" (state.json/chronology.txt per session,
+    # the default layout above) or "sqlite" (one WAL-mode database file)
+    STORAGE_BACKEND: Literal["file", "sqlite"] = "file"
+    SQLITE_PATH: Path = BASE_DIR / "game.db"
+
+    # Duplicate turn requests (Idempotency-Key header) are answered from the
+    # original turn; its result is kept this long for late retries
+    TURN_RESULT_TTL: float = 600.0
+    TURN_RESULT_MAX_ENTRIES: int = 1024
+
+    # Rendered prompt context (state JSON, text snapshots) cached per state version
+    RENDER_CACHE_SIZE: int = 64
+
+    # Response cache for deterministic (temperature 0) agents
+    RESPONSE_CACHE_ENABLED: bool = True
+    RESPONSE_CACHE_MAX_ENTRIES: int = 512
+    RESPONSE_CACHE_DIR: Optional[Path] = None  # enables the on-disk tier
+    RESPONSE_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+
+    # Local story pre-verification: confident verdicts skip the LLM verifier
+    STORY_PREVERIFY_ENABLED: bool = True
+    STORY_PREVERIFY_PASS_THRESHOLD: float = 0.85  # share of action words found
+
+    # Turn tracing: spans of every turn (stages, agent calls, story attempts,
+    # state merge/save, chronicle jobs) as Chrome trace events in a rotating file
+    TRACING_ENABLED: bool = False
+    TRACE_FILE_PATH: Path = BASE_DIR / "traces" / "turns.jsonl"
+    TRACE_FILE_MAX_BYTES: int = 16 * 1024 * 1024
+    TRACE_FILE_BACKUPS: int = 4
+
+    # Relevance-pruned world context: agents with a context policy see the
+    # acting characters plus the characters and objects referenced by the
+    # action, user input and last chronicle. Smaller worlds are sent whole.
+    CONTEXT_PRUNING_ENABLED: bool = True
+    CONTEXT_PRUNING_MIN_ENTITIES: int = 12  # characters + scene objects
+
+    # Story writing: drafts per round are written and verified in parallel and
+    # the first verified one wins; failed rounds are rewritten with the
+    # verifier's feedback. 1 keeps the serial write -> verify -> rewrite loop.
+    STORY_CANDIDATES: int = 1
+    STORY_MAX_ATTEMPTS: int = 3  # drafts per turn across all rounds
+
+    # Long-term memory: older chronicle entries relevant to the user input and
+    # the planned action (local BM25 index over turn summaries) are added to the
+    # action selector and story writer prompts. 0 disables the index.
+    CHRONICLE_RECALL_TOP_K: int = 3
+    CHRONICLE_RECALL_MAX_TOKENS: int = 400
+    CHRONICLE_INDEX_MAX_SESSIONS: int = 64  # sessions whose index is kept in memory
+
+    # Tiered chronology compaction
+    CHRONICLE_VERBATIM_WORD_LIMIT: int = (
+        6000  # compact once verbatim entries exceed this
+    )
+    CHRONICLE_KEEP_RECENT: int = 20  # newest entries that always stay verbatim
+    CHRONICLE_CHUNK_SIZE: int = 10  # entries summarised per chunk job
+    CHRONICLE_ERA_SIZE: int = 8  # chunk summaries merged per era job
+
     model_config = SettingsConfigDict(
         env_file=os.path.join(BASE_DIR, ".env"), case_sensitive=True, extra="ignore"
     )
 
 
 settings = Settings()
+
+# Session used when a request does not specify one (the legacy single game)
+DEFAULT_SESSION_ID = "default"
@@ -0,0 +1,296 @@
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+from app.models.game_state import GameState, InteractiveObject
+from app.core.render_cache import state_version
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Короткие служебные слова не становятся псевдонимами
+_STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "in", "on", "at", "to", "for", "with",
+    "his", "her", "my", "your", "their", "its",
+}  # fmt: skip
+
+# Псевдоним, который подходит к большему числу сущностей, слишком общий
+# ("shirt", "small key" у всех персонажей) и не учитывается
+_MAX_ALIAS_REFS = 3
+
+_INDEX_CACHE_SIZE = 16
+
+# Ссылка на сущность мира: ("character", имя) или ("object", имя объекта)
+Ref = Tuple[str, str]
+Phrase = Tuple[str, ...]
+
+
+def _normalize(word: str) -> str:
+    """Нижний регистр и грубое снятие английского множественного числа."""
+    word = word.lower()
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        word = word[:-1]
+    return word
+
+
+def _tokens(text: str) -> Phrase:
+    return tuple(_normalize(w) for w in _WORD_RE.findall(text))
+
+
+def _item_aliases(name: str) -> List[Phrase]:
+    """
+    Полное название предмета и его главное слово:
+    "kitchen knife" -> knife, "pot of water" -> pot.
+    """
+    phrase = _tokens(name)
+    if not phrase:
+        return []
+    aliases = [phrase]
+    words = list(phrase)
+    if "of" in words[1:]:
+        head = words[words.index("of", 1) - 1]
+    else:
+        head = words[-1]
+    if len(phrase) > 1 and head.isalpha() and len(head) >= 3:
+        aliases.append((head,))
+    return aliases
+
+
+class ContextPolicy(NamedTuple):
+    """Что остается в контексте агента после отбора по релевантности."""
+
+    # Поля-списки, которые очищаются у персонажей вне ядра
+    trim_fields: Tuple[str, ...] = ("knowledge", "relationships")
+    # Все объекты сцены остаются, отбираются только персонажи
+    keep_all_objects: bool = False
+    # Цели персонажей ядра тоже служат источником ссылок
+    goal_references: bool = False
+
+
+class EntityIndex:
+    """
+    Индекс имен и псевдонимов мира: персонажи (имя, части имени, роли из
+    чужих relationships — "mother", "son"), объекты сцены, одежда
+    и предметы инвентаря (ссылка на предмет выбирает его владельца).
+    """
+
+    def __init__(self, game_state: GameState):
+        aliases: Dict[Phrase, Set[Ref]] = {}
+
+        def add(phrase: Phrase, ref: Ref) -> None:
+            if phrase and not (len(phrase) == 1 and phrase[0] in _STOPWORDS):
+                aliases.setdefault(phrase, set()).add(ref)
+
+        for name, character in game_state.characters.items():
+            ref = ("character", name)
+            add(_tokens(name), ref)
+            for word in _tokens(name):
+                if len(word) >= 3:
+                    add((word,), ref)
+            items = list(character.inventory) + list(character.holding)
+            for worn in character.clothing.model_dump().values():
+                items.extend(worn)
+            for item in items:
+                for alias in _item_aliases(item):
+                    add(alias, ref)
+            for relationship in character.relationships:
+                if relationship.target in game_state.characters:
+                    add(
+                        _tokens(relationship.type),
+                        ("character", relationship.target),
+                    )
+        for obj in game_state.scene.interactive_objects:
+            for alias in _item_aliases(obj.name):
+                add(alias, ("object", obj.name))
+
+        self.aliases = {
+            phrase: refs
+            for phrase, refs in aliases.items()
+            if len(refs) <= _MAX_ALIAS_REFS
+        }
+        self.max_phrase = max((len(p) for p in self.aliases), default=1)
+
+    def find(self, texts: Iterable[str]) -> Set[Ref]:
+        """Сущности, упомянутые в текстах."""
+        found: Set[Ref] = set()
+        for text in texts:
+            if not text:
+                continue
+            words = _tokens(text)
+            for size in range(1, self.max_phrase + 1):
+                for i in range(len(words) - size + 1):
+                    refs = self.aliases.get(words[i : i + size])
+                    if refs:
+                        found |= refs
+        return found
+
+
+class _IndexCache:
+    """LRU индексов по версии состояния: агенты одного хода делят индекс."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, EntityIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, game_state: GameState) -> EntityIndex:
+        version = state_version(game_state)
+        with self._lock:
+            index = self._entries.get(version)
+            if index is not None:
+                self._entries.move_to_end(version)
+                return index
+        index = EntityIndex(game_state)
+        with self._lock:
+            self._entries[version] = index
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return index
+
+
+_index_cache = _IndexCache(_INDEX_CACHE_SIZE)
+
+
+@dataclass
+class PrunedContext:
+    """
+    Состояние, которое видит агент, и сведения о скрытом.
+    При pruned=False state — исходное состояние целиком.
+    """
+
+    state: GameState
+    full_state: GameState
+    pruned: bool = False
+    hidden_characters: Set[str] = field(default_factory=set)
+    hidden_objects: Set[str] = field(default_factory=set)
+    # Персонаж -> очищенные у него поля
+    trimmed: Dict[str, Tuple[str, ...]] = field(default_factory=dict)
+
+    def check_changes(self, changes: Any) -> Optional[str]:
+        """
+        Причина, по которой state_changes нельзя применять к полному миру,
+        или None. Изменения скрытого персонажа или очищенного поля означают,
+        что агенту не хватило контекста (списки заменяются целиком).
+        """
+        if not self.pruned or not isinstance(changes, dict):
+            return None
+        characters = changes.get("characters")
+        if not isinstance(characters, dict):
+            return None
+        for name, character_changes in characters.items():
+            if name in self.hidden_characters:
+                return f"changes hidden character '{name}'"
+            if isinstance(character_changes, dict):
+                for field_name in self.trimmed.get(name, ()):
+                    if field_name in character_changes:
+                        return f"changes trimmed field '{name}.{field_name}'"
+        return None
+
+    def expand_changes(self, changes: Any) -> Any:
+        """
+        Возвращает скрытые объекты в новый список scene.interactive_objects:
+        агент перечисляет только те объекты, что видел.
+        """
+        if not self.pruned or not self.hidden_objects or not isinstance(changes, dict):
+            return changes
+        scene = changes.get("scene")
+        if not isinstance(scene, dict):
+            return changes
+        objects = scene.get("interactive_objects")
+        if not isinstance(objects, list):
+            return changes
+
+        updated = {
+            obj.get("name"): obj
+            for obj in objects
+            if isinstance(obj, dict) and obj.get("name") is not None
+        }
+        merged: List[Any] = []
+        for obj in self.full_state.scene.interactive_objects:
+            if obj.name in self.hidden_objects:
+                merged.append(obj.model_dump())
+            elif obj.name in updated:
+                merged.append(updated.pop(obj.name))
+        # Новые объекты и записи, которые не удалось сопоставить по имени
+        merged.extend(
+            obj
+            for obj in objects
+            if not isinstance(obj, dict) or obj.get("name") in updated
+        )
+        return {**changes, "scene": {**scene, "interactive_objects": merged}}
+
+
+def prune_context(
+    game_state: GameState,
+    policy: ContextPolicy,
+    core: Iterable[str],
+    texts: Iterable[Optional[str]],
+    min_entities: int = 0,
+) -> PrunedContext:
+    """
+    Оставляет в состоянии ядро (персонажи core) и сущности, упомянутые
+    в texts (действие, ввод пользователя, последняя хроника и т.п.).
+    Миры меньше min_entities (персонажи + объекты) и выборки, из которых
+    нечего убрать, возвращаются без изменений.
+    """
+    full = PrunedContext(state=game_state, full_state=game_state)
+    characters = game_state.characters
+    objects = game_state.scene.interactive_objects
+    if len(characters) + len(objects) < min_entities:
+        return full
+
+    core_names = {name for name in core if name in characters}
+    sources = [text for text in texts if text]
+    if policy.goal_references:
+        sources.extend(characters[name].goal for name in core_names)
+    refs = _index_cache.get(game_state).find(sources)
+
+    keep_characters = core_names | {n for kind, n in refs if kind == "character"}
+    if policy.keep_all_objects:
+        keep_objects = {obj.name for obj in objects}
+    else:
+        keep_objects = {n for kind, n in refs if kind == "object"}
+
+    trimmed: Dict[str, Tuple[str, ...]] = {}
+    view_characters = {}
+    for name, character in characters.items():
+        if name not in keep_characters:
+            continue
+        fields = tuple(
+            f
+            for f in policy.trim_fields
+            if name not in core_names and getattr(character, f)
+        )
+        if fields:
+            trimmed[name] = fields
+            character = character.model_copy(
+                update={f: type(getattr(character, f))() for f in fields}
+            )
+        view_characters[name] = character
+    view_objects: List[InteractiveObject] = [
+        obj for obj in objects if obj.name in keep_objects
+    ]
+
+    if (
+        len(view_characters) == len(characters)
+        and len(view_objects) == len(objects)
+        and not trimmed
+    ):
+        return full
+
+    view = game_state.model_copy(
+        update={
+            "scene": game_state.scene.model_copy(
+                update={"interactive_objects": view_objects}
+            ),
+            "characters": view_characters,
+        }
+    )
+    return PrunedContext(
+        state=view,
+        full_state=game_state,
+        pruned=True,
+        hidden_characters=set(characters) - set(view_characters),
+        hidden_objects={obj.name for obj in objects} - keep_objects,
+        trimmed=trimmed,
+    )
@@ -1,11 +1,17 @@
-from typing import Generator
-from fastapi import Depends
-from openai import OpenAI
-from app.core.config import settings
+from typing import Optional
+from fastapi import Depends, Request
+from openai import AsyncOpenAI
+from app.core.llm_batching import LLMBatchDispatcher
+from app.core.response_cache import ResponseCache
+from app.storage import Storage
 
 # Import Logic Services
 from app.services.state_service import GameStateService
 from app.services.chronicle_service import ChronicleService
+from app.services.chronicle_memory import ChronicleMemory
+from app.services.chronicle_queue import ChronicleJobQueue
+from app.services.story_preverifier import StoryPreVerifier
+from app.services.turn_coordinator import TurnCoordinator
 from app.services.game_engine_service import GameEngineService
 from app.services.agent_services import (
     ActionSelectorService,
@@ -17,68 +23,112 @@ from app.services.agent_services import (
 )
 
 
-def get_openai_client() -> Generator[OpenAI, None, None]:
+def get_openai_client(request: Request) -> AsyncOpenAI:
     """
-    Создает и предоставляет клиент OpenAI.
-    Конфигурация берется из settings (переменные окружения).
+    Возвращает общий клиент OpenAI, созданный в lifespan приложения.
+    Все сервисы одного хода (и всех параллельных ходов) используют один пул соединений.
     """
-    client = OpenAI(
-        base_url=settings.OPENAI_BASE_URL,
-        api_key=settings.OPENAI_API_KEY,
-    )
-    try:
-        yield client
-    finally:
-        client.close()
+    return request.app.state.openai_client
+
+
+def get_response_cache(request: Request) -> Optional[ResponseCache]:
+    """Общий кэш ответов LLM (None, если кэш отключен в настройках)."""
+    return request.app.state.response_cache
+
+
+def get_llm_dispatcher(request: Request) -> Optional[LLMBatchDispatcher]:
+    """Общий диспетчер пачек запросов к LLM (None, если отключен)."""
+    return request.app.state.llm_dispatcher
+
+
+def get_storage(request: Request) -> Storage:
+    """Общее хранилище сессий (файлы или SQLite, создается в lifespan)."""
+    return request.app.state.storage
+
+
+def get_chronicle_queue(request: Request) -> ChronicleJobQueue:
+    """Общая фоновая очередь задач хронологии (создается в lifespan)."""
+    return request.app.state.chronicle_queue
+
+
+def get_chronicle_memory(request: Request) -> Optional[ChronicleMemory]:
+    """Общий индекс хронологии для поиска прошлых событий (None, если отключен)."""
+    return request.app.state.chronicle_memory
+
+
+def get_story_preverifier(request: Request) -> Optional[StoryPreVerifier]:
+    """Общий локальный предварительный верификатор (None, если отключен)."""
+    return request.app.state.story_preverifier
+
+
+def get_turn_coordinator(request: Request) -> TurnCoordinator:
+    """Общая очередь ходов по сессиям с объединением повторов (создается в lifespan)."""
+    return request.app.state.turn_coordinator
 
 
 # --- Service Providers ---
 
 
-def get_state_service() -> GameStateService:
-    return GameStateService()
+def get_state_service(request: Request) -> GameStateService:
+    """Общий сервис состояния с кэшем сессий (создается в lifespan)."""
+    return request.app.state.state_service
 
 
 def get_chronicle_service(
-    client: OpenAI = Depends(get_openai_client),
+    client: AsyncOpenAI = Depends(get_openai_client),
+    storage: Storage = Depends(get_storage),
+    memory: Optional[ChronicleMemory] = Depends(get_chronicle_memory),
 ) -> ChronicleService:
-    return ChronicleService(client)
+    return ChronicleService(client, storage, memory)
 
 
 def get_action_selector_service(
-    client: OpenAI = Depends(get_openai_client),
+    client: AsyncOpenAI = Depends(get_openai_client),
+    response_cache: Optional[ResponseCache] = Depends(get_response_cache),
+    dispatcher: Optional[LLMBatchDispatcher] = Depends(get_llm_dispatcher),
 ) -> ActionSelectorService:
-    return ActionSelectorService(client)
+    return ActionSelectorService(client, response_cache, dispatcher)
 
 
 def get_motivation_generator_service(
-    client: OpenAI = Depends(get_openai_client),
+    client: AsyncOpenAI = Depends(get_openai_client),
+    response_cache: Optional[ResponseCache] = Depends(get_response_cache),
+    dispatcher: Optional[LLMBatchDispatcher] = Depends(get_llm_dispatcher),
 ) -> MotivationGeneratorService:
-    return MotivationGeneratorService(client)
+    return MotivationGeneratorService(client, response_cache, dispatcher)
 
 
 def get_action_consequence_service(
-    client: OpenAI = Depends(get_openai_client),
+    client: AsyncOpenAI = Depends(get_openai_client),
+    response_cache: Optional[ResponseCache] = Depends(get_response_cache),
+    dispatcher: Optional[LLMBatchDispatcher] = Depends(get_llm_dispatcher),
 ) -> ActionConsequenceService:
-    return ActionConsequenceService(client)
+    return ActionConsequenceService(client, response_cache, dispatcher)
 
 
 def get_story_writer_service(
-    client: OpenAI = Depends(get_openai_client),
+    client: AsyncOpenAI = Depends(get_openai_client),
+    response_cache: Optional[ResponseCache] = Depends(get_response_cache),
+    dispatcher: Optional[LLMBatchDispatcher] = Depends(get_llm_dispatcher),
 ) -> StoryWriterService:
-    return StoryWriterService(client)
+    return StoryWriterService(client, response_cache, dispatcher)
 
 
 def get_story_verifier_service(
-    client: OpenAI = Depends(get_openai_client),
+    client: AsyncOpenAI = Depends(get_openai_client),
+    response_cache: Optional[ResponseCache] = Depends(get_response_cache),
+    preverifier: Optional[StoryPreVerifier] = Depends(get_story_preverifier),
+    dispatcher: Optional[LLMBatchDispatcher] = Depends(get_llm_dispatcher),
 ) -> StoryVerifierService:
-    return StoryVerifierService(client)
+    return StoryVerifierService(client, response_cache, preverifier, dispatcher)
 
 
 def get_world_descriptor_service(
-    client: OpenAI = Depends(get_openai_client),
+    client: AsyncOpenAI = Depends(get_openai_client),
+    response_cache: Optional[ResponseCache] = Depends(get_response_cache),
+    dispatcher: Optional[LLMBatchDispatcher] = Depends(get_llm_dispatcher),
 ) -> WorldDescriptorService:
-    return WorldDescriptorService(client)
+    return WorldDescriptorService(client, response_cache, dispatcher)
 
 
 def get_game_engine_service(
@@ -93,6 +143,7 @@ def get_game_engine_service(
     ),
     story_writer: StoryWriterService = Depends(get_story_writer_service),
     story_verifier: StoryVerifierService = Depends(get_story_verifier_service),
+    chronicle_queue: ChronicleJobQueue = Depends(get_chronicle_queue),
 ) -> GameEngineService:
     return GameEngineService(
         state_service=state_service,
@@ -102,4 +153,5 @@ def get_game_engine_service(
         action_consequence=action_consequence,
         story_writer=story_writer,
         story_verifier=story_verifier,
+        chronicle_queue=chronicle_queue,
     )
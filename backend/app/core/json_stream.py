@@ -0,0 +1,83 @@
+import json
+import re
+from typing import Any, Dict, List
+
+_TRAILING_COMMA_RE = re.compile(r",\s*([\}\]])")
+
+
+class JsonObjectScanner:
+    """
+    Потоковый сканер первого JSON-объекта в ответе LLM.
+    Получает текст по фрагментам и отслеживает вложенность скобок с учетом
+    строк и экранирования, поэтому знает момент, когда объект закрыт, —
+    генерацию после этого можно остановить. Текст до первой `{`
+    (пояснения, markdown-ограждения) пропускается.
+    """
+
+    def __init__(self):
+        self.complete = False
+        self.text = ""
+        self._parts: List[str] = []
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk: str) -> bool:
+        """Добавляет фрагмент ответа. Возвращает True, когда объект полностью получен."""
+        if self.complete:
+            return True
+        start = 0
+        if not self._started:
+            start = chunk.find("{")
+            if start < 0:
+                return False
+            self._started = True
+
+        for i in range(start, len(chunk)):
+            ch = chunk[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{" or ch == "[":
+                self._depth += 1
+            elif ch == "}" or ch == "]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._parts.append(chunk[start : i + 1])
+                    self.text = "".join(self._parts)
+                    self.complete = True
+                    return True
+
+        self._parts.append(chunk[start:])
+        return False
+
+
+def extract_json_object(text: str) -> str:
+    """Возвращает текст первого сбалансированного JSON-объекта в строке."""
+    scanner = JsonObjectScanner()
+    if not scanner.feed(text):
+        raise ValueError("No complete JSON object found")
+    return scanner.text
+
+
+def parse_json_object(text: str) -> Dict[str, Any]:
+    """
+    Разбирает первый JSON-объект из ответа LLM.
+    Висячие запятые (частая ошибка локальных моделей) исправляются
+    только если строгий разбор не удался.
+    """
+    object_text = extract_json_object(text)
+    try:
+        result = json.loads(object_text)
+    except json.JSONDecodeError:
+        result = json.loads(_TRAILING_COMMA_RE.sub(r"\1", object_text))
+    if not isinstance(result, dict):
+        raise ValueError("JSON response is not an object")
+    return result
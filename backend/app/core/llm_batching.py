@@ -0,0 +1,206 @@
+import asyncio
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
+from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletion
+from app.core.metrics import LLM_BATCH_SIZE, LLM_BATCHED_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _InFlight:
+    task: asyncio.Task
+    callers: int = 1
+
+
+@dataclass
+class _Batch:
+    # Ключ параметров запроса -> (параметры, ожидающие с такими параметрами)
+    groups: Dict[str, Tuple[Dict[str, Any], List[asyncio.Future]]] = field(
+        default_factory=dict
+    )
+    size: int = 0
+    timer: Optional[asyncio.TimerHandle] = None
+
+
+class LLMBatchDispatcher:
+    """
+    Диспетчер непотоковых вызовов chat.completions между агентами и клиентом.
+
+    При window=0 (по умолчанию) запросы не ждут: детерминированный запрос
+    (temperature=0), совпадающий по параметрам с уже отправленным и еще
+    не завершенным, из любой сессии, получает его ответ без нового вызова.
+    Остальные запросы уходят сразу, как без диспетчера.
+
+    При window>0 запросы к одной модели, пришедшие в течение окна из любых
+    сессий и ходов, собираются в пачку (не более max_batch_size) и уходят
+    одновременно, а ответы возвращаются каждому ожидающему:
+      - одинаковые запросы с temperature=0 — один вызов, ответ получают все;
+      - одинаковые сэмплированные — один вызов с n=<число таких запросов>,
+        каждый получает свой вариант (если сервер поддерживает n); если
+        сервер вернул меньше вариантов, недостающие запрашиваются отдельно,
+        а n больше не используется;
+      - разные запросы — параллельные вызовы, отправленные разом.
+    Chat API не принимает несколько диалогов в одном запросе, поэтому
+    разные запросы пачки сервер объединяет сам (continuous batching
+    в vLLM и аналогах): окно выравнивает их приход, чтобы они попали
+    в один шаг планировщика. Окно добавляет свою задержку к каждому вызову.
+    Потоковые запросы и запросы с явным n проходят мимо диспетчера.
+    """
+
+    def __init__(
+        self,
+        client: AsyncOpenAI,
+        window: float,
+        max_batch_size: int,
+        use_n: bool = True,
+    ):
+        self.client = client
+        self.window = window
+        self.max_batch_size = max(1, max_batch_size)
+        self.use_n = use_n
+        self._open: Dict[str, _Batch] = {}
+        self._in_flight: Dict[str, _InFlight] = {}
+        self._sending: Set[asyncio.Task] = set()
+
+    async def create(self, **params: Any) -> ChatCompletion:
+        if params.get("stream") or params.get("n", 1) != 1:
+            return await self.client.chat.completions.create(**params)
+
+        key = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+        if self.window <= 0:
+            return await self._create_shared(key, params)
+
+        model = str(params.get("model"))
+        batch = self._open.get(model)
+        if batch is None:
+            batch = self._open[model] = _Batch()
+            batch.timer = asyncio.get_running_loop().call_later(
+                self.window, self._flush, model
+            )
+        future = asyncio.get_running_loop().create_future()
+        batch.groups.setdefault(key, (params, []))[1].append(future)
+        batch.size += 1
+        if batch.size >= self.max_batch_size:
+            self._flush(model)
+        return await future
+
+    async def _create_shared(self, key: str, params: Dict[str, Any]) -> ChatCompletion:
+        """Присоединяет детерминированный запрос к такому же в полете."""
+        if params.get("temperature") != 0.0:
+            # Каждый сэмплированный запрос должен получить свой вариант
+            return await self.client.chat.completions.create(**params)
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            in_flight.callers += 1
+            completion = await asyncio.shield(in_flight.task)
+            LLM_BATCHED_REQUESTS.inc(mode="in_flight")
+            # usage — только у первого, чтобы токены не считались дважды
+            return completion.model_copy(update={"usage": None})
+
+        # Запрос идет отдельной задачей: отмена первого вызывающего
+        # не должна обрывать его для присоединившихся
+        task = asyncio.ensure_future(self.client.chat.completions.create(**params))
+        in_flight = self._in_flight[key] = _InFlight(task)
+        self._sending.add(task)
+
+        def done(_: asyncio.Task) -> None:
+            self._sending.discard(task)
+            if not task.cancelled():
+                task.exception()  # ошибку получат ожидающие, если они остались
+            if self._in_flight.get(key) is in_flight:
+                del self._in_flight[key]
+            LLM_BATCH_SIZE.observe(in_flight.callers)
+
+        task.add_done_callback(done)
+        completion = await asyncio.shield(task)
+        LLM_BATCHED_REQUESTS.inc(mode="single")
+        return completion
+
+    async def close(self) -> None:
+        """Отправляет открытые пачки и дожидается ответов."""
+        for key in list(self._open):
+            self._flush(key)
+        if self._sending:
+            await asyncio.gather(*self._sending, return_exceptions=True)
+
+    def _flush(self, model: str) -> None:
+        batch = self._open.pop(model, None)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        # Ожидающие, чей ход уже отменен, не увеличивают пачку
+        groups = []
+        for params, waiters in batch.groups.values():
+            waiters = [w for w in waiters if not w.done()]
+            if waiters:
+                groups.append((params, waiters))
+        if not groups:
+            return
+        LLM_BATCH_SIZE.observe(sum(len(waiters) for _, waiters in groups))
+        for params, waiters in groups:
+            task = asyncio.create_task(self._send(params, waiters))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(
+        self, params: Dict[str, Any], waiters: List[asyncio.Future]
+    ) -> None:
+        """Отправляет группу одинаковых запросов пачки и раздает ответы."""
+        try:
+            if len(waiters) == 1 or params.get("temperature") == 0.0:
+                completion = await self.client.chat.completions.create(**params)
+                mode = "single" if len(waiters) == 1 else "shared"
+                # usage — только у первого, чтобы токены не считались дважды
+                results = [completion] + [
+                    completion.model_copy(update={"usage": None})
+                ] * (len(waiters) - 1)
+            elif self.use_n:
+                mode = "n"
+                results = await self._create_with_n(params, len(waiters))
+            else:
+                mode = "separate"
+                results = await asyncio.gather(
+                    *(self.client.chat.completions.create(**params) for _ in waiters)
+                )
+        except Exception as e:
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(e)
+            return
+        LLM_BATCHED_REQUESTS.inc(len(waiters), mode=mode)
+        for waiter, result in zip(waiters, results):
+            if not waiter.done():
+                waiter.set_result(result)
+
+    async def _create_with_n(
+        self, params: Dict[str, Any], count: int
+    ) -> List[ChatCompletion]:
+        completion = await self.client.chat.completions.create(**params, n=count)
+        # Каждый вариант — отдельный ответ с одним choice; usage всего
+        # запроса достается первому, чтобы токены не считались дважды
+        results = [
+            completion.model_copy(
+                update={
+                    "choices": [choice.model_copy(update={"index": 0})],
+                    "usage": completion.usage if i == 0 else None,
+                }
+            )
+            for i, choice in enumerate(completion.choices[:count])
+        ]
+        missing = count - len(results)
+        if missing > 0:
+            logger.warning(
+                f"LLM server returned {len(results)} of {count} requested choices; "
+                f"disabling n>1 batching."
+            )
+            self.use_n = False
+            results += await asyncio.gather(
+                *(self.client.chat.completions.create(**params) for _ in range(missing))
+            )
+        return results
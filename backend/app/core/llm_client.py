@@ -0,0 +1,26 @@
+import httpx
+from openai import AsyncOpenAI
+from app.core.config import settings
+
+
+def create_openai_client() -> AsyncOpenAI:
+    """
+    Создает клиент OpenAI с общим пулом HTTP-соединений.
+    Клиент живет все время работы приложения (см. lifespan в main.py),
+    поэтому keep-alive соединения к LLM серверу переиспользуются между ходами.
+    """
+    timeout = httpx.Timeout(
+        settings.LLM_REQUEST_TIMEOUT, connect=settings.LLM_CONNECT_TIMEOUT
+    )
+    limits = httpx.Limits(
+        max_connections=settings.LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY,
+    )
+    return AsyncOpenAI(
+        base_url=settings.OPENAI_BASE_URL,
+        api_key=settings.OPENAI_API_KEY,
+        timeout=timeout,
+        max_retries=settings.LLM_MAX_RETRIES,
+        http_client=httpx.AsyncClient(timeout=timeout, limits=limits),
+    )
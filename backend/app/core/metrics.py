@@ -0,0 +1,274 @@
+import bisect
+import math
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Границы корзин гистограмм по умолчанию (секунды)
+LLM_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+TTFT_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric(ABC):
+    """Метрика с фиксированным набором меток; значения — по комбинации меток."""
+
+    TYPE = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"Metric '{self.name}' expects labels {self.labelnames}, "
+                f"got {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def samples(self) -> Iterator[Sample]:
+        """Сэмплы метрики: (имя ряда, метки, значение)."""
+
+
+class Counter(_Metric):
+    TYPE = "counter"
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}_total", dict(zip(self.labelnames, key)), value
+
+
+class Histogram(_Metric):
+    TYPE = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LLM_LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # Комбинация меток -> (счетчики по корзинам без накопления, сумма)
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(
+                key, ([0] * len(self.buckets), [0.0])
+            )
+            counts[index] += 1
+            total[0] += value
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            items = [
+                (key, list(counts), total[0])
+                for key, (counts, total) in self._values.items()
+            ]
+        for key, counts, total in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield (
+                    f"{self.name}_bucket",
+                    {**labels, "le": _format_value(bound)},
+                    cumulative,
+                )
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+class MetricsRegistry:
+    """
+    Реестр метрик процесса с выдачей в текстовом формате Prometheus
+    (exposition format 0.0.4). Без внешних зависимостей.
+    """
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> Any:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric '{metric.name}' is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LLM_LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.TYPE}")
+            for name, labels, value in metric.samples():
+                if labels:
+                    rendered = ",".join(
+                        f'{k}="{_escape(v)}"' for k, v in labels.items()
+                    )
+                    name = f"{name}{{{rendered}}}"
+                lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Метрики процесса. Реестр — модульный, как и кэш рендеринга состояния:
+# запись идет из глубины сервисов, а значения общие для всех сессий.
+REGISTRY = MetricsRegistry()
+
+LLM_REQUESTS = REGISTRY.counter(
+    "llm_requests",
+    "LLM chat completion calls by agent and outcome (ok, error, cached).",
+    ["agent", "outcome"],
+)
+LLM_REQUEST_SECONDS = REGISTRY.histogram(
+    "llm_request_duration_seconds",
+    "Wall time of LLM chat completion calls.",
+    ["agent", "stream"],
+    buckets=LLM_LATENCY_BUCKETS,
+)
+LLM_TTFT_SECONDS = REGISTRY.histogram(
+    "llm_time_to_first_token_seconds",
+    "Time to the first content token of streamed LLM calls.",
+    ["agent"],
+    buckets=TTFT_BUCKETS,
+)
+LLM_TOKENS = REGISTRY.counter(
+    "llm_tokens",
+    "Tokens reported by the LLM server in completion.usage.",
+    ["agent", "kind"],
+)
+LLM_BATCH_SIZE = REGISTRY.histogram(
+    "llm_batch_size",
+    "Requests per dispatcher batch (identical requests in flight, or "
+    "same-model requests within the window).",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+LLM_BATCHED_REQUESTS = REGISTRY.counter(
+    "llm_batched_requests",
+    "Requests served by the batch dispatcher, by mode (single, in_flight, "
+    "shared, n, separate).",
+    ["mode"],
+)
+ENGINE_STAGE_SECONDS = REGISTRY.histogram(
+    "engine_stage_duration_seconds",
+    "Duration of turn graph stages.",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+ENGINE_TURN_SECONDS = REGISTRY.histogram(
+    "engine_turn_duration_seconds",
+    "Wall time of a whole turn (process_turn).",
+    ["outcome"],
+    buckets=LLM_LATENCY_BUCKETS,
+)
+SESSION_LOCK_WAIT_SECONDS = REGISTRY.histogram(
+    "session_lock_wait_seconds",
+    "Time a turn waited for the previous turn of its session.",
+    buckets=STAGE_BUCKETS,
+)
+TURNS_COALESCED = REGISTRY.counter(
+    "turns_coalesced",
+    "Duplicate turn requests (same idempotency key) served without a new "
+    "pipeline run, by the state of the original turn (in_flight, completed).",
+    ["state"],
+)
+PROMPT_SECTIONS_SHRUNK = REGISTRY.counter(
+    "prompt_sections_shrunk",
+    "Prompt sections shortened to fit the context window, by agent, section "
+    "and shrink policy.",
+    ["agent", "section", "policy"],
+)
+CONTEXT_PRUNING = REGISTRY.counter(
+    "context_pruning",
+    "World context given to agents with a context policy, by agent and outcome "
+    "(pruned, full, fallback).",
+    ["agent", "outcome"],
+)
+STORY_ATTEMPTS = REGISTRY.histogram(
+    "story_attempts",
+    "Story writer attempts per turn, by final outcome (verified, failed).",
+    ["outcome"],
+    buckets=(1, 2, 3),
+)
+STORY_RETRIES = REGISTRY.counter(
+    "story_retries",
+    "Story rewrites requested after a failed verification.",
+)
+STORY_VERDICTS = REGISTRY.counter(
+    "story_verdicts",
+    "Story verification verdicts by source (preverifier, llm) and verdict "
+    "(pass, fail, invalid).",
+    ["source", "verdict"],
+)
+
+
+def observe_llm_call(
+    agent: str,
+    duration: float,
+    outcome: str = "ok",
+    stream: bool = False,
+    ttft: Optional[float] = None,
+    usage: Any = None,
+) -> None:
+    """Записывает метрики одного вызова LLM (usage — объект completion.usage)."""
+    LLM_REQUESTS.inc(agent=agent, outcome=outcome)
+    if outcome == "cached":
+        return
+    LLM_REQUEST_SECONDS.observe(duration, agent=agent, stream=str(stream).lower())
+    if ttft is not None:
+        LLM_TTFT_SECONDS.observe(ttft, agent=agent)
+    if usage is not None:
+        LLM_TOKENS.inc(usage.prompt_tokens or 0, agent=agent, kind="prompt")
+        LLM_TOKENS.inc(usage.completion_tokens or 0, agent=agent, kind="completion")
@@ -0,0 +1,81 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+from app.core.config import settings
+from app.models.game_state import GameState
+
+_STATE_JSON = "state_json"
+
+
+class RenderCache:
+    """
+    Небольшой LRU-кэш отрисованного контекста промптов.
+    Ключ — (версия содержимого GameState, вид представления), поэтому
+    несколько попыток истории и разные агенты одного хода используют
+    одни и те же строки вместо повторной сериализации мира.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, version: str, kind: str) -> Optional[str]:
+        with self._lock:
+            value = self._entries.get((version, kind))
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end((version, kind))
+            return value
+
+    def put(self, version: str, kind: str, value: str) -> None:
+        with self._lock:
+            self._entries[(version, kind)] = value
+            self._entries.move_to_end((version, kind))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+render_cache = RenderCache(settings.RENDER_CACHE_SIZE)
+
+
+def _dump_state_json(game_state: GameState) -> str:
+    return game_state.model_dump_json(indent=2)
+
+
+def state_version(game_state: GameState) -> str:
+    """
+    Версия содержимого состояния: хэш его JSON-представления.
+    Считается один раз на экземпляр; сам JSON сразу кладется в кэш.
+    """
+    version = game_state._content_version
+    if version is None:
+        state_json = _dump_state_json(game_state)
+        version = hashlib.blake2b(
+            state_json.encode("utf-8"), digest_size=16
+        ).hexdigest()
+        game_state._content_version = version
+        render_cache.put(version, _STATE_JSON, state_json)
+    return version
+
+
+def cached_render(
+    game_state: GameState, kind: str, render: Callable[[GameState], str]
+) -> str:
+    """Возвращает представление состояния из кэша или строит и запоминает его."""
+    version = state_version(game_state)
+    value = render_cache.get(version, kind)
+    if value is None:
+        value = render(game_state)
+        render_cache.put(version, kind, value)
+    return value
+
+
+def render_state_json(game_state: GameState) -> str:
+    """JSON состояния для промптов (indent=2), один раз на версию."""
+    return cached_render(game_state, _STATE_JSON, _dump_state_json)
@@ -0,0 +1,165 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    Кэш ответов LLM с адресацией по содержимому запроса.
+    Ключ — хэш модели, сообщений и параметров сэмплирования, поэтому
+    имеет смысл только для детерминированных вызовов (temperature=0).
+    Два уровня: LRU в памяти и необязательный каталог на диске
+    с вытеснением самых старых файлов при превышении лимита размера.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        disk_dir: Optional[Path] = None,
+        max_disk_bytes: int = 0,
+    ):
+        self.max_entries = max_entries
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.max_disk_bytes = max_disk_bytes
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        # Файлы дискового уровня: ключ -> размер, от старых к новым
+        self._disk_index: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        if self.disk_dir is not None:
+            self._load_disk_index()
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict[str, Any]], **params: Any) -> str:
+        payload = json.dumps(
+            {"model": model, "messages": messages, "params": params},
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    # --- Public API ---
+
+    async def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return value
+            on_disk = key in self._disk_index
+
+        if on_disk:
+            value = await asyncio.to_thread(self._read_disk, key)
+            if value is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._remember(key, value)
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    async def put(self, key: str, value: str) -> None:
+        with self._lock:
+            self._remember(key, value)
+        if self.disk_dir is not None:
+            await asyncio.to_thread(self._write_disk, key, value)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (
+                    round((self.memory_hits + self.disk_hits) / lookups, 3)
+                    if lookups
+                    else 0.0
+                ),
+                "memory_entries": len(self._memory),
+                "disk_entries": len(self._disk_index),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    # --- Internals ---
+
+    def _remember(self, key: str, value: str) -> None:
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _path(self, key: str) -> Path:
+        return self.disk_dir / key[:2] / f"{key}.txt"
+
+    def _load_disk_index(self) -> None:
+        self.disk_dir.mkdir(parents=True, exist_ok=True)
+        files = []
+        for path in self.disk_dir.glob("*/*.txt"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, path.stem, st.st_size))
+        for _, key, size in sorted(files):
+            self._disk_index[key] = size
+            self._disk_bytes += size
+
+    def _read_disk(self, key: str) -> Optional[str]:
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            with self._lock:
+                size = self._disk_index.pop(key, 0)
+                self._disk_bytes -= size
+            return None
+
+    def _write_disk(self, key: str, value: str) -> None:
+        path = self._path(key)
+        data = value.encode("utf-8")
+        # Уникальное имя: параллельные промахи по одному ключу (повтор запроса
+        # клиентом) не пишут в общий временный файл
+        tmp_path = path.with_name(f"{path.stem}.{uuid.uuid4().hex}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, "xb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"Failed to write response cache entry {key}: {e}")
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+            return
+
+        victims = []
+        with self._lock:
+            self._disk_bytes -= self._disk_index.pop(key, 0)
+            self._disk_index[key] = len(data)
+            self._disk_bytes += len(data)
+            while self._disk_bytes > self.max_disk_bytes and len(self._disk_index) > 1:
+                old_key, size = self._disk_index.popitem(last=False)
+                self._disk_bytes -= size
+                victims.append(old_key)
+        for old_key in victims:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
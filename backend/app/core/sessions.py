@@ -0,0 +1,37 @@
+import re
+from pathlib import Path
+from app.core.config import settings, DEFAULT_SESSION_ID
+
+_SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def validate_session_id(session_id: str) -> str:
+    """Проверяет идентификатор сессии (он используется как имя каталога)."""
+    if not _SESSION_ID_RE.match(session_id or ""):
+        raise ValueError(
+            "Invalid session_id: use 1-64 characters from [A-Za-z0-9_-]."
+        )
+    return session_id
+
+
+def session_dir(session_id: str) -> Path:
+    return settings.SESSIONS_DIR / validate_session_id(session_id)
+
+
+def session_state_path(session_id: str) -> Path:
+    """Путь к state.json сессии. Сессия по умолчанию использует STATE_FILE_PATH."""
+    if session_id == DEFAULT_SESSION_ID:
+        return settings.STATE_FILE_PATH
+    return session_dir(session_id) / "state.json"
+
+
+def session_chronology_path(session_id: str) -> Path:
+    """Путь к chronology.txt сессии. Сессия по умолчанию использует CHRONOLOGY_FILE_PATH."""
+    if session_id == DEFAULT_SESSION_ID:
+        return settings.CHRONOLOGY_FILE_PATH
+    return session_dir(session_id) / "chronology.txt"
+
+
+def scenario_path() -> Path:
+    """Начальное состояние мира для новых сессий (файл только читается)."""
+    return settings.SCENARIO_FILE_PATH
@@ -0,0 +1,170 @@
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Tuple, get_args
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from pydantic_core import to_jsonable_python
+from app.models.game_state import GameState
+
+logger = logging.getLogger(__name__)
+
+Path = Tuple[str, ...]
+
+_MISSING = object()
+
+# TypeAdapter строится один раз на тип поля
+_ADAPTERS: Dict[Any, TypeAdapter] = {}
+
+
+def _adapter(annotation: Any) -> TypeAdapter:
+    adapter = _ADAPTERS.get(annotation)
+    if adapter is None:
+        adapter = _ADAPTERS[annotation] = TypeAdapter(annotation)
+    return adapter
+
+
+def format_path(path: Path) -> str:
+    return ".".join(path)
+
+
+@dataclass(frozen=True)
+class DeltaOp:
+    """Установка значения по пути (значение уже провалидировано)."""
+
+    path: Path
+    value: Any
+
+    def to_record(self) -> Dict[str, Any]:
+        """JSON-представление операции для журнала состояния."""
+        return {"path": list(self.path), "value": to_jsonable_python(self.value)}
+
+
+@dataclass
+class DeltaResult:
+    state: GameState
+    # Примененные операции (для журнала) и их diff:
+    # (путь, старое значение, новое значение)
+    ops: List[DeltaOp] = field(default_factory=list)
+    diff: List[Tuple[str, Any, Any]] = field(default_factory=list)
+
+    @property
+    def touched_paths(self) -> List[str]:
+        return [path for path, _, _ in self.diff]
+
+    def format_diff(self) -> str:
+        return "; ".join(f"{path}: {old!r} -> {new!r}" for path, old, new in self.diff)
+
+
+@dataclass
+class StateDelta:
+    """
+    Типизированное представление state_changes от LLM.
+    Вложенный словарь изменений раскладывается на операции по путям
+    (та же семантика, что у deep_merge_dicts: словари сливаются,
+    остальные значения заменяются целиком). Каждое значение проверяется
+    только по типу своего поля, а не пересборкой всего GameState.
+    Невалидные и неизвестные ключи отбрасываются с предупреждением,
+    а не роняют весь ход.
+    """
+
+    ops: List[DeltaOp] = field(default_factory=list)
+    # (путь, причина) для отброшенных изменений
+    rejected: List[Tuple[str, str]] = field(default_factory=list)
+
+    @classmethod
+    def from_changes(cls, state: GameState, changes: Dict[str, Any]) -> "StateDelta":
+        delta = cls()
+        if isinstance(changes, dict):
+            delta._collect(state, GameState, changes, ())
+        else:
+            delta.rejected.append(("", "state_changes is not an object"))
+        for path, reason in delta.rejected:
+            logger.warning(f"State change '{path}' rejected: {reason}")
+        return delta
+
+    def apply(self, state: GameState) -> DeltaResult:
+        """
+        Применяет операции copy-on-write: копируются только модели и словари
+        на путях изменений, остальные ветки мира разделяются со старым состоянием.
+        """
+        result = DeltaResult(state=state, ops=list(self.ops))
+        if not self.ops:
+            return result
+        tree: Dict[str, Any] = {}
+        for op in self.ops:
+            node = tree
+            for key in op.path[:-1]:
+                node = node.setdefault(key, {})
+            node[op.path[-1]] = op
+        result.state = self._rebuild(state, tree, (), result.diff)
+        return result
+
+    # --- Internals ---
+
+    def _collect(
+        self, node: Any, annotation: Any, changes: Dict[str, Any], path: Path
+    ) -> None:
+        for key, value in changes.items():
+            key_path = path + (str(key),)
+            if isinstance(node, BaseModel):
+                model_field = type(node).model_fields.get(key)
+                if model_field is None:
+                    self.rejected.append((format_path(key_path), "unknown field"))
+                    continue
+                child_annotation = model_field.annotation
+                current = getattr(node, key)
+            else:
+                args = get_args(annotation)
+                child_annotation = args[1] if len(args) == 2 else Any
+                current = node.get(key, _MISSING)
+
+            if isinstance(value, dict) and isinstance(current, (BaseModel, dict)):
+                self._collect(current, child_annotation, value, key_path)
+                continue
+
+            try:
+                validated = _adapter(child_annotation).validate_python(value)
+            except ValidationError as e:
+                reason = e.errors()[0]["msg"] if e.errors() else str(e)
+                self.rejected.append((format_path(key_path), reason))
+                continue
+            if current is not _MISSING and current == validated:
+                continue
+            self.ops.append(DeltaOp(key_path, validated))
+
+    def _rebuild(
+        self,
+        node: Any,
+        tree: Dict[str, Any],
+        path: Path,
+        diff: List[Tuple[str, Any, Any]],
+    ) -> Any:
+        updates: Dict[str, Any] = {}
+        for key, sub in tree.items():
+            key_path = path + (key,)
+            if isinstance(node, BaseModel):
+                current = getattr(node, key)
+            else:
+                current = node.get(key)
+            if isinstance(sub, DeltaOp):
+                diff.append((format_path(key_path), current, sub.value))
+                updates[key] = sub.value
+            else:
+                updates[key] = self._rebuild(current, sub, key_path, diff)
+
+        if isinstance(node, BaseModel):
+            return node.model_copy(update=updates)
+        return {**node, **updates}
+
+
+def replay_records(state: GameState, records: List[Dict[str, Any]]) -> GameState:
+    """
+    Повторно применяет операции из журнала (DeltaOp.to_record) по порядку.
+    Операции — установки значений, поэтому повтор уже примененного
+    префикса журнала дает то же итоговое состояние.
+    """
+    for record in records:
+        changes: Any = record["value"]
+        for key in reversed(record["path"]):
+            changes = {key: changes}
+        state = StateDelta.from_changes(state, changes).apply(state).state
+    return state
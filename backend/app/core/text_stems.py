@@ -0,0 +1,37 @@
+import re
+from typing import List
+
+# Нормализация текста для сравнения по словам: основы значимых слов без
+# стоп-слов. Общая для предпроверки историй и поиска по хронологии.
+_WORD_RE = re.compile(r"[a-zа-яё]+", re.IGNORECASE)
+
+STOPWORDS = {
+    # English
+    "a", "an", "the", "and", "or", "but", "to", "of", "in", "on", "at", "by",
+    "for", "with", "from", "into", "onto", "up", "down", "out", "off", "over",
+    "his", "her", "hers", "him", "he", "she", "it", "its", "they", "them",
+    "their", "i", "me", "my", "you", "your", "we", "our", "is", "are", "was",
+    "were", "be", "been", "this", "that", "these", "those", "then", "than",
+    "as", "so", "very", "just", "still", "some", "while", "again", "back",
+    # Russian
+    "и", "в", "во", "на", "с", "со", "к", "ко", "по", "из", "за", "от", "до",
+    "о", "об", "у", "не", "а", "но", "его", "ее", "её", "их", "он", "она",
+    "они", "я", "меня", "мой", "моя", "свой", "свою", "это", "то",
+}  # fmt: skip
+
+_SUFFIXES = ("ingly", "edly", "ing", "ed", "es", "ly", "s", "e")
+
+
+def stem(word: str) -> str:
+    """Грубая нормализация слова: срезает частые английские окончания."""
+    word = word.lower()
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[: -len(suffix)]
+            break
+    return word[:6]
+
+
+def content_stems(text: str) -> List[str]:
+    """Основы значимых слов текста (без стоп-слов), в порядке появления."""
+    return [stem(w) for w in _WORD_RE.findall(text) if w.lower() not in STOPWORDS]
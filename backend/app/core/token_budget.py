@@ -0,0 +1,313 @@
+import json
+import logging
+import re
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+try:
+    import tiktoken
+except ImportError:  # необязательная зависимость: без нее счет приблизительный
+    tiktoken = None
+from app.core.config import settings
+from app.core.metrics import PROMPT_SECTIONS_SHRUNK
+
+logger = logging.getLogger(__name__)
+
+# Служебные токены разметки чата на каждое сообщение и на начало ответа
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_PRIMING_TOKENS = 3
+
+_APPROX_RE = re.compile(r"\w+|[^\w\s]|\n", re.UNICODE)
+
+TRUNCATION_MARK = " [...]"
+
+_COUNT_CACHE_SIZE = 256
+
+
+class TokenCounter:
+    """
+    Счетчик токенов для бюджета промпта.
+    Если установлен tiktoken и указана его кодировка, считает ею (для локальных
+    моделей это тоже оценка, но близкая); иначе — быстрая приблизительная
+    оценка по словам и знакам препинания.
+    Результаты кэшируются по тексту секции: строки из кэша рендеринга
+    (состояние, снимки) и статические инструкции считаются один раз
+    на версию содержимого.
+    """
+
+    def __init__(self, encoding: str, max_entries: int):
+        self.encoding_name = encoding
+        self.max_entries = max_entries
+        self._encode: Optional[Callable[[str], List[int]]] = None
+        self._resolved = False
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def approximate(self) -> bool:
+        self._resolve()
+        return self._encode is None
+
+    def _resolve(self) -> None:
+        if self._resolved:
+            return
+        self._resolved = True
+        if self.encoding_name == "approx":
+            return
+        if tiktoken is None:
+            logger.info("tiktoken is not installed, prompt token counts are estimated.")
+            return
+        try:
+            encoding = tiktoken.get_encoding(self.encoding_name)
+        except Exception as e:
+            # Кодировка скачивается при первом использовании и может быть недоступна
+            logger.warning(
+                f"Tokenizer '{self.encoding_name}' is unavailable ({e}), "
+                f"prompt token counts are estimated."
+            )
+            return
+        self._encode = encoding.encode_ordinary
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        with self._lock:
+            cached = self._entries.get(text)
+            if cached is not None:
+                self._entries.move_to_end(text)
+                return cached
+        self._resolve()
+        if self._encode is not None:
+            tokens = len(self._encode(text))
+        else:
+            tokens = self.estimate(text)
+        with self._lock:
+            self._entries[text] = tokens
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return tokens
+
+    @staticmethod
+    def estimate(text: str) -> int:
+        """
+        Оценка без токенизатора: слово — токен на каждые 4 символа,
+        знак препинания и перевод строки — по токену. Для английского
+        текста и JSON обычно немного завышает, что безопасно для бюджета.
+        """
+        return sum(
+            (len(part) + 3) // 4 if part[0].isalnum() or part[0] == "_" else 1
+            for part in _APPROX_RE.findall(text)
+        )
+
+
+def _split_header(text: str) -> Tuple[str, str]:
+    """Отделяет заголовок секции ("[CURRENT JSON]") от ее содержимого."""
+    if text.startswith("[") and "\n" in text:
+        header, body = text.split("\n", 1)
+        return header + "\n", body
+    return "", text
+
+
+class PromptBudgetError(RuntimeError):
+    """Промпт не укладывается в контекст модели даже после всех сокращений."""
+
+    def __init__(self, agent: str, tokens: int, limit: int):
+        self.agent = agent
+        self.tokens = tokens
+        self.limit = limit
+        super().__init__(
+            f"Prompt of {agent} (~{tokens} tokens) exceeds the context budget "
+            f"of {limit} tokens by {tokens - limit} tokens. Increase "
+            f"LLM_MAX_CONTEXT to the model's context window or set it to 0."
+        )
+
+
+class ShrinkPolicy(ABC):
+    """Способ сократить текст секции до target токенов (насколько возможно)."""
+
+    name = ""
+
+    @abstractmethod
+    def shrink(self, text: str, target: int, counter: TokenCounter) -> Optional[str]:
+        """Новый текст или None, если политика здесь неприменима."""
+
+
+class KeepLastEntries(ShrinkPolicy):
+    """Отбрасывает самые старые записи (хроника), оставляя не меньше min_entries."""
+
+    name = "keep_last_entries"
+
+    def __init__(self, separator: str = "\n", min_entries: int = 1):
+        self.separator = separator
+        self.min_entries = min_entries
+
+    def shrink(self, text: str, target: int, counter: TokenCounter) -> Optional[str]:
+        header, body = _split_header(text)
+        entries = body.split(self.separator)
+        if len(entries) <= self.min_entries:
+            return None
+        budget = target - counter.count(header)
+        kept: List[str] = []
+        used = 0
+        for entry in reversed(entries):
+            tokens = counter.count(entry) + 1
+            if len(kept) >= self.min_entries and used + tokens > budget:
+                break
+            kept.append(entry)
+            used += tokens
+        if len(kept) == len(entries):
+            return None
+        return header + self.separator.join(reversed(kept))
+
+
+class CompactJson(ShrinkPolicy):
+    """Перекодирует JSON секции без отступов и пробелов."""
+
+    name = "compact_json"
+
+    def shrink(self, text: str, target: int, counter: TokenCounter) -> Optional[str]:
+        header, body = _split_header(text)
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return None
+        compact = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        return header + compact
+
+
+class Truncate(ShrinkPolicy):
+    """
+    Последнее средство: обрезает текст. Только для свободного текста —
+    обрезанный JSON перестает быть JSON.
+    С separator каждая запись укорачивается до равной доли бюджета
+    (все записи сохраняют начало), без него отрезается конец текста.
+    Содержимое не сокращается меньше min_tokens: остаток бюджета
+    добирают секции с большим приоритетом.
+    """
+
+    name = "truncate"
+
+    def __init__(self, separator: Optional[str] = None, min_tokens: int = 64):
+        self.separator = separator
+        self.min_tokens = min_tokens
+
+    def shrink(self, text: str, target: int, counter: TokenCounter) -> Optional[str]:
+        header, body = _split_header(text)
+        budget = max(self.min_tokens, target - counter.count(header))
+        if self.separator is None:
+            return header + self._cut(body, budget, counter)
+        entries = body.split(self.separator)
+        share = max(1, budget // len(entries))
+        return header + self.separator.join(
+            self._cut(entry, share, counter) for entry in entries
+        )
+
+    @staticmethod
+    def _cut(text: str, budget: int, counter: TokenCounter) -> str:
+        # Длина подбирается по доле токенов; пара итераций поправляет оценку
+        for _ in range(3):
+            tokens = counter.count(text)
+            if tokens <= budget:
+                return text
+            keep = int(len(text) * budget / tokens * 0.95)
+            text = text[: max(0, keep - len(TRUNCATION_MARK))].rstrip()
+            text += TRUNCATION_MARK
+        return text
+
+
+class BudgetSection(NamedTuple):
+    name: str
+    text: str
+    # Меньший приоритет сокращается раньше
+    priority: int = 0
+    shrink: Tuple[ShrinkPolicy, ...] = ()
+
+
+class BudgetResult(NamedTuple):
+    texts: Dict[str, str]
+    tokens: int
+    # (секция, политика) для примененных сокращений
+    shrunk: List[Tuple[str, str]]
+
+
+def fit_sections(
+    sections: Sequence[BudgetSection],
+    limit: int,
+    counter: TokenCounter,
+    messages: int = 2,
+) -> BudgetResult:
+    """
+    Сокращает секции, пока промпт не уложится в limit токенов.
+    Политики применяются по ступеням: сначала первые политики всех секций
+    по возрастанию приоритета, затем вторые и т.д. — мягкие сокращения
+    (старые записи хроники, компактный JSON) идут раньше обрезки текста.
+    Секции без политик не меняются. Если уложиться не удалось,
+    возвращается наименьший достигнутый вариант.
+    """
+    texts = {section.name: section.text for section in sections}
+    counts = {name: counter.count(text) for name, text in texts.items()}
+    overhead = messages * MESSAGE_OVERHEAD_TOKENS + REPLY_PRIMING_TOKENS
+    total = sum(counts.values()) + overhead
+    shrunk: List[Tuple[str, str]] = []
+    if total <= limit:
+        return BudgetResult(texts, total, shrunk)
+
+    ordered = sorted(sections, key=lambda s: s.priority)
+    steps = max((len(section.shrink) for section in sections), default=0)
+    for step in range(steps):
+        for section in ordered:
+            excess = total - limit
+            if excess <= 0:
+                break
+            if step >= len(section.shrink):
+                continue
+            policy = section.shrink[step]
+            current = texts[section.name]
+            new_text = policy.shrink(
+                current, max(0, counts[section.name] - excess), counter
+            )
+            if new_text is None or new_text == current:
+                continue
+            new_count = counter.count(new_text)
+            if new_count >= counts[section.name]:
+                continue
+            total += new_count - counts[section.name]
+            texts[section.name] = new_text
+            counts[section.name] = new_count
+            shrunk.append((section.name, policy.name))
+        if total <= limit:
+            break
+    return BudgetResult(texts, total, shrunk)
+
+
+token_counter = TokenCounter(settings.LLM_TOKENIZER, _COUNT_CACHE_SIZE)
+
+
+def fit_prompt(
+    agent: str,
+    sections: Sequence[BudgetSection],
+    reserve: Optional[int] = None,
+    messages: int = 2,
+) -> Dict[str, str]:
+    """
+    Укладывает секции промпта агента в LLM_MAX_CONTEXT минус резерв
+    под ответ (по умолчанию LLM_GENERATION_RESERVE). Возвращает тексты секций.
+    Если промпт не помещается и после всех сокращений, бросает PromptBudgetError:
+    сервер обрезал бы его сам, молча и в произвольном месте.
+    """
+    if reserve is None:
+        reserve = settings.LLM_GENERATION_RESERVE
+    limit = settings.LLM_MAX_CONTEXT - reserve
+    result = fit_sections(sections, limit, token_counter, messages)
+    if result.shrunk:
+        for section, policy in result.shrunk:
+            PROMPT_SECTIONS_SHRUNK.inc(agent=agent, section=section, policy=policy)
+        logger.info(
+            f"Prompt of {agent} shrunk to ~{result.tokens} tokens "
+            f"({', '.join(f'{s}:{p}' for s, p in result.shrunk)})"
+        )
+    if result.tokens > limit:
+        raise PromptBudgetError(agent, result.tokens, limit)
+    return result.texts
@@ -0,0 +1,267 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+import weakref
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+
+class TraceExporter:
+    """
+    Запись завершенных спанов в локальный файл с ротацией.
+    Формат — Chrome Trace Event (события "X"), по одному JSON на строку:
+    трасса хода открывается в Perfetto или chrome://tracing после сборки
+    событий в {"traceEvents": [...]} (см. find_trace).
+    Файл ротируется по размеру: path, path.1, ..., path.<backups>.
+    """
+
+    def __init__(self, path: Path, max_bytes: int, backups: int):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = threading.Lock()
+
+    def export(self, events: List[Dict[str, Any]]) -> None:
+        data = "".join(
+            json.dumps(event, ensure_ascii=False, default=str) + "\n"
+            for event in events
+        )
+        with self._lock:
+            try:
+                size = self.path.stat().st_size if self.path.exists() else 0
+                if size and size + len(data) > self.max_bytes:
+                    self._rotate()
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(data)
+            except OSError as e:
+                logger.error(f"Failed to export trace events to {self.path}: {e}")
+
+    def _rotate(self) -> None:
+        for i in range(self.backups - 1, 0, -1):
+            src = self.path.with_name(f"{self.path.name}.{i}")
+            if src.exists():
+                os.replace(src, self.path.with_name(f"{self.path.name}.{i + 1}"))
+        if self.backups > 0:
+            os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        else:
+            self.path.unlink()
+
+    def find_trace(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        """Собирает события трассы из всех файлов; None, если их нет."""
+        files = [self.path] + [
+            self.path.with_name(f"{self.path.name}.{i}")
+            for i in range(1, self.backups + 1)
+        ]
+        events = []
+        with self._lock:
+            for path in reversed(files):
+                if not path.exists():
+                    continue
+                with open(path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        # Дешевый отсев до разбора JSON
+                        if trace_id not in line:
+                            continue
+                        event = json.loads(line)
+                        if event.get("args", {}).get("trace_id") == trace_id:
+                            events.append(event)
+        if not events:
+            return None
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+class _Trace:
+    """События одной трассы, еще не выгруженные в файл."""
+
+    __slots__ = ("trace_id", "exporter", "events", "open_spans", "tracks", "_tids")
+
+    def __init__(self, trace_id: str, exporter: TraceExporter):
+        self.trace_id = trace_id
+        self.exporter = exporter
+        self.events: List[Dict[str, Any]] = []
+        self.open_spans = 0
+        # asyncio-задача -> номер дорожки (tid) в просмотрщике. Ссылки слабые:
+        # id() завершенной задачи может достаться новой
+        self.tracks: "weakref.WeakKeyDictionary[asyncio.Task, int]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._tids = 0
+
+    def track_for(self, name: str) -> int:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        tid = self.tracks.get(task) if task is not None else None
+        if tid is None:
+            self._tids += 1
+            tid = self._tids
+            if task is not None:
+                self.tracks[task] = tid
+            # Дорожка называется по первому спану задачи (например, этапу хода)
+            self.events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": os.getpid(),
+                    "tid": tid,
+                    "args": {"name": name, "trace_id": self.trace_id},
+                }
+            )
+        return tid
+
+
+class Span:
+    """
+    Интервал трассы. Используется как контекстный менеджер: на время блока
+    становится текущим, и вложенные вызовы span() создают дочерние спаны.
+    Текущий спан хранится в ContextVar, поэтому наследуется задачами asyncio,
+    созданными внутри блока.
+    """
+
+    __slots__ = (
+        "name",
+        "trace",
+        "span_id",
+        "parent_id",
+        "attributes",
+        "_start_wall",
+        "_start",
+        "_token",
+        "_tid",
+    )
+
+    recording = True
+
+    def __init__(
+        self,
+        name: str,
+        trace: _Trace,
+        parent_id: Optional[str],
+        attributes: Dict[str, Any],
+    ):
+        self.name = name
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = attributes
+
+    @property
+    def trace_id(self) -> str:
+        return self.trace.trace_id
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def __enter__(self) -> "Span":
+        self.trace.open_spans += 1
+        self._tid = self.trace.track_for(self.name)
+        self._start_wall = time.time_ns() // 1000
+        self._start = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        duration = time.perf_counter() - self._start
+        _current_span.reset(self._token)
+        if exc_type is asyncio.CancelledError:
+            self.attributes["cancelled"] = True
+        elif exc_type is not None:
+            self.attributes["error"] = f"{exc_type.__name__}: {exc}"
+        trace = self.trace
+        trace.events.append(
+            {
+                "name": self.name,
+                "cat": self.name.split(".", 1)[0],
+                "ph": "X",
+                "ts": self._start_wall,
+                "dur": round(duration * 1_000_000),
+                "pid": os.getpid(),
+                "tid": self._tid,
+                "args": {
+                    "trace_id": trace.trace_id,
+                    "span_id": self.span_id,
+                    "parent_id": self.parent_id,
+                    **self.attributes,
+                },
+            }
+        )
+        trace.open_spans -= 1
+        # Выгрузка пачкой, когда закрыт последний открытый спан трассы;
+        # поздние спаны (фоновые задачи хроники) выгружаются отдельно
+        if trace.open_spans == 0:
+            events, trace.events = trace.events, []
+            trace.exporter.export(events)
+        return False
+
+
+class _NoopSpan:
+    """Спан при выключенной трассировке: ничего не записывает."""
+
+    __slots__ = ()
+
+    recording = False
+    trace_id = None
+
+    def set(self, **attributes: Any) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+AnySpan = Union[Span, _NoopSpan]
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+_exporter: Optional[TraceExporter] = None
+
+
+def configure_tracing(exporter: Optional[TraceExporter]) -> None:
+    """Включает трассировку (None — выключает). Вызывается при старте приложения."""
+    global _exporter
+    _exporter = exporter
+
+
+def get_exporter() -> Optional[TraceExporter]:
+    return _exporter
+
+
+def start_trace(trace_id: str, name: str, **attributes: Any) -> AnySpan:
+    """
+    Корневой спан трассы (например, хода с trace_id = turn_id).
+    При выключенной трассировке возвращает NOOP_SPAN.
+    """
+    if _exporter is None:
+        return NOOP_SPAN
+    return Span(name, _Trace(trace_id, _exporter), None, attributes)
+
+
+def span(name: str, parent: Optional[AnySpan] = None, **attributes: Any) -> AnySpan:
+    """
+    Дочерний спан текущего (или явно переданного parent).
+    Вне трассы возвращает NOOP_SPAN — цена вызова одна проверка ContextVar.
+    Дорогие атрибуты стоит вычислять только при span.recording.
+    """
+    if parent is None or not parent.recording:
+        parent = _current_span.get()
+    if parent is None:
+        return NOOP_SPAN
+    return Span(name, parent.trace, parent.span_id, attributes)
+
+
+def current_span() -> AnySpan:
+    """Текущий спан или NOOP_SPAN."""
+    return _current_span.get() or NOOP_SPAN
@@ -1,6 +1,7 @@
 import copy
 from typing import Dict, Any, List
 from app.models.game_state import GameState
+from app.core.render_cache import cached_render
 
 
 def deep_merge_dicts(
@@ -24,6 +25,16 @@ def deep_merge_dicts(
 
 
 def get_scene_context(game_state: GameState) -> str:
+    """Текстовое описание сцены (кэшируется по версии состояния)."""
+    return cached_render(game_state, "scene_context", _build_scene_context)
+
+
+def get_characters_snapshot(game_state: GameState) -> str:
+    """Текстовое описание персонажей (кэшируется по версии состояния)."""
+    return cached_render(game_state, "characters_snapshot", _build_characters_snapshot)
+
+
+def _build_scene_context(game_state: GameState) -> str:
     """Создает текстовое описание сцены из объекта GameState."""
     scene = game_state.scene
 
@@ -36,7 +47,7 @@ def get_scene_context(game_state: GameState) -> str:
     )
 
 
-def get_characters_snapshot(game_state: GameState) -> str:
+def _build_characters_snapshot(game_state: GameState) -> str:
     """Создает текстовое описание персонажей из объекта GameState."""
     character_texts = []
     for name, char_data in game_state.characters.items():
@@ -1,15 +1,109 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+import asyncio
+import json
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
+from app.core.llm_batching import LLMBatchDispatcher
+from app.core.llm_client import create_openai_client
+from app.core.metrics import REGISTRY
+from app.core.tracing import TraceExporter, configure_tracing, get_exporter
+from app.core.response_cache import ResponseCache
+from app.services.chronicle_memory import ChronicleMemory
+from app.services.chronicle_queue import ChronicleJobQueue
+from app.services.turn_coordinator import TurnCoordinator
+from app.services.state_service import GameStateService
+from app.storage import create_storage
+from app.services.story_preverifier import StoryPreVerifier
 from app.api.api import api_router
 
 
+@asynccontextmanager
+async def lifespan(application: FastAPI):
+    # Turn tracing (off by default; spans are no-ops without an exporter)
+    if settings.TRACING_ENABLED:
+        configure_tracing(
+            TraceExporter(
+                settings.TRACE_FILE_PATH,
+                max_bytes=settings.TRACE_FILE_MAX_BYTES,
+                backups=settings.TRACE_FILE_BACKUPS,
+            )
+        )
+    # Shared LLM client: one connection pool with keep-alive for the whole app
+    application.state.openai_client = create_openai_client()
+    # Shares identical in-flight requests (and batches them within the window)
+    application.state.llm_dispatcher = (
+        LLMBatchDispatcher(
+            application.state.openai_client,
+            window=settings.LLM_BATCH_WINDOW,
+            max_batch_size=settings.LLM_BATCH_MAX_SIZE,
+            use_n=settings.LLM_BATCH_USE_N,
+        )
+        if settings.LLM_BATCH_ENABLED
+        else None
+    )
+    # Content-addressed cache of deterministic LLM responses
+    application.state.response_cache = (
+        ResponseCache(
+            max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES,
+            disk_dir=settings.RESPONSE_CACHE_DIR,
+            max_disk_bytes=settings.RESPONSE_CACHE_MAX_BYTES,
+        )
+        if settings.RESPONSE_CACHE_ENABLED
+        else None
+    )
+    # Deterministic story checks that short-circuit the LLM verifier
+    application.state.story_preverifier = (
+        StoryPreVerifier(
+            pass_threshold=settings.STORY_PREVERIFY_PASS_THRESHOLD,
+        )
+        if settings.STORY_PREVERIFY_ENABLED
+        else None
+    )
+    # Background chronicle jobs (turn summaries, compaction), ordered per session
+    application.state.chronicle_queue = ChronicleJobQueue()
+    # Session storage backend (files or SQLite, see STORAGE_BACKEND)
+    application.state.storage = create_storage()
+    application.state.storage.start()
+    # Long-term memory: BM25 index over each session's chronicle entries
+    application.state.chronicle_memory = (
+        ChronicleMemory(
+            application.state.storage,
+            max_sessions=settings.CHRONICLE_INDEX_MAX_SESSIONS,
+        )
+        if settings.CHRONICLE_RECALL_TOP_K > 0
+        else None
+    )
+    # Session state cache on top of the storage's delta log and snapshots
+    application.state.state_service = GameStateService(application.state.storage)
+    application.state.state_service.start()
+    # Per-session turn serialisation and idempotency-key coalescing
+    application.state.turn_coordinator = TurnCoordinator(
+        result_ttl=settings.TURN_RESULT_TTL,
+        max_results=settings.TURN_RESULT_MAX_ENTRIES,
+    )
+    try:
+        yield
+    finally:
+        # Turns detached from their clients still have to be saved
+        await application.state.turn_coordinator.shutdown()
+        await application.state.state_service.close()
+        # Finish pending chronicle jobs before the LLM client goes away
+        await application.state.chronicle_queue.shutdown()
+        await application.state.storage.close()
+        if application.state.llm_dispatcher is not None:
+            await application.state.llm_dispatcher.close()
+        await application.state.openai_client.close()
+        configure_tracing(None)
+
+
 def create_application() -> FastAPI:
     application = FastAPI(
         title=settings.PROJECT_NAME,
         openapi_url=f"{settings.API_V1_STR}/openapi.json",
         docs_url="/docs",
         redoc_url="/redoc",
+        lifespan=lifespan,
     )
 
     # Set all CORS enabled origins
@@ -43,6 +137,49 @@ async def health_check():
     }
 
 
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus metrics: per-agent LLM latency, time to first token and
+    token usage, turn and stage durations, story retries and verdicts.
+    """
+    return Response(REGISTRY.render(), media_type=REGISTRY.CONTENT_TYPE)
+
+
+@app.get("/traces/{turn_id}")
+async def get_trace(turn_id: str):
+    """
+    Chrome trace (Perfetto / chrome://tracing) of one turn, by the turn_id
+    returned in the turn response. Requires TRACING_ENABLED.
+    """
+    exporter = get_exporter()
+    if exporter is None:
+        raise HTTPException(status_code=404, detail="Tracing is disabled.")
+    trace = await asyncio.to_thread(exporter.find_trace, turn_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found.")
+    return Response(
+        json.dumps(trace, ensure_ascii=False),
+        media_type="application/json",
+        headers={"Content-Disposition": f'attachment; filename="turn-{turn_id}.json"'},
+    )
+
+
+@app.get("/stats")
+async def stats():
+    """
+    Runtime counters of the engine's caches and short-circuits.
+    """
+    response_cache = app.state.response_cache
+    story_preverifier = app.state.story_preverifier
+    chronicle_memory = app.state.chronicle_memory
+    return {
+        "response_cache": response_cache.stats() if response_cache else None,
+        "story_preverifier": (story_preverifier.stats() if story_preverifier else None),
+        "chronicle_memory": chronicle_memory.stats() if chronicle_memory else None,
+    }
+
+
 @app.get("/")
 async def root():
     return {
@@ -1,2 +1,2 @@
 from .game_state import GameState, Character, Scene, InteractiveObject, Clothing
-from .api_dtos import TurnRequest, TurnResponse
+from .api_dtos import TurnRequest, TurnResponse, TurnEvent
@@ -1,5 +1,6 @@
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from pydantic import BaseModel
+from app.core.config import DEFAULT_SESSION_ID
 
 
 class TurnRequest(BaseModel):
@@ -9,6 +10,28 @@ class TurnRequest(BaseModel):
 
     user_character_name: str
     user_input: str
+    session_id: str = DEFAULT_SESSION_ID
+
+
+class StageTimingInfo(BaseModel):
+    """
+    Время выполнения одного этапа хода (в секундах).
+    """
+
+    started_at: float
+    duration: float
+
+
+class TurnTimings(BaseModel):
+    """
+    Сводка по времени хода: этапы, общий срок, критический путь
+    и сумма этапов (время при последовательном выполнении).
+    """
+
+    stages: Dict[str, StageTimingInfo] = {}
+    total: float = 0.0
+    critical_path: float = 0.0
+    sequential: float = 0.0
 
 
 class TurnResponse(BaseModel):
@@ -16,9 +39,22 @@ class TurnResponse(BaseModel):
     Ответ сервера после обработки хода ИИ.
     """
 
+    session_id: str = DEFAULT_SESSION_ID
+    turn_id: Optional[str] = None
     ai_character_name: str
     motivation: str
     story_part: str
     completed_actions: List[str]
     is_success: bool = True
     error_message: Optional[str] = None
+    timings: Optional[TurnTimings] = None
+
+
+class TurnEvent(BaseModel):
+    """
+    Событие потоковой обработки хода (SSE).
+    event: stage | story_token | story_reset | result | error
+    """
+
+    event: str
+    data: Dict[str, Any] = {}
@@ -1,5 +1,5 @@
 from typing import List, Dict, Optional, Any
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel, Field, ConfigDict, PrivateAttr
 
 
 class InteractiveObject(BaseModel):
@@ -52,9 +52,22 @@ class Character(BaseModel):
 class GameState(BaseModel):
     """
     Root model representing the entire state.json file.
+
+    Instances are treated as immutable once built: the engine creates a new
+    GameState for every change, so the content version (see
+    app.core.render_cache.state_version) is computed once per instance.
     """
 
     scene: Scene
     characters: Dict[str, Character]
 
     model_config = ConfigDict(extra="ignore")
+
+    # Content hash, memoised by app.core.render_cache
+    _content_version: Optional[str] = PrivateAttr(default=None)
+
+    def model_copy(self, *, update=None, deep: bool = False) -> "GameState":
+        copied = super().model_copy(update=update, deep=deep)
+        # The copy may have different content: its version is recomputed lazily
+        copied._content_version = None
+        return copied
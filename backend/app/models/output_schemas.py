@@ -0,0 +1,84 @@
+from typing import Any, Dict, Type
+from pydantic import BaseModel
+from .game_state import GameState
+
+# Keywords removed from every schema node
+# (descriptions are docstrings: they only cost grammar and prompt tokens)
+_DROP_KEYS = ("default", "description")
+
+_DEFS_PREFIX = "#/$defs/"
+
+
+def partial_json_schema(model: Type[BaseModel]) -> Dict[str, Any]:
+    """
+    JSON schema of a pydantic model in which every field is optional,
+    i.e. the shape of a sparse update ("only the keys that have changed").
+    Fields stay optional through model and dict nesting only: array items
+    replace the whole list, so their schemas keep "required". A definition
+    used both ways is emitted twice ("<Name>Partial" and "<Name>").
+    """
+    schema = model.model_json_schema()
+    source_defs = schema.pop("$defs", {})
+    defs: Dict[str, Any] = {}
+
+    def ref(name: str, partial: bool) -> Dict[str, Any]:
+        target = f"{name}Partial" if partial else name
+        if target not in defs:
+            defs[target] = {}  # placeholder for recursive models
+            defs[target] = convert(source_defs[name], partial)
+        return {"$ref": _DEFS_PREFIX + target}
+
+    def convert(node: Any, partial: bool) -> Any:
+        if isinstance(node, list):
+            return [convert(item, partial) for item in node]
+        if not isinstance(node, dict):
+            return node
+        converted: Dict[str, Any] = {}
+        for key, value in node.items():
+            if key in _DROP_KEYS or (partial and key == "required"):
+                continue
+            if key == "$ref" and value.startswith(_DEFS_PREFIX):
+                converted.update(ref(value[len(_DEFS_PREFIX) :], partial))
+            elif key == "properties":
+                # Names here are field names, not schema keywords
+                converted[key] = {
+                    name: convert(sub, partial) for name, sub in value.items()
+                }
+            elif key in ("items", "prefixItems"):
+                converted[key] = convert(value, False)
+            else:
+                converted[key] = convert(value, partial)
+        return converted
+
+    partial = convert(schema, True)
+    if defs:
+        partial["$defs"] = defs
+    return partial
+
+
+def _action_consequence_schema() -> Dict[str, Any]:
+    state_changes = partial_json_schema(GameState)
+    definitions = state_changes.pop("$defs", {})
+    return {
+        "type": "object",
+        "properties": {
+            "state_changes": state_changes,
+            "completed_actions": {"type": "array", "items": {"type": "string"}},
+        },
+        "required": ["state_changes", "completed_actions"],
+        "$defs": definitions,
+    }
+
+
+# Output of ActionConsequenceService: a partial GameState plus the action script
+ACTION_CONSEQUENCE_SCHEMA = _action_consequence_schema()
+
+# Output of StoryVerifierService
+STORY_VERIFICATION_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "result": {"type": "string", "enum": ["PASS", "FAIL"]},
+        "reason": {"type": "string"},
+    },
+    "required": ["result"],
+}
@@ -1,17 +1,382 @@
-import json
-import re
 import logging
-from typing import List, Tuple, Dict, Any, Optional
-from openai import OpenAI
+import re
+import time
+from enum import IntEnum
+from typing import (
+    List,
+    Tuple,
+    Dict,
+    Any,
+    Optional,
+    Callable,
+    Awaitable,
+    NamedTuple,
+)
+from openai import AsyncOpenAI
+from app.core.config import settings
 from app.models.game_state import GameState
+from app.models.output_schemas import (
+    ACTION_CONSEQUENCE_SCHEMA,
+    STORY_VERIFICATION_SCHEMA,
+)
 from app.core.utils import get_scene_context, get_characters_snapshot
+from app.core.render_cache import render_state_json
+from app.core.context_pruner import ContextPolicy, PrunedContext, prune_context
+from app.core.response_cache import ResponseCache
+from app.core.llm_batching import LLMBatchDispatcher
+from app.core.json_stream import JsonObjectScanner, parse_json_object
+from app.core.metrics import CONTEXT_PRUNING, STORY_VERDICTS, observe_llm_call
+from app.core.token_budget import (
+    BudgetSection,
+    CompactJson,
+    KeepLastEntries,
+    ShrinkPolicy,
+    Truncate,
+    fit_prompt,
+)
+from app.core.tracing import current_span, span
+from app.services.story_preverifier import StoryPreVerifier
 
 logger = logging.getLogger(__name__)
 
+# Колбэк для потоковой выдачи: получает очередной фрагмент текста ответа LLM
+TokenCallback = Callable[[str], Awaitable[None]]
+
+# Условие остановки потока: получает фрагмент, True — ответ уже достаточен
+StopCondition = Callable[[str], bool]
+
+
+class Stability(IntEnum):
+    """
+    Как часто меняется секция промпта.
+    Локальные серверы (llama.cpp, vLLM, LM Studio) переиспользуют KV-кэш только
+    для побайтно совпадающего префикса, поэтому секции упорядочиваются
+    от самых стабильных к самым изменчивым.
+    """
+
+    STATIC = 0  # не меняется никогда (инструкции агента)
+    SESSION = 1  # постоянна в рамках сессии (имя персонажа)
+    TURN = 2  # одинакова в пределах хода (состояние, хроника, действие игрока)
+    CALL = 3  # своя для каждого вызова (замечания к повторной попытке)
+
+
+class PromptSection(NamedTuple):
+    name: str
+    stability: Stability
+    # Если промпт не помещается в контекст модели, секции сокращаются
+    # по возрастанию приоритета своими политиками; без политик — не меняются
+    priority: int = 0
+    shrink: Tuple[ShrinkPolicy, ...] = ()
+
+
+# Политики сокращения для типовых секций
+SHRINK_CHRONICLE = (KeepLastEntries(), Truncate())
+# JSON только перекодируется: обрезанный JSON модель прочитала бы неверно
+SHRINK_STATE_JSON = (CompactJson(),)
+SHRINK_TEXT = (Truncate(),)
+
+
+def format_past_events(past_events: Optional[List[str]]) -> Optional[str]:
+    """Секция прошлых событий, найденных в хронологии (ChronicleMemory)."""
+    if not past_events:
+        return None
+    return (
+        "[RELEVANT PAST EVENTS] (earlier moments of the story, oldest first)\n"
+        + "\n".join(past_events)
+    )
+
 
 class BaseAgentService:
-    def __init__(self, client: OpenAI):
+    # Секции промпта агента в порядке объявления; итоговый порядок —
+    # по стабильности (при равной стабильности — порядок объявления).
+    PROMPT_SECTIONS: Tuple[PromptSection, ...] = ()
+
+    # Агент разрешает кэшировать свои детерминированные (temperature=0) ответы
+    CACHE_RESPONSES: bool = False
+
+    # Отбор контекста мира по релевантности; None — агент видит весь мир
+    CONTEXT_POLICY: Optional[ContextPolicy] = None
+
+    # Токены, оставляемые под ответ (None — LLM_GENERATION_RESERVE)
+    GENERATION_RESERVE: Optional[int] = None
+
+    def __init__(
+        self,
+        client: AsyncOpenAI,
+        response_cache: Optional[ResponseCache] = None,
+        dispatcher: Optional[LLMBatchDispatcher] = None,
+    ):
         self.client = client
+        self.response_cache = response_cache
+        # Непотоковые вызовы идут через общий диспетчер пачек, если он включен
+        self.dispatcher = dispatcher
+
+    @property
+    def metrics_name(self) -> str:
+        """Имя агента в метриках: StoryWriterService -> story_writer."""
+        name = type(self).__name__.removesuffix("Service")
+        return re.sub(r"(?<!^)(?=[A-Z])", "_", name).lower()
+
+    def _prune_context(
+        self, game_state: GameState, core: List[str], *texts: Optional[str]
+    ) -> PrunedContext:
+        """
+        Состояние для промпта: персонажи core и сущности, упомянутые в texts,
+        по политике агента (CONTEXT_POLICY).
+        """
+        if self.CONTEXT_POLICY is None or not settings.CONTEXT_PRUNING_ENABLED:
+            return PrunedContext(state=game_state, full_state=game_state)
+        context = prune_context(
+            game_state,
+            self.CONTEXT_POLICY,
+            core,
+            texts,
+            settings.CONTEXT_PRUNING_MIN_ENTITIES,
+        )
+        CONTEXT_PRUNING.inc(
+            agent=self.metrics_name, outcome="pruned" if context.pruned else "full"
+        )
+        if context.pruned:
+            logger.debug(
+                f"{type(self).__name__}: context pruned to "
+                f"{len(context.state.characters)} characters, "
+                f"{len(context.state.scene.interactive_objects)} objects"
+            )
+        return context
+
+    def _build_messages(self, **sections: Optional[str]) -> List[Dict[str, str]]:
+        """
+        Собирает сообщения из объявленных секций.
+        STATIC и SESSION секции образуют системное сообщение, TURN и CALL —
+        пользовательское, так что префикс промпта одинаков между ходами
+        и повторными попытками. Пустые секции пропускаются.
+        Секции сокращаются, если промпт не помещается в контекст модели.
+        """
+        declared = {section.name for section in self.PROMPT_SECTIONS}
+        unknown = set(sections) - declared
+        if unknown:
+            raise ValueError(f"Undeclared prompt sections: {sorted(unknown)}")
+
+        contents = {
+            name: content.strip() for name, content in sections.items() if content
+        }
+        if settings.LLM_MAX_CONTEXT > 0:
+            contents = self._fit_context(contents)
+
+        system_parts: List[str] = []
+        user_parts: List[str] = []
+        for section in sorted(self.PROMPT_SECTIONS, key=lambda s: s.stability):
+            content = contents.get(section.name)
+            if not content:
+                continue
+            if section.stability <= Stability.SESSION:
+                system_parts.append(content)
+            else:
+                user_parts.append(content)
+
+        return [
+            {"role": "system", "content": "\n\n".join(system_parts)},
+            {"role": "user", "content": "\n\n".join(user_parts)},
+        ]
+
+    def _fit_context(self, contents: Dict[str, str]) -> Dict[str, str]:
+        """Укладывает секции в контекст модели (см. PromptSection.shrink)."""
+        return fit_prompt(
+            self.metrics_name,
+            [
+                BudgetSection(
+                    section.name,
+                    contents[section.name],
+                    section.priority,
+                    section.shrink,
+                )
+                for section in self.PROMPT_SECTIONS
+                if section.name in contents
+            ],
+            self.GENERATION_RESERVE,
+        )
+
+    async def _create_completion(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        on_token: Optional[TokenCallback] = None,
+        stop_when: Optional[StopCondition] = None,
+        **kwargs: Any,
+    ) -> str:
+        """
+        Единая точка вызова LLM для всех агентов.
+        Возвращает текст первого варианта ответа.
+        Если передан on_token, ответ запрашивается с stream=True и каждый
+        фрагмент передается в колбэк по мере генерации.
+        Если передан stop_when, ответ тоже читается потоком, а соединение
+        закрывается, как только условие выполнено (сервер прекращает генерацию).
+        """
+        with span(f"llm.{self.metrics_name}", temperature=temperature) as llm_span:
+            if llm_span.recording:
+                llm_span.set(
+                    messages=len(messages),
+                    prompt_chars=sum(len(m["content"]) for m in messages),
+                )
+            response = await self._complete(
+                messages, temperature, on_token, stop_when, **kwargs
+            )
+            llm_span.set(response_chars=len(response))
+            return response
+
+    async def _complete(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        on_token: Optional[TokenCallback],
+        stop_when: Optional[StopCondition],
+        **kwargs: Any,
+    ) -> str:
+        if on_token is not None:
+            return await self._stream_completion(
+                messages, temperature, on_token=on_token, **kwargs
+            )
+
+        cache_key = None
+        if (
+            self.CACHE_RESPONSES
+            and self.response_cache is not None
+            and temperature == 0.0
+        ):
+            cache_key = ResponseCache.make_key(
+                f"{self.client.base_url}|local-model",
+                messages,
+                temperature=temperature,
+                **kwargs,
+            )
+            cached = await self.response_cache.get(cache_key)
+            if cached is not None:
+                logger.debug(f"{type(self).__name__}: response cache hit")
+                self._record_call(0.0, outcome="cached")
+                return cached
+
+        if stop_when is not None:
+            response = await self._stream_completion(
+                messages, temperature, stop_when=stop_when, **kwargs
+            )
+        else:
+            started = time.perf_counter()
+            create = (
+                self.dispatcher.create
+                if self.dispatcher is not None
+                else self.client.chat.completions.create
+            )
+            try:
+                completion = await create(
+                    model="local-model",
+                    messages=messages,
+                    temperature=temperature,
+                    **kwargs,
+                )
+            except Exception:
+                self._record_call(time.perf_counter() - started, outcome="error")
+                raise
+            self._record_call(time.perf_counter() - started, usage=completion.usage)
+            response = completion.choices[0].message.content or ""
+
+        if cache_key is not None and response:
+            await self.response_cache.put(cache_key, response)
+        return response
+
+    async def _stream_completion(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        on_token: Optional[TokenCallback] = None,
+        stop_when: Optional[StopCondition] = None,
+        **kwargs: Any,
+    ) -> str:
+        if settings.LLM_STREAM_USAGE:
+            kwargs.setdefault("stream_options", {"include_usage": True})
+        started = time.perf_counter()
+        ttft: Optional[float] = None
+        usage = None
+        parts: List[str] = []
+        try:
+            stream = await self.client.chat.completions.create(
+                model="local-model",
+                messages=messages,
+                temperature=temperature,
+                stream=True,
+                **kwargs,
+            )
+            async for chunk in stream:
+                # При include_usage последний фрагмент несет usage без choices
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+                    parts.append(delta)
+                    if on_token is not None:
+                        await on_token(delta)
+                    if stop_when is not None and stop_when(delta):
+                        await stream.close()
+                        current_span().set(stopped_early=True)
+                        break
+        except Exception:
+            self._record_call(
+                time.perf_counter() - started, outcome="error", stream=True, ttft=ttft
+            )
+            raise
+        self._record_call(
+            time.perf_counter() - started, stream=True, ttft=ttft, usage=usage
+        )
+        return "".join(parts)
+
+    def _record_call(
+        self,
+        duration: float,
+        outcome: str = "ok",
+        stream: bool = False,
+        ttft: Optional[float] = None,
+        usage: Any = None,
+    ) -> None:
+        """Метрики вызова LLM и атрибуты его спана."""
+        observe_llm_call(self.metrics_name, duration, outcome, stream, ttft, usage)
+        call_span = current_span()
+        if call_span.recording:
+            call_span.set(outcome=outcome, stream=stream)
+            if ttft is not None:
+                call_span.set(ttft_ms=round(ttft * 1000, 1))
+            if usage is not None:
+                call_span.set(
+                    prompt_tokens=usage.prompt_tokens,
+                    completion_tokens=usage.completion_tokens,
+                )
+
+    async def _create_json_completion(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        schema_name: str,
+        schema: Dict[str, Any],
+    ) -> str:
+        """
+        Вызов LLM, ответ которого — один JSON-объект (разбирается parse_json_object).
+        При LLM_STRUCTURED_OUTPUT схема передается через response_format,
+        и сервер ограничивает декодирование грамматикой схемы.
+        Ответ читается потоком до закрытия объекта (LLM_JSON_EARLY_STOP).
+        """
+        kwargs: Dict[str, Any] = {}
+        if settings.LLM_STRUCTURED_OUTPUT:
+            kwargs["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": schema_name, "schema": schema},
+            }
+        stop_when = JsonObjectScanner().feed if settings.LLM_JSON_EARLY_STOP else None
+
+        return await self._create_completion(
+            messages=messages, temperature=temperature, stop_when=stop_when, **kwargs
+        )
 
     def _log_prompt(self, agent_name: str, prompt: str):
         logger.debug(f"--- PROMPT FOR {agent_name} ---\n{prompt}\n----------------")
@@ -23,6 +388,8 @@ class BaseAgentService:
 
 
 class WorldDescriptorService(BaseAgentService):
+    CACHE_RESPONSES = True
+
     SYSTEM_PROMPT = """
 You are a Game Master's assistant.
 Your task is to read a JSON object representing the game's state and write a detailed, factual, human-readable summary of it.
@@ -40,25 +407,32 @@ Your task is to read a JSON object representing the game's state and write a det
 Your response MUST be ONLY the plain text description. Do not add titles or tags.
 """
 
-    def describe(self, game_state: GameState) -> str:
-        state_json = game_state.model_dump_json(indent=2)
+    TASK_PROMPT = """
+[YOUR TASK]
+Translate the JSON state from `[CURRENT JSON STATE]` into a detailed text description.
+You MUST use the `Wearing:` and `Holding:` headings to clearly separate clothing from held items.
+"""
+
+    PROMPT_SECTIONS = (
+        PromptSection("instructions", Stability.STATIC),
+        PromptSection("task", Stability.STATIC),
+        PromptSection("state", Stability.TURN, shrink=SHRINK_STATE_JSON),
+    )
+
+    async def describe(self, game_state: GameState) -> str:
+        state_json = render_state_json(game_state)
         agent_name = "AGENT 0: WORLD DESCRIPTOR"
-        prompt = f"[CURRENT JSON STATE]\n{state_json}\n\n[YOUR TASK]\nTranslate the JSON state above into a detailed text description.\nYou MUST use the `Wearing:` and `Holding:` headings to clearly separate clothing from held items."
+        messages = self._build_messages(
+            instructions=self.SYSTEM_PROMPT,
+            task=self.TASK_PROMPT,
+            state=f"[CURRENT JSON STATE]\n{state_json}",
+        )
 
-        self._log_prompt(agent_name, prompt)
+        self._log_prompt(agent_name, messages[-1]["content"])
 
         response = (
-            self.client.chat.completions.create(
-                model="local-model",
-                messages=[
-                    {"role": "system", "content": self.SYSTEM_PROMPT},
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=0.0,
-            )
-            .choices[0]
-            .message.content.strip()
-        )
+            await self._create_completion(messages=messages, temperature=0.0)
+        ).strip()
 
         self._log_response(agent_name, response)
         return response
@@ -66,7 +440,7 @@ Your response MUST be ONLY the plain text description. Do not add titles or tags
 
 class ActionSelectorService(BaseAgentService):
     SYSTEM_PROMPT = """
-You are {character_name}, a character in a role-playing game.
+You are a character in a role-playing game. Who you are is stated in `[YOUR CHARACTER]`.
 Your single task is to decide on your NEXT immediate physical action.
 *** CRITICAL ANALYSIS HIERARCHY ***
 Your decision-making MUST follow this strict order of priorities.
@@ -80,7 +454,7 @@ Your action MUST be a logical response to this interaction.
 1.  **MAINTAIN CONTINUITY:** Your primary focus is the `[LATEST USER ACTION]`, but you MUST consider the `[LAST TURN'S CHRONICLE]` and your `current_emotion` to ensure your action is emotionally consistent.
 Do not have emotional amnesia.
 2.  **THINK IN COMPLETE STEPS (NO MICRO-ACTIONS!)**:
-    * Your previous action was: `{last_ai_action}`.
+    * Your previous action is given in `[YOUR PREVIOUS ACTION]`.
 * You MUST choose a new, distinct, and significant action.
 * **CRITICAL FAILURE CONDITION**: Actions that are a slight variation or direct continuation of the previous one are FORBIDDEN.
 For example, a sequence like "start unbuttoning shirt" -> "continue unbuttoning shirt" is a CRITICAL FAILURE.
@@ -92,64 +466,79 @@ Inventing items is a CRITICAL FAILURE and is forbidden.
 DO NOT add any other text, explanations, or greetings.
 """
 
-    def select_action(
+    TASK_PROMPT = """
+[YOUR TASK]
+Follow your CRITICAL ANALYSIS HIERARCHY and CRITICAL RULES.
+Your highest priority is reacting appropriately to the LATEST user action, while maintaining emotional continuity with past events.
+State your new action as a concise command phrase.
+"""
+
+    # Сцена остается целиком (из ее объектов выбирается действие),
+    # персонажи отбираются по упоминаниям, в том числе в цели
+    CONTEXT_POLICY = ContextPolicy(
+        trim_fields=("knowledge", "relationships", "clothing", "inventory"),
+        keep_all_objects=True,
+        goal_references=True,
+    )
+
+    PROMPT_SECTIONS = (
+        PromptSection("instructions", Stability.STATIC),
+        PromptSection("task", Stability.STATIC),
+        PromptSection("character", Stability.SESSION),
+        PromptSection("goal", Stability.TURN),
+        PromptSection("scene", Stability.TURN, 3, SHRINK_TEXT),
+        PromptSection("characters", Stability.TURN, 2, SHRINK_TEXT),
+        PromptSection("memories", Stability.TURN, 0, SHRINK_CHRONICLE),
+        PromptSection("chronicle", Stability.TURN, 1, SHRINK_CHRONICLE),
+        PromptSection("previous_action", Stability.TURN),
+        PromptSection("user_action", Stability.TURN),
+    )
+
+    async def select_action(
         self,
         game_state: GameState,
         ai_character_name: str,
         user_input: str,
         last_ai_action: str,
         last_turn_chronicle: str,
+        past_events: Optional[List[str]] = None,
     ) -> str:
         agent_name = "AGENT 1.1: ACTION SELECTOR"
 
         # Prepare context using helper functions
-        scene_context = get_scene_context(game_state)
-        characters_snapshot = get_characters_snapshot(game_state)
+        context = self._prune_context(
+            game_state,
+            [ai_character_name],
+            user_input,
+            last_ai_action,
+            last_turn_chronicle,
+        )
+        scene_context = get_scene_context(context.state)
+        characters_snapshot = get_characters_snapshot(context.state)
 
         char_data = game_state.characters.get(ai_character_name)
         current_goal = char_data.goal if char_data else "No goal"
 
-        prompt = f"""
-[LAST TURN'S CHRONICLE]
-This is what happened right before the user's latest action: "{last_turn_chronicle}"
-
-[SCENE CONTEXT]
-{scene_context}
-
-[CHARACTERS SNAPSHOT]
-{characters_snapshot}
-
-[LATEST USER ACTION]
-The other character just did this: "{user_input}"
-
-[YOUR GOAL]
-Your current personal background goal is: "{current_goal}".
-[YOUR PREVIOUS ACTION]
-Your last action was: "{last_ai_action}"
-
-[YOUR TASK]
-Follow your CRITICAL ANALYSIS HIERARCHY and CRITICAL RULES.
-Your highest priority is reacting appropriately to the LATEST user action, while maintaining emotional continuity with past events.
-State your new action as a concise command phrase.
-"""
-        self._log_prompt(agent_name, prompt)
-
-        system_msg = self.SYSTEM_PROMPT.format(
-            character_name=ai_character_name, last_ai_action=last_ai_action
+        messages = self._build_messages(
+            instructions=self.SYSTEM_PROMPT,
+            task=self.TASK_PROMPT,
+            character=f"[YOUR CHARACTER]\nYou are {ai_character_name}.",
+            goal=f'[YOUR GOAL]\nYour current personal background goal is: "{current_goal}".',
+            scene=f"[SCENE CONTEXT]\n{scene_context}",
+            characters=f"[CHARACTERS SNAPSHOT]\n{characters_snapshot}",
+            memories=format_past_events(past_events),
+            chronicle=(
+                "[LAST TURN'S CHRONICLE]\n"
+                f'This is what happened right before the user\'s latest action: "{last_turn_chronicle}"'
+            ),
+            previous_action=f'[YOUR PREVIOUS ACTION]\nYour last action was: "{last_ai_action}"',
+            user_action=f'[LATEST USER ACTION]\nThe other character just did this: "{user_input}"',
         )
+        self._log_prompt(agent_name, messages[-1]["content"])
 
         response = (
-            self.client.chat.completions.create(
-                model="local-model",
-                messages=[
-                    {"role": "system", "content": system_msg},
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=0.7,
-            )
-            .choices[0]
-            .message.content.strip()
-        )
+            await self._create_completion(messages=messages, temperature=0.7)
+        ).strip()
 
         self._log_response(agent_name, response)
         return response
@@ -157,7 +546,7 @@ State your new action as a concise command phrase.
 
 class MotivationGeneratorService(BaseAgentService):
     SYSTEM_PROMPT = """
-You are {character_name}, a character in a role-playing game.
+You are a character in a role-playing game. Who you are is stated in `[YOUR CHARACTER]`.
 Your single task is to explain your reasoning (motivation) for a specific action that has already been decided for you.
 *** CRITICAL ANALYSIS ALGORITHM ***
 1.  **Analyze the Action:** Look at the `[PLANNED ACTION]` you have been given.
@@ -169,7 +558,25 @@ Your single task is to explain your reasoning (motivation) for a specific action
 Your response MUST be ONLY the text of the motivation.
 """
 
-    def generate_motivation(
+    TASK_PROMPT = """
+[YOUR TASK]
+Explain your motivation.
+If it's a reaction, explain the reaction. If it's not a reaction, explain how it serves your goal.
+Your response must be only the explanation.
+"""
+
+    CONTEXT_POLICY = ContextPolicy(goal_references=True)
+
+    PROMPT_SECTIONS = (
+        PromptSection("instructions", Stability.STATIC),
+        PromptSection("task", Stability.STATIC),
+        PromptSection("character", Stability.SESSION),
+        PromptSection("state", Stability.TURN, shrink=SHRINK_STATE_JSON),
+        PromptSection("user_action", Stability.TURN),
+        PromptSection("context", Stability.TURN),
+    )
+
+    async def generate_motivation(
         self,
         game_state: GameState,
         ai_character_name: str,
@@ -177,55 +584,46 @@ Your response MUST be ONLY the text of the motivation.
         user_input: str,
     ) -> str:
         agent_name = "AGENT 1.2: MOTIVATION GENERATOR"
-        state_json = game_state.model_dump_json(indent=2)
+        context = self._prune_context(
+            game_state, [ai_character_name], planned_action, user_input
+        )
+        state_json = render_state_json(context.state)
 
         char_data = game_state.characters.get(ai_character_name)
         current_goal = char_data.goal if char_data else "No goal"
 
-        prompt = f"""
-[CURRENT JSON]
-{state_json}
-
-[USER'S ACTION]
-The other character just did this: "{user_input}"
-
-[CONTEXT]
-Your current goal is: "{current_goal}".
-The action you have decided to take in response is: "{planned_action}".
-
-[YOUR TASK]
-Explain your motivation.
-If it's a reaction, explain the reaction. If it's not a reaction, explain how it serves your goal.
-Your response must be only the explanation.
-"""
-        self._log_prompt(agent_name, prompt)
+        messages = self._build_messages(
+            instructions=self.SYSTEM_PROMPT,
+            task=self.TASK_PROMPT,
+            character=f"[YOUR CHARACTER]\nYou are {ai_character_name}.",
+            state=f"[CURRENT JSON]\n{state_json}",
+            user_action=f'[USER\'S ACTION]\nThe other character just did this: "{user_input}"',
+            context=(
+                "[CONTEXT]\n"
+                f'Your current goal is: "{current_goal}".\n'
+                f'The action you have decided to take in response is: "{planned_action}".'
+            ),
+        )
+        self._log_prompt(agent_name, messages[-1]["content"])
 
         response = (
-            self.client.chat.completions.create(
-                model="local-model",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": self.SYSTEM_PROMPT.format(
-                            character_name=ai_character_name
-                        ),
-                    },
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=0.7,
-            )
-            .choices[0]
-            .message.content.strip()
-        )
+            await self._create_completion(messages=messages, temperature=0.7)
+        ).strip()
 
         self._log_response(agent_name, response)
         return response
 
 
 class ActionConsequenceService(BaseAgentService):
+    CACHE_RESPONSES = True
+
+    # Ответ проверяется по отобранному контексту: изменения того, что агент
+    # не видел, повторяются по полному состоянию
+    CONTEXT_POLICY = ContextPolicy()
+
     SYSTEM_PROMPT = """
 *** CRITICAL ANALYSIS ALGORITHM ***
-1.  **Analyze the Action**: Based on the `[PLANNED ACTION]` for `{character_name}`, determine the direct, immediate consequences.
+1.  **Analyze the Action**: Based on the `[PLANNED ACTION]` for the acting character, determine the direct, immediate consequences.
 2.  **CRITICAL CHECK: VERIFY OBJECT EXISTENCE**: Identify the primary object of the action (e.g., for "pick up the knife", the object is "knife").
 You MUST verify that this object exists in the `[CURRENT JSON STATE]` (in `clothing`, `holding`, `inventory`, or `scene.interactive_objects`).
 Do not invent items.
@@ -241,47 +639,62 @@ For lists (like `current_emotion` or `holding`), you must provide the **complete
 Your response MUST be a single valid JSON object containing "state_changes" (a JSON object with the updates) and "completed_actions" (a list of strings).
 """
 
-    def determine_consequences(
+    TASK_PROMPT = """
+[YOUR TASK]
+Deconstruct the action for the acting character named in `[PLANNED ACTION FOR ...]` and generate the `state_changes` (as a JSON object) and `completed_actions` lists according to your critical rules.
+"""
+
+    PROMPT_SECTIONS = (
+        PromptSection("instructions", Stability.STATIC),
+        PromptSection("task", Stability.STATIC),
+        PromptSection("state", Stability.TURN, shrink=SHRINK_STATE_JSON),
+        PromptSection("planned_action", Stability.CALL),
+    )
+
+    async def determine_consequences(
         self, game_state: GameState, planned_action: str, character_name: str
     ) -> Tuple[Dict[str, Any], List[str]]:
-        agent_name = f"AGENT 3: ACTION CONSEQUENCE (for {character_name})"
-        state_json = game_state.model_dump_json(indent=2)
+        context = self._prune_context(game_state, [character_name], planned_action)
+        state_changes, completed_actions = await self._determine(
+            context.state, planned_action, character_name
+        )
+        if not context.pruned:
+            return state_changes, completed_actions
+
+        reason = context.check_changes(state_changes)
+        if reason is not None:
+            logger.warning(
+                f"ActionConsequenceService: answer for the pruned context {reason}, "
+                f"retrying with the full state."
+            )
+            CONTEXT_PRUNING.inc(agent=self.metrics_name, outcome="fallback")
+            return await self._determine(game_state, planned_action, character_name)
+        return context.expand_changes(state_changes), completed_actions
 
-        prompt = f"""
-[CURRENT JSON STATE]
-{state_json}
+    async def _determine(
+        self, game_state: GameState, planned_action: str, character_name: str
+    ) -> Tuple[Dict[str, Any], List[str]]:
+        agent_name = f"AGENT 3: ACTION CONSEQUENCE (for {character_name})"
+        state_json = render_state_json(game_state)
 
-[PLANNED ACTION FOR {character_name}]
-{planned_action}
+        messages = self._build_messages(
+            instructions=self.SYSTEM_PROMPT,
+            task=self.TASK_PROMPT,
+            state=f"[CURRENT JSON STATE]\n{state_json}",
+            planned_action=f"[PLANNED ACTION FOR {character_name}]\n{planned_action}",
+        )
+        self._log_prompt(agent_name, messages[-1]["content"])
 
-[YOUR TASK]
-Deconstruct the action for `{character_name}` and generate the `state_changes` (as a JSON object) and `completed_actions` lists according to your critical rules.
-"""
-        self._log_prompt(agent_name, prompt)
-
-        response = self.client.chat.completions.create(
-            model="local-model",
-            messages=[
-                {
-                    "role": "system",
-                    "content": self.SYSTEM_PROMPT.format(character_name=character_name),
-                },
-                {"role": "user", "content": prompt},
-            ],
+        response_text = await self._create_json_completion(
+            messages=messages,
             temperature=0.0,
+            schema_name="action_consequence",
+            schema=ACTION_CONSEQUENCE_SCHEMA,
         )
-        response_text = response.choices[0].message.content
         self._log_response(agent_name, response_text)
 
         try:
-            json_match = re.search(r"\{.*\}", response_text, re.DOTALL)
-            if json_match:
-                clean_json_str = json_match.group(0)
-                clean_json_str = re.sub(r",\s*([\}\]])", r"\1", clean_json_str)
-                result = json.loads(clean_json_str)
-            else:
-                raise ValueError("No JSON object found")
-
+            result = parse_json_object(response_text)
             state_changes = result.get("state_changes", {})
             completed_actions = result.get("completed_actions", [])
             return state_changes, completed_actions
@@ -292,10 +705,10 @@ Deconstruct the action for `{character_name}` and generate the `state_changes` (
 
 class StoryWriterService(BaseAgentService):
     SYSTEM_PROMPT = """
-You are the character {character_name} in a role-playing game.
+You are a character in a role-playing game. Who you are is stated in `[YOUR CHARACTER]`.
 Your task is to write a story segment from your first-person perspective based on the current situation.
 *** CRITICAL RULES ***
-1.  **FIRST-PERSON ONLY**: Your entire response MUST be written from the "I" perspective of {character_name}.
+1.  **FIRST-PERSON ONLY**: Your entire response MUST be written from the "I" perspective of your character.
 2.  **DESCRIBE THE PRESENT**: Your story must describe the events of the current turn.
 Start by describing the other character's action (`[USER'S ACTION]`) and then describe your own reaction based on your `[COMPLETED ACTIONS]` and `[MOTIVATION FOR THE ACTIONS]`.
 3.  **INCLUDE DIALOGUE**: If your planned action is verbal, turn it into natural dialogue.
@@ -303,10 +716,33 @@ Start by describing the other character's action (`[USER'S ACTION]`) and then de
 5.  **NO TAGS**: Do not include any tags like [STORY] or character names as headers. Just write the story text.
 6.  **DO NOT REPEAT**: Do not repeat events that are already described in the `[LAST TURN'S CHRONICLE]`.
 7.  **ABSOLUTE GROUNDING RULE**: You MUST NOT invent or mention any object, item, or piece of clothing that is NOT explicitly listed in the [CURRENT JSON] context.
-8.  **NO DIALOGUE FOR OTHERS**: You can ONLY write dialogue for yourself, {character_name}.
+8.  **NO DIALOGUE FOR OTHERS**: You can ONLY write dialogue for yourself, your character.
+"""
+
+    TASK_PROMPT = """
+[YOUR TASK]
+Write a narrative story segment that smoothly continues from the last turn's chronicle.
+Describe your character performing all actions from the script as a reaction to the user's action.
+Enrich the description with atmospheric details, but do not add new significant physical actions.
+If `[REVISION INSTRUCTIONS]` are present, your previous story was rejected: fix the stated error.
 """
 
-    def write_story(
+    CONTEXT_POLICY = ContextPolicy()
+
+    PROMPT_SECTIONS = (
+        PromptSection("instructions", Stability.STATIC),
+        PromptSection("task", Stability.STATIC),
+        PromptSection("character", Stability.SESSION),
+        PromptSection("memories", Stability.TURN, 0, SHRINK_CHRONICLE),
+        PromptSection("chronicle", Stability.TURN, 1, SHRINK_CHRONICLE),
+        PromptSection("state", Stability.TURN, 2, SHRINK_STATE_JSON),
+        PromptSection("user_action", Stability.TURN),
+        PromptSection("motivation", Stability.TURN, 3, SHRINK_TEXT),
+        PromptSection("actions", Stability.TURN),
+        PromptSection("revision", Stability.CALL),
+    )
+
+    async def write_story(
         self,
         game_state: GameState,
         ai_character_name: str,
@@ -316,67 +752,65 @@ Start by describing the other character's action (`[USER'S ACTION]`) and then de
         user_input: str,
         last_turn_chronicle: str,
         revision_feedback: Optional[str] = None,
+        on_token: Optional[TokenCallback] = None,
+        past_events: Optional[List[str]] = None,
     ) -> str:
         agent_name = "AGENT 4: STORY WRITER"
         if revision_feedback:
             agent_name += " (REVISION)"
 
-        state_json = game_state.model_dump_json(indent=2)
         actions_str = "\n".join(completed_actions)
+        # Замечания верификатора не участвуют в отборе: иначе [CURRENT JSON]
+        # повторной попытки отличался бы от первой и ломал общий префикс
+        context = self._prune_context(
+            game_state,
+            [ai_character_name, user_character_name],
+            user_input,
+            motivation,
+            actions_str,
+            last_turn_chronicle,
+        )
+        state_json = render_state_json(context.state)
 
-        revision_section = ""
+        # Замечания верификатора идут в самом конце: повторная попытка
+        # переиспользует весь префикс первой
+        revision_section = None
         if revision_feedback:
-            revision_section = f"\n[REVISION INSTRUCTIONS]\nYour previous story was rejected.\nYou MUST rewrite it to fix the following error.\nREASON: {revision_feedback}\n"
-
-        prompt = f"""
-{revision_section}
-[LAST TURN'S CHRONICLE]
-{last_turn_chronicle}
-
-[CURRENT JSON]
-{state_json}
-
-[USER'S ACTION]
-{user_input}
-
-[MOTIVATION FOR THE ACTIONS]
-{motivation}
-
-[COMPLETED ACTIONS] (Your script to follow)
-{actions_str}
-
-[YOUR TASK]
-Write a narrative story segment that smoothly continues from the last turn's chronicle.
-Describe your character performing all actions from the script as a reaction to the user's action.
-Enrich the description with atmospheric details, but do not add new significant physical actions.
-"""
-        self._log_prompt(agent_name, prompt)
+            revision_section = f"[REVISION INSTRUCTIONS]\nYour previous story was rejected.\nYou MUST rewrite it to fix the following error.\nREASON: {revision_feedback}"
+
+        messages = self._build_messages(
+            instructions=self.SYSTEM_PROMPT,
+            task=self.TASK_PROMPT,
+            character=(
+                f"[YOUR CHARACTER]\nYou are {ai_character_name}. "
+                f"The other character is {user_character_name}."
+            ),
+            memories=format_past_events(past_events),
+            chronicle=f"[LAST TURN'S CHRONICLE]\n{last_turn_chronicle}",
+            state=f"[CURRENT JSON]\n{state_json}",
+            user_action=f"[USER'S ACTION]\n{user_input}",
+            motivation=f"[MOTIVATION FOR THE ACTIONS]\n{motivation}",
+            actions=f"[COMPLETED ACTIONS] (Your script to follow)\n{actions_str}",
+            revision=revision_section,
+        )
+        self._log_prompt(agent_name, messages[-1]["content"])
 
         response = (
-            self.client.chat.completions.create(
-                model="local-model",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": self.SYSTEM_PROMPT.format(
-                            character_name=ai_character_name,
-                            user_character_name=user_character_name,
-                        ),
-                    },
-                    {"role": "user", "content": prompt},
-                ],
+            await self._create_completion(
+                messages=messages,
                 temperature=0.8,
+                on_token=on_token,
                 extra_body={"repetition_penalty": 1.1},
             )
-            .choices[0]
-            .message.content.strip()
-        )
+        ).strip()
 
         self._log_response(agent_name, response)
         return response
 
 
 class StoryVerifierService(BaseAgentService):
+    CACHE_RESPONSES = True
+
     SYSTEM_PROMPT = """
 You are a meticulous verification engine.
 Your task is to compare a narrative story against a required script of actions.
@@ -397,45 +831,75 @@ Your response MUST be a single, valid JSON object.
 - If it fails: `{"result": "FAIL", "reason": "A clear, concise explanation of the failure."}`
 """
 
-    def verify(self, completed_actions: List[str], story_text: str) -> Tuple[bool, str]:
-        agent_name = "AGENT 4.5: STORY VERIFIER"
-        actions_str = "\n".join(completed_actions)
-        prompt = f"""
-[COMPLETED ACTIONS] (Script)
-{actions_str}
-
-[STORY TEXT] (To Verify)
-{story_text}
-
+    TASK_PROMPT = """
 [YOUR TASK]
 Compare the script against the story text.
 Ensure ALL script actions are present and NO major extraneous actions or objects have been added.
 Provide your verification result in the specified JSON format.
 """
-        self._log_prompt(agent_name, prompt)
 
-        response = self.client.chat.completions.create(
-            model="local-model",
-            messages=[
-                {"role": "system", "content": self.SYSTEM_PROMPT},
-                {"role": "user", "content": prompt},
-            ],
+    # Ответ верификатора — короткий JSON; историю сокращать нельзя
+    GENERATION_RESERVE = 256
+
+    PROMPT_SECTIONS = (
+        PromptSection("instructions", Stability.STATIC),
+        PromptSection("task", Stability.STATIC),
+        PromptSection("actions", Stability.TURN),
+        PromptSection("story", Stability.CALL),
+    )
+
+    def __init__(
+        self,
+        client: AsyncOpenAI,
+        response_cache: Optional[ResponseCache] = None,
+        preverifier: Optional[StoryPreVerifier] = None,
+        dispatcher: Optional[LLMBatchDispatcher] = None,
+    ):
+        super().__init__(client, response_cache, dispatcher)
+        self.preverifier = preverifier
+
+    async def verify(
+        self,
+        completed_actions: List[str],
+        story_text: str,
+        game_state: Optional[GameState] = None,
+    ) -> Tuple[bool, str]:
+        agent_name = "AGENT 4.5: STORY VERIFIER"
+        # Сначала локальная проверка: LLM вызывается только в спорных случаях
+        if self.preverifier is not None:
+            local = self.preverifier.check(completed_actions, story_text, game_state)
+            if local is not None:
+                logger.info(f"{agent_name}: local verdict {local}")
+                STORY_VERDICTS.inc(
+                    source="preverifier", verdict="pass" if local[0] else "fail"
+                )
+                return local
+        actions_str = "\n".join(completed_actions)
+        messages = self._build_messages(
+            instructions=self.SYSTEM_PROMPT,
+            task=self.TASK_PROMPT,
+            actions=f"[COMPLETED ACTIONS] (Script)\n{actions_str}",
+            story=f"[STORY TEXT] (To Verify)\n{story_text}",
+        )
+        self._log_prompt(agent_name, messages[-1]["content"])
+
+        response_text = await self._create_json_completion(
+            messages=messages,
             temperature=0.0,
+            schema_name="story_verification",
+            schema=STORY_VERIFICATION_SCHEMA,
         )
-        response_text = response.choices[0].message.content
         self._log_response(agent_name, response_text)
 
         try:
-            if "```json" in response_text:
-                response_text = response_text.split("```json")[1].split("```")[0]
-            elif "```" in response_text:
-                response_text = response_text.split("```")[1].split("```")[0]
-
-            result = json.loads(response_text)
+            result = parse_json_object(response_text)
             if result.get("result") == "PASS":
+                STORY_VERDICTS.inc(source="llm", verdict="pass")
                 return True, "Verified successfully."
             else:
+                STORY_VERDICTS.inc(source="llm", verdict="fail")
                 return False, result.get("reason", "Unknown reason")
         except Exception as e:
             logger.error(f"StoryVerifierService Error: {e}")
+            STORY_VERDICTS.inc(source="llm", verdict="invalid")
             return False, "Verifier failed to return valid JSON."
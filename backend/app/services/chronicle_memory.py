@@ -0,0 +1,169 @@
+import logging
+import math
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, Tuple
+from app.core.text_stems import content_stems
+from app.core.token_budget import token_counter
+from app.storage import Storage
+
+logger = logging.getLogger(__name__)
+
+# Параметры BM25
+_K1 = 1.5
+_B = 0.75
+
+# Записи с оценкой ниже этой доли от лучшей совпали лишь случайными словами
+_MIN_RELATIVE_SCORE = 0.3
+
+# Записи при перестройке индекса читаются из хранилища пачками
+_REBUILD_BATCH = 512
+
+
+class _SessionIndex:
+    """Инвертированный индекс записей хронологии одной сессии."""
+
+    __slots__ = ("postings", "lengths", "total_length", "lock")
+
+    def __init__(self):
+        # Индекс меняется и читается только под своей блокировкой:
+        # построение индекса одной сессии не задерживает другие
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        # Основа слова -> {номер записи: частота в записи}
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.lengths: List[int] = []
+        self.total_length = 0
+
+    def add(self, text: str) -> None:
+        doc = len(self.lengths)
+        terms = Counter(content_stems(text))
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[doc] = tf
+        length = sum(terms.values())
+        self.lengths.append(length)
+        self.total_length += length
+
+    def search(self, query: str, stop: int) -> List[int]:
+        """Номера записей [0, stop) по убыванию BM25-оценки (только заметно совпавшие)."""
+        n = len(self.lengths)
+        if not n:
+            return []
+        avg_length = self.total_length / n or 1.0
+        scores: Dict[int, float] = {}
+        for term in set(content_stems(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc, tf in postings.items():
+                if doc >= stop:
+                    continue
+                norm = _K1 * (1 - _B + _B * self.lengths[doc] / avg_length)
+                scores[doc] = scores.get(doc, 0.0) + idf * tf * (_K1 + 1) / (tf + norm)
+        if not scores:
+            return []
+        cutoff = max(scores.values()) * _MIN_RELATIVE_SCORE
+        return sorted(
+            (doc for doc, score in scores.items() if score >= cutoff),
+            key=lambda doc: (-scores[doc], -doc),
+        )
+
+
+class ChronicleMemory:
+    """
+    Долгосрочная память: локальный BM25-индекс записей хронологии ходов.
+    Последняя запись и так попадает в промпты; из более старых по вводу
+    игрока и выбранному действию отбираются top_k самых релевантных
+    в пределах бюджета токенов. Без эмбеддингов и сетевых вызовов.
+
+    Индекс обновляется инкрементально после каждой записи хода (sync)
+    и строится из хранилища при первом обращении к сессии — например,
+    после перезапуска. Индексы хранятся для max_sessions последних сессий.
+    Методы синхронные (чтение хранилища) и вызываются через asyncio.to_thread.
+    """
+
+    def __init__(self, storage: Storage, max_sessions: int):
+        self.storage = storage
+        self.max_sessions = max_sessions
+        self._indexes: "OrderedDict[str, _SessionIndex]" = OrderedDict()
+        # Короткая блокировка только для словаря индексов
+        self._lock = threading.Lock()
+
+    def sync(self, session_id: str) -> None:
+        """Добавляет в индекс записи хронологии, которых в нем еще нет."""
+        index = self._session_index(session_id)
+        with index.lock:
+            self._sync(session_id, index)
+
+    def recall(
+        self, session_id: str, query: str, top_k: int, max_tokens: int
+    ) -> List[str]:
+        """
+        Прошлые записи, релевантные запросу, в хронологическом порядке.
+        Последняя запись хронологии не возвращается.
+        """
+        if top_k <= 0 or not query.strip():
+            return []
+        index = self._session_index(session_id)
+        with index.lock:
+            self._sync(session_id, index)
+            docs = index.search(query, stop=len(index.lengths) - 1)
+        if not docs:
+            return []
+        store = self.storage.chronology(session_id)
+        # Одинаковые записи (повторяющиеся ходы) не дублируются,
+        # в том числе с последней записью, которая уже есть в промпте
+        seen = set(store.tail(1))
+        picked: List[Tuple[int, str]] = []
+        used = 0
+        for doc in docs:
+            entries = store.entries(doc, doc + 1)
+            if not entries or entries[0] in seen:
+                continue
+            seen.add(entries[0])
+            tokens = token_counter.count(entries[0])
+            if used + tokens > max_tokens:
+                continue
+            picked.append((doc, entries[0]))
+            used += tokens
+            if len(picked) >= top_k:
+                break
+        return [text for _, text in sorted(picked)]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "sessions": len(self._indexes),
+                "entries": sum(len(i.lengths) for i in self._indexes.values()),
+            }
+
+    def _session_index(self, session_id: str) -> _SessionIndex:
+        with self._lock:
+            index = self._indexes.get(session_id)
+            if index is None:
+                index = self._indexes[session_id] = _SessionIndex()
+            self._indexes.move_to_end(session_id)
+            # Вытесненный индекс достраивает тот, кто его уже получил;
+            # следующее обращение к сессии построит новый
+            while len(self._indexes) > self.max_sessions:
+                self._indexes.popitem(last=False)
+            return index
+
+    def _sync(self, session_id: str, index: _SessionIndex) -> None:
+        """Дописывает в индекс новые записи. Вызывается под index.lock."""
+        store = self.storage.chronology(session_id)
+        total = store.count()
+        if len(index.lengths) > total:
+            # Переписанная хронология
+            index.reset()
+        if not index.lengths and total:
+            logger.info(
+                f"Building chronicle index of '{session_id}' ({total} entries)."
+            )
+
+        for start in range(len(index.lengths), total, _REBUILD_BATCH):
+            for entry in store.entries(start, min(total, start + _REBUILD_BATCH)):
+                index.add(entry)
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from app.core.tracing import AnySpan, current_span, span
+
+logger = logging.getLogger(__name__)
+
+ChronicleJob = Callable[[], Awaitable[None]]
+_QueuedJob = Tuple[ChronicleJob, AnySpan]
+# Очередь задач одного вида одной сессии: (session_id, имя задачи)
+_Lane = Tuple[str, str]
+
+
+class ChronicleJobQueue:
+    """
+    Фоновая очередь задач хронологии (саммари хода, сжатие).
+    Задачи одного вида одной сессии выполняются строго по порядку поступления;
+    разные виды задач и разные сессии — независимо друг от друга, так что
+    долгое сжатие не задерживает саммари, которого ждет следующий ход.
+    Воркер очереди создается по требованию и завершается, когда она пуста.
+    """
+
+    def __init__(self):
+        self._queues: Dict[_Lane, asyncio.Queue[_QueuedJob]] = {}
+        self._workers: Dict[_Lane, asyncio.Task] = {}
+        self._closed = False
+
+    def submit(self, session_id: str, name: str, job: ChronicleJob) -> None:
+        """Ставит задачу в очередь сессии. Результат не ожидается."""
+        if self._closed:
+            raise RuntimeError("Chronicle job queue is shut down.")
+
+        lane = (session_id, name)
+        queue = self._queues.get(lane)
+        if queue is None:
+            queue = asyncio.Queue()
+            self._queues[lane] = queue
+        # Спан задачи станет дочерним для спана, в котором она поставлена
+        # (обычно — хода), хотя выполнится уже после его завершения
+        queue.put_nowait((job, current_span()))
+
+        worker = self._workers.get(lane)
+        if worker is None or worker.done():
+            self._workers[lane] = asyncio.create_task(self._run_worker(lane, queue))
+
+    def pending(self, session_id: str, name: Optional[str] = None) -> int:
+        return sum(
+            queue.qsize()
+            for (sid, job_name), queue in list(self._queues.items())
+            if sid == session_id and name in (None, job_name)
+        )
+
+    async def wait_idle(self, session_id: str, name: Optional[str] = None) -> None:
+        """
+        Ждет завершения уже поставленных задач сессии: только задач name,
+        если оно указано, иначе всех.
+        """
+        for (sid, job_name), queue in list(self._queues.items()):
+            if sid == session_id and name in (None, job_name):
+                await queue.join()
+
+    async def shutdown(self) -> None:
+        """Дожидается выполнения всех задач и останавливает прием новых."""
+        self._closed = True
+        for queue in list(self._queues.values()):
+            await queue.join()
+
+    async def _run_worker(self, lane: _Lane, queue: asyncio.Queue[_QueuedJob]) -> None:
+        session_id, name = lane
+        while True:
+            try:
+                job, parent = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            try:
+                with span(f"chronicle.{name}", parent=parent, session_id=session_id):
+                    await job()
+            except Exception as e:
+                logger.error(
+                    f"Chronicle job '{name}' failed for session '{session_id}': {e}",
+                    exc_info=True,
+                )
+            finally:
+                queue.task_done()
+
+        # Очередь пуста: освобождаем ресурсы
+        if self._queues.get(lane) is queue and queue.empty():
+            del self._queues[lane]
+            self._workers.pop(lane, None)
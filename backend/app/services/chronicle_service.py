@@ -1,7 +1,14 @@
-import os
+import asyncio
 import logging
-from openai import OpenAI
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from openai import AsyncOpenAI
 from app.core.config import settings
+from app.core.metrics import observe_llm_call
+from app.core.token_budget import BudgetSection, ShrinkPolicy, Truncate, fit_prompt
+from app.core.tracing import span
+from app.services.chronicle_memory import ChronicleMemory
+from app.storage import ChronologyLog, Storage
 
 logger = logging.getLogger(__name__)
 
@@ -34,48 +41,72 @@ You are a scriptwriter and editor. Your task is to take a raw game log, which in
 5.  **BE CONCISE**: The final text must be significantly shorter than the original.
 """
 
-    def __init__(self, client: OpenAI):
+    SYSTEM_PROMPT_ERA_MERGER = """
+You are a chronicler. You will receive several consecutive summaries of parts of a role-playing story.
+Your task is to merge them into one summary of this whole era of the story.
+*** CRITICAL RULES ***
+1.  **PRESERVE KEY FACTS**: Keep the key events, decisions, changes in relationships and the fate of important objects, in chronological order.
+2.  **THIRD-PERSON PERSPECTIVE**: The summary must be told from a third-person point of view.
+3.  **NO TAGS**: Output only the summary text, without headings or tags.
+4.  **BE CONCISE**: The result must be shorter than the combined input.
+"""
+
+    def __init__(
+        self,
+        client: AsyncOpenAI,
+        storage: Storage,
+        memory: Optional[ChronicleMemory] = None,
+    ):
         self.client = client
-        self.file_path = settings.CHRONOLOGY_FILE_PATH
+        self.storage = storage
+        # Индекс для поиска релевантных прошлых событий (None — отключен)
+        self.memory = memory
 
-    def _read_file(self) -> str:
-        if not os.path.exists(self.file_path):
-            return ""
-        try:
-            with open(self.file_path, "r", encoding="utf-8") as f:
-                return f.read()
-        except Exception as e:
-            logger.error(f"Error reading chronology file: {e}")
-            return ""
+    def _store(self, session_id: str) -> ChronologyLog:
+        return self.storage.chronology(session_id)
 
-    def _append_to_file(self, text: str):
-        try:
-            with open(self.file_path, "a", encoding="utf-8") as f:
-                f.write(text + "\n")
-        except Exception as e:
-            logger.error(f"Error appending to chronology file: {e}")
+    def get_last_turn_chronicle(self, session_id: str) -> str:
+        """Возвращает последнюю запись (абзац) из хронологии сессии."""
+        last = self._store(session_id).tail(1)
+        return last[0] if last else "This is the first turn of the story."
 
-    def _overwrite_file(self, text: str):
+    def _append_entry(self, session_id: str, text: str):
         try:
-            with open(self.file_path, "w", encoding="utf-8") as f:
-                f.write(text.strip() + "\n")
+            self._store(session_id).append(text)
         except Exception as e:
-            logger.error(f"Error overwriting chronology file: {e}")
-
-    def get_full_chronology(self) -> str:
-        return self._read_file()
+            logger.error(f"Error appending to chronology: {e}")
+            return
+        if self.memory is not None:
+            try:
+                self.memory.sync(session_id)
+            except Exception as e:
+                logger.error(f"Error updating chronicle index: {e}")
 
-    def get_last_turn_chronicle(self) -> str:
-        """Возвращает последнюю запись (абзац) из хронологии."""
-        content = self._read_file().strip()
-        if not content:
-            return "This is the first turn of the story."
-        # Предполагаем, что записи разделены переводами строк. Берем последний непустой блок.
-        lines = [line for line in content.split("\n") if line.strip()]
-        return lines[-1] if lines else "This is the first turn of the story."
+    async def recall(self, session_id: str, query: str) -> List[str]:
+        """
+        Прошлые записи хронологии (кроме последней), релевантные запросу,
+        в пределах CHRONICLE_RECALL_MAX_TOKENS.
+        """
+        if self.memory is None:
+            return []
+        with span("chronicle.recall", query_chars=len(query)) as recall_span:
+            try:
+                events = await asyncio.to_thread(
+                    self.memory.recall,
+                    session_id,
+                    query,
+                    settings.CHRONICLE_RECALL_TOP_K,
+                    settings.CHRONICLE_RECALL_MAX_TOKENS,
+                )
+            except Exception as e:
+                logger.error(f"Chronicle recall failed: {e}")
+                return []
+            recall_span.set(events=len(events))
+            return events
 
-    def create_turn_summary(
+    async def create_turn_summary(
         self,
+        session_id: str,
         user_char_name: str,
         user_action: str,
         ai_char_name: str,
@@ -93,41 +124,199 @@ Create a concise, third-person narrative summary.
 - AI Character ({ai_char_name}) Resulting Story: "{cleaned_ai_story}"
 """
         try:
-            completion = self.client.chat.completions.create(
-                model="local-model",
-                messages=[
-                    {"role": "system", "content": self.SYSTEM_PROMPT_CHRONICLER},
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=0.2,
+            summary = await self._complete(
+                "chronicler", self.SYSTEM_PROMPT_CHRONICLER, prompt, 0.2
             )
-            summary = completion.choices[0].message.content.strip()
-            self._append_to_file(summary)
+            await asyncio.to_thread(self._append_entry, session_id, summary)
             return summary
         except Exception as e:
             logger.error(f"Failed to create turn summary: {e}")
             fallback = f"{user_char_name} did {user_action}. {ai_char_name} reacted."
-            self._append_to_file(fallback)
+            await asyncio.to_thread(self._append_entry, session_id, fallback)
             return fallback
 
-    def summarize_if_needed(self, word_limit=6000):
-        """Проверяет размер хронологии и сжимает ее при необходимости."""
-        text = self._read_file()
-        word_count = len(text.split())
+    # --- Durable turn summaries ---
+    #
+    # Саммари хода пишется в фоне. Чтобы оно не потерялось при перезапуске,
+    # его входные данные сохраняются в хранилище до ответа клиенту и удаляются
+    # после записи; оставшиеся после сбоя генерируются перед следующим ходом.
+
+    def save_pending_summary(self, session_id: str, job: Dict[str, Any]) -> int:
+        """
+        Сохраняет данные саммари (аргументы create_turn_summary).
+        Предыдущие саммари сессии к этому моменту уже записаны, поэтому
+        номер будущей записи — текущий размер хронологии. Возвращает его.
+        """
+        entry = self._store(session_id).count()
+        self.storage.add_pending_summary(session_id, entry, job)
+        return entry
+
+    async def write_turn_summary(
+        self, session_id: str, entry: int, job: Dict[str, Any]
+    ) -> None:
+        await self.create_turn_summary(session_id, **job)
+        await asyncio.to_thread(self.storage.remove_pending_summary, session_id, entry)
+
+    async def recover_summaries(self, session_id: str) -> None:
+        """Записывает саммари, сохраненные до сбоя, но не попавшие в хронологию."""
+        pending = await asyncio.to_thread(self.storage.pending_summaries, session_id)
+        for entry, job in pending:
+            count = await asyncio.to_thread(lambda: self._store(session_id).count())
+            # Запись могла появиться до сбоя, а удаление данных — нет
+            if entry >= count:
+                logger.info(
+                    f"Recovering turn summary {entry} of session '{session_id}'."
+                )
+                await self.create_turn_summary(session_id, **job)
+            await asyncio.to_thread(
+                self.storage.remove_pending_summary, session_id, entry
+            )
+
+    # --- Tiered compaction ---
+    #
+    # Хронология сессии хранится в три уровня (см. app.storage.CHRONICLE_TIERS):
+    #   entries — записи ходов (последние остаются дословно);
+    #   chunks  — сводки блоков по CHRONICLE_CHUNK_SIZE старых записей;
+    #   eras    — сводки эпох, по CHRONICLE_ERA_SIZE сводок блоков.
+    # Каждый шаг сжатия — отдельный вызов LLM ограниченного размера.
+    # Уже свернутые записи и блоки повторно не суммируются.
+
+    def get_full_chronology(self, session_id: str) -> str:
+        """Вся история: сводки эпох, несвернутые сводки блоков и свежие записи."""
+        meta = self.storage.read_chronicle_meta(session_id)
+        store = self._store(session_id)
+        chunks = self.storage.chronology(session_id, "chunks")
+        eras = self.storage.chronology(session_id, "eras")
+        parts = (
+            eras.tail(eras.count())
+            + chunks.entries(meta["merged_chunks"], chunks.count())
+            + store.entries(meta["compacted_entries"], store.count())
+        )
+        return "\n".join(parts)
 
-        if word_count > word_limit:
-            logger.info(f"Chronology size ({word_count}) exceeds limit. Summarizing...")
+    async def compact_step(self, session_id: str) -> bool:
+        """
+        Выполняет один шаг сжатия хронологии, если он нужен.
+        Возвращает True, если шаг был выполнен (можно пробовать следующий).
+        """
+        store = await asyncio.to_thread(self._store, session_id)
+        chunks = await asyncio.to_thread(self.storage.chronology, session_id, "chunks")
+        meta = await asyncio.to_thread(self.storage.read_chronicle_meta, session_id)
+
+        chunk_size = settings.CHRONICLE_CHUNK_SIZE
+        era_size = settings.CHRONICLE_ERA_SIZE
+
+        # 1. Свежие записи: сворачиваем самый старый блок сверх окна последних ходов
+        compacted = meta["compacted_entries"]
+        verbatim_entries = await asyncio.to_thread(store.count) - compacted
+        verbatim_words = await asyncio.to_thread(store.words_since, compacted)
+        if (
+            verbatim_words > settings.CHRONICLE_VERBATIM_WORD_LIMIT
+            and verbatim_entries >= settings.CHRONICLE_KEEP_RECENT + chunk_size
+        ):
+            entries = await asyncio.to_thread(
+                store.entries, compacted, compacted + chunk_size
+            )
+            logger.info(
+                f"Chronology of '{session_id}' has {verbatim_words} verbatim words. "
+                f"Summarizing entries {compacted}..{compacted + chunk_size - 1}."
+            )
+            # Каждая запись сокращается поровну, чтобы сводка охватила все
+            summary = await self._complete(
+                "chronicle_summarizer",
+                self.SYSTEM_PROMPT_SUMMARIZER,
+                "\n".join(entries),
+                0.3,
+                shrink=(Truncate("\n"),),
+            )
+            await asyncio.to_thread(
+                self.storage.commit_chronicle_step,
+                session_id,
+                meta,
+                "chunks",
+                summary,
+                "compacted_entries",
+                compacted + chunk_size,
+            )
+            return True
+
+        # 2. Сводки блоков: объединяем самые старые в сводку эпохи
+        merged = meta["merged_chunks"]
+        if await asyncio.to_thread(chunks.count) - merged >= era_size:
+            chunk_summaries = await asyncio.to_thread(
+                chunks.entries, merged, merged + era_size
+            )
+            logger.info(
+                f"Merging chronicle chunks {merged}..{merged + era_size - 1} of '{session_id}' into an era."
+            )
+            summary = await self._complete(
+                "chronicle_era_merger",
+                self.SYSTEM_PROMPT_ERA_MERGER,
+                "\n\n".join(chunk_summaries),
+                0.3,
+                shrink=(Truncate("\n\n"),),
+            )
+            await asyncio.to_thread(
+                self.storage.commit_chronicle_step,
+                session_id,
+                meta,
+                "eras",
+                summary,
+                "merged_chunks",
+                merged + era_size,
+            )
+            return True
+
+        return False
+
+    async def summarize_if_needed(self, session_id: str) -> None:
+        """Выполняет все необходимые шаги сжатия хронологии сессии."""
+        try:
+            while await self.compact_step(session_id):
+                pass
+        except Exception as e:
+            logger.error(f"Chronology summarization failed: {e}")
+
+    async def _complete(
+        self,
+        agent: str,
+        system_prompt: str,
+        text: str,
+        temperature: float,
+        shrink: Tuple[ShrinkPolicy, ...] = (Truncate(),),
+    ) -> str:
+        if settings.LLM_MAX_CONTEXT > 0:
+            text = fit_prompt(
+                agent,
+                [
+                    BudgetSection("instructions", system_prompt),
+                    BudgetSection("text", text, shrink=shrink),
+                ],
+            )["text"]
+        with span(
+            f"llm.{agent}",
+            temperature=temperature,
+            prompt_chars=len(system_prompt) + len(text),
+        ) as llm_span:
+            started = time.perf_counter()
             try:
-                completion = self.client.chat.completions.create(
+                completion = await self.client.chat.completions.create(
                     model="local-model",
                     messages=[
-                        {"role": "system", "content": self.SYSTEM_PROMPT_SUMMARIZER},
+                        {"role": "system", "content": system_prompt},
                         {"role": "user", "content": text},
                     ],
-                    temperature=0.3,
+                    temperature=temperature,
                 )
-                summary_text = completion.choices[0].message.content.strip()
-                self._overwrite_file(summary_text)
-                logger.info("Chronology summarized successfully.")
-            except Exception as e:
-                logger.error(f"Chronology summarization failed: {e}")
+            except Exception:
+                observe_llm_call(agent, time.perf_counter() - started, outcome="error")
+                raise
+            observe_llm_call(
+                agent, time.perf_counter() - started, usage=completion.usage
+            )
+            if completion.usage is not None:
+                llm_span.set(
+                    prompt_tokens=completion.usage.prompt_tokens,
+                    completion_tokens=completion.usage.completion_tokens,
+                )
+            return completion.choices[0].message.content.strip()
@@ -1,9 +1,27 @@
+import asyncio
 import logging
-from typing import Optional, List
-from app.core.utils import deep_merge_dicts
-from app.models.api_dtos import TurnResponse
+import time
+import uuid
+from typing import Optional, List, Callable, Awaitable, Any, Dict, Tuple
+from app.core.config import settings
+from app.core.metrics import (
+    ENGINE_STAGE_SECONDS,
+    ENGINE_TURN_SECONDS,
+    STORY_ATTEMPTS,
+    STORY_RETRIES,
+)
+from app.core.state_delta import DeltaResult, StateDelta
+from app.core.tracing import span, start_trace
+from app.models.api_dtos import (
+    TurnResponse,
+    TurnEvent,
+    TurnTimings,
+    StageTimingInfo,
+)
+from app.models.game_state import GameState
 from app.services.state_service import GameStateService
 from app.services.chronicle_service import ChronicleService
+from app.services.chronicle_queue import ChronicleJobQueue
 from app.services.agent_services import (
     ActionSelectorService,
     MotivationGeneratorService,
@@ -11,9 +29,15 @@ from app.services.agent_services import (
     StoryWriterService,
     StoryVerifierService,
 )
+from app.services.turn_graph import TurnGraph
 
 logger = logging.getLogger(__name__)
 
+# Получатель событий хода (используется потоковым эндпоинтом)
+TurnEventCallback = Callable[[TurnEvent], Awaitable[None]]
+
+TOTAL_STAGES = 7
+
 
 class GameEngineService:
     """
@@ -30,6 +54,7 @@ class GameEngineService:
         action_consequence: ActionConsequenceService,
         story_writer: StoryWriterService,
         story_verifier: StoryVerifierService,
+        chronicle_queue: ChronicleJobQueue,
     ):
         self.state_service = state_service
         self.chronicle_service = chronicle_service
@@ -38,12 +63,70 @@ class GameEngineService:
         self.action_consequence = action_consequence
         self.story_writer = story_writer
         self.story_verifier = story_verifier
+        self.chronicle_queue = chronicle_queue
 
-    def process_turn(self, user_character_name: str, user_input: str) -> TurnResponse:
-        logger.info(f"--- Processing turn for {user_character_name}: {user_input} ---")
+    @staticmethod
+    async def _emit(
+        on_event: Optional[TurnEventCallback], event: str, **data: Any
+    ) -> None:
+        if on_event is not None:
+            await on_event(TurnEvent(event=event, data=data))
 
-        # 1. Загрузка состояния
-        current_state = self.state_service.load_state()
+    async def _stage(
+        self, on_event: Optional[TurnEventCallback], step: int, message: str
+    ) -> None:
+        logger.info(f"{step}/{TOTAL_STAGES} {message}")
+        await self._emit(
+            on_event, "stage", step=step, total=TOTAL_STAGES, message=message
+        )
+
+    async def process_turn(
+        self,
+        user_character_name: str,
+        user_input: str,
+        session_id: str,
+        on_event: Optional[TurnEventCallback] = None,
+    ) -> TurnResponse:
+        """
+        Обрабатывает один ход.
+        Если передан on_event, по ходу работы отправляет события этапов
+        и фрагменты текста истории (для потоковой выдачи клиенту).
+        """
+        # turn_id возвращается клиенту и служит идентификатором трассы хода
+        turn_id = uuid.uuid4().hex
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            with start_trace(
+                turn_id,
+                "turn",
+                session_id=session_id,
+                user_character=user_character_name,
+                user_input_chars=len(user_input),
+            ):
+                response = await self._process_turn(
+                    user_character_name, user_input, session_id, on_event
+                )
+            response.turn_id = turn_id
+            outcome = "ok"
+            return response
+        finally:
+            ENGINE_TURN_SECONDS.observe(time.perf_counter() - started, outcome=outcome)
+
+    async def _process_turn(
+        self,
+        user_character_name: str,
+        user_input: str,
+        session_id: str,
+        on_event: Optional[TurnEventCallback],
+    ) -> TurnResponse:
+        logger.info(
+            f"--- Processing turn for {user_character_name} "
+            f"(session '{session_id}'): {user_input} ---"
+        )
+
+        # 1. Загрузка состояния (из кэша сессий или с диска)
+        current_state = await self.state_service.load_state(session_id)
 
         # Определяем имя AI персонажа (первый, кто не юзер)
         ai_character_name = next(
@@ -57,64 +140,249 @@ class GameEngineService:
         if not ai_character_name:
             raise ValueError("AI character not found in state.")
 
-        # 2. Определение последствий действия ПОЛЬЗОВАТЕЛЯ
-        logger.info("1/7 Determining user consequences...")
-        user_changes, _ = self.action_consequence.determine_consequences(
-            current_state, user_input, user_character_name
-        )
+        # Этапы хода описаны как граф зависимостей: мотивация и последствия
+        # действия AI зависят только от выбранного действия и выполняются параллельно.
+        async def load_chronicle(results: Dict[str, Any]) -> str:
+            # Саммари прошлого хода могло еще не записаться — дожидаемся только
+            # его (сжатие хронологии идет в своей очереди); затем дописываем
+            # саммари, оставшиеся незаписанными после перезапуска
+            await self.chronicle_queue.wait_idle(session_id, "turn_summary")
+            await self.chronicle_service.recover_summaries(session_id)
+            return await asyncio.to_thread(
+                self.chronicle_service.get_last_turn_chronicle, session_id
+            )
 
-        # Применяем изменения пользователя к промежуточному состоянию (в памяти)
-        # Для deep_merge_dicts нужно преобразовать модели в dict
-        current_state_dict = current_state.model_dump()
-        intermediate_state_dict = deep_merge_dicts(user_changes, current_state_dict)
+        async def memories(results: Dict[str, Any]) -> List[str]:
+            # Прошлые события, связанные с действием игрока (долгосрочная память)
+            return await self.chronicle_service.recall(session_id, user_input)
 
-        # Преобразуем обратно в объект GameState для работы агентов
-        # (Это важно, так как агенты ожидают GameState объект)
-        from app.models.game_state import GameState
+        async def user_consequences(results: Dict[str, Any]) -> DeltaResult:
+            # 2. Определение последствий действия ПОЛЬЗОВАТЕЛЯ
+            await self._stage(on_event, 1, "Determining user consequences...")
+            user_changes, _ = await self.action_consequence.determine_consequences(
+                current_state, user_input, user_character_name
+            )
+            # Применяем изменения пользователя к промежуточному состоянию (в памяти)
+            return self._apply_changes(current_state, user_changes, "user")
 
-        intermediate_state = GameState(**intermediate_state_dict)
+        async def select_action(results: Dict[str, Any]) -> str:
+            # 3. Подготовка контекста для AI
+            await self._stage(on_event, 2, "Selecting AI action...")
+            intermediate_state = results["user_consequences"].state
 
-        # 3. Подготовка контекста для AI
-        logger.info("2/7 Selecting AI action...")
-        last_turn_chronicle = self.chronicle_service.get_last_turn_chronicle()
+            # Получаем последнее действие AI из текущего состояния (как approximation)
+            ai_char_data = intermediate_state.characters.get(ai_character_name)
+            last_ai_action = ai_char_data.current_action if ai_char_data else "unknown"
 
-        # Получаем последнее действие AI из текущего состояния (как approximation)
-        ai_char_data = intermediate_state.characters.get(ai_character_name)
-        last_ai_action = ai_char_data.current_action if ai_char_data else "unknown"
+            return await self.action_selector.select_action(
+                intermediate_state,
+                ai_character_name,
+                user_input,
+                last_ai_action,
+                results["chronicle"],
+                results["memories"],
+            )
 
-        planned_action = self.action_selector.select_action(
-            intermediate_state,
-            ai_character_name,
-            user_input,
-            last_ai_action,
-            last_turn_chronicle,
+        async def motivation(results: Dict[str, Any]) -> str:
+            # 4. Генерация мотивации
+            await self._stage(on_event, 3, "Generating motivation...")
+            return await self.motivation_generator.generate_motivation(
+                results["user_consequences"].state,
+                ai_character_name,
+                results["select_action"],
+                user_input,
+            )
+
+        async def ai_consequences(
+            results: Dict[str, Any],
+        ) -> Tuple[Dict[str, Any], List[str]]:
+            # 5. Последствия действий AI
+            await self._stage(on_event, 4, "Determining AI consequences...")
+            return await self.action_consequence.determine_consequences(
+                results["user_consequences"].state,
+                results["select_action"],
+                ai_character_name,
+            )
+
+        async def story_memories(results: Dict[str, Any]) -> List[str]:
+            # Для истории память ищется и по выбранному действию AI
+            query = f"{user_input}\n{results['select_action']}"
+            return await self.chronicle_service.recall(session_id, query)
+
+        async def story(results: Dict[str, Any]) -> str:
+            # 6. Написание истории с верификацией
+            await self._stage(on_event, 5, "Writing story...")
+            ai_changes, completed_actions = results["ai_consequences"]
+            return await self._write_verified_story(
+                results["user_consequences"].state,
+                ai_character_name,
+                user_character_name,
+                ai_changes,
+                completed_actions,
+                results["motivation"],
+                user_input,
+                results["chronicle"],
+                results["story_memories"],
+                on_event,
+            )
+
+        async def apply_changes(results: Dict[str, Any]) -> DeltaResult:
+            # 7. Применение изменений AI
+            await self._stage(on_event, 6, "Applying AI state changes...")
+            ai_changes, _ = results["ai_consequences"]
+            return self._apply_changes(
+                results["user_consequences"].state, ai_changes, "AI"
+            )
+
+        async def save_state(results: Dict[str, Any]) -> None:
+            await self._stage(on_event, 7, "Saving results...")
+            # В журнал состояния уходят только операции дельт этого хода
+            user_delta, ai_delta = (
+                results["user_consequences"],
+                results["apply_changes"],
+            )
+            # Запись истории хода сохраняется в той же транзакции, что и дельта
+            turn = {
+                "user_character": user_character_name,
+                "user_input": user_input,
+                "ai_character": ai_character_name,
+                "action": results["select_action"],
+                "motivation": results["motivation"],
+                "completed_actions": results["ai_consequences"][1],
+                "story": results["story"],
+            }
+            await self.state_service.save_state(
+                session_id, ai_delta.state, user_delta.ops + ai_delta.ops, turn
+            )
+
+        graph = (
+            TurnGraph()
+            .add("chronicle", load_chronicle)
+            .add("memories", memories, ["chronicle"])
+            .add("user_consequences", user_consequences)
+            .add(
+                "select_action",
+                select_action,
+                ["user_consequences", "chronicle", "memories"],
+            )
+            .add("motivation", motivation, ["select_action"])
+            .add("ai_consequences", ai_consequences, ["select_action"])
+            .add("story_memories", story_memories, ["select_action"])
+            .add("story", story, ["motivation", "ai_consequences", "story_memories"])
+            .add("apply_changes", apply_changes, ["ai_consequences"])
+            .add("save_state", save_state, ["apply_changes", "story"])
         )
+        try:
+            results = await graph.run()
+        finally:
+            for name, timing in graph.timings.items():
+                ENGINE_STAGE_SECONDS.observe(timing.duration, stage=name)
+        graph.log_summary()
 
-        # 4. Генерация мотивации
-        logger.info("3/7 Generating motivation...")
-        motivation = self.motivation_generator.generate_motivation(
-            intermediate_state, ai_character_name, planned_action, user_input
+        motivation_text = results["motivation"]
+        story_part = results["story"]
+        _, completed_actions = results["ai_consequences"]
+
+        # 8. Обновление хронологии — в фоне, после отправки ответа.
+        # Данные саммари сохраняются до ответа, чтобы пережить перезапуск;
+        # следующий ход этой сессии дождется задачи перед чтением хронологии.
+        summary_job = {
+            "user_char_name": user_character_name,
+            "user_action": user_input,
+            "ai_char_name": ai_character_name,
+            "ai_story_part": story_part,
+            "ai_motivation": motivation_text,
+        }
+        entry = await asyncio.to_thread(
+            self.chronicle_service.save_pending_summary, session_id, summary_job
+        )
+        self.chronicle_queue.submit(
+            session_id,
+            "turn_summary",
+            lambda: self.chronicle_service.write_turn_summary(
+                session_id, entry, summary_job
+            ),
         )
 
-        # 5. Последствия действий AI
-        logger.info("4/7 Determining AI consequences...")
-        ai_changes, completed_actions = self.action_consequence.determine_consequences(
-            intermediate_state, planned_action, ai_character_name
+        # Сжатие — в отдельной очереди после саммари этого хода; каждый шаг
+        # ограничен по размеру, и следующий ход его не ждет
+        async def compact_chronicle() -> None:
+            await self.chronicle_queue.wait_idle(session_id, "turn_summary")
+            await self.chronicle_service.summarize_if_needed(session_id)
+
+        self.chronicle_queue.submit(
+            session_id, "chronicle_compaction", compact_chronicle
         )
 
-        # 6. Написание истории с верификацией
-        logger.info("5/7 Writing story...")
-        story_part = ""
-        verification_passed = False
-        feedback = None
+        return TurnResponse(
+            session_id=session_id,
+            ai_character_name=ai_character_name,
+            motivation=motivation_text,
+            story_part=story_part,
+            completed_actions=completed_actions,
+            is_success=True,
+            timings=TurnTimings(
+                stages={
+                    name: StageTimingInfo(
+                        started_at=round(t.started_at, 3),
+                        duration=round(t.duration, 3),
+                    )
+                    for name, t in graph.timings.items()
+                },
+                total=round(graph.total_duration, 3),
+                critical_path=round(graph.critical_path(), 3),
+                sequential=round(graph.sequential_duration(), 3),
+            ),
+        )
+
+    @staticmethod
+    def _apply_changes(
+        state: GameState, changes: Dict[str, Any], actor: str
+    ) -> DeltaResult:
+        """Применяет state_changes агента как типизированную дельту."""
+        with span("state.merge", actor=actor) as merge_span:
+            result = StateDelta.from_changes(state, changes).apply(state)
+            merge_span.set(ops=len(result.ops))
+        if result.diff:
+            logger.info(f"Applied {actor} state changes: {result.format_diff()}")
+        return result
 
+    async def _write_verified_story(
+        self,
+        intermediate_state: GameState,
+        ai_character_name: str,
+        user_character_name: str,
+        ai_changes: Dict[str, Any],
+        completed_actions: List[str],
+        motivation: str,
+        user_input: str,
+        last_turn_chronicle: str,
+        past_events: List[str],
+        on_event: Optional[TurnEventCallback],
+    ) -> str:
+        """
+        Написание истории с проверкой, раундами по STORY_CANDIDATES черновиков
+        (всего не больше STORY_MAX_ATTEMPTS). Черновики раунда пишутся
+        и проверяются параллельно; первый прошедший проверку принимается,
+        остальные отменяются. Если не прошел ни один, следующий раунд
+        переписывает историю по замечанию верификатора.
+        При STORY_CANDIDATES=1 это прежний последовательный цикл.
+        """
         # Если действий нет, заглушка
         if not completed_actions and not ai_changes:
-            story_part = f"{ai_character_name} does nothing."
-            verification_passed = True
-        else:
-            for attempt in range(3):
-                story_part = self.story_writer.write_story(
+            return f"{ai_character_name} does nothing."
+
+        budget = max(1, settings.STORY_MAX_ATTEMPTS)
+        width = max(1, settings.STORY_CANDIDATES)
+
+        async def candidate(
+            attempt: int, feedback: Optional[str], stream: bool
+        ) -> Tuple[str, bool, str]:
+            async def on_token(token: str) -> None:
+                await self._emit(on_event, "story_token", attempt=attempt, text=token)
+
+            with span("story.attempt", attempt=attempt) as attempt_span:
+                story_part = await self.story_writer.write_story(
                     intermediate_state,
                     ai_character_name,
                     user_character_name,
@@ -123,46 +391,83 @@ class GameEngineService:
                     user_input,
                     last_turn_chronicle,
                     revision_feedback=feedback,
+                    on_token=on_token if stream else None,
+                    past_events=past_events,
                 )
 
-                is_valid, reason = self.story_verifier.verify(
-                    completed_actions, story_part
+                is_valid, reason = await self.story_verifier.verify(
+                    completed_actions, story_part, intermediate_state
                 )
-                if is_valid:
-                    verification_passed = True
-                    logger.info(f"Story verified on attempt {attempt + 1}")
-                    break
-                else:
-                    logger.warning(
-                        f"Verification failed (Attempt {attempt + 1}): {reason}"
-                    )
-                    feedback = reason
-
-            if not verification_passed:
-                logger.error("Story generation failed after 3 attempts.")
-                # Fallback: просто перечисляем действия
-                story_part = f"(System: Story generation failed) Actions taken: {', '.join(completed_actions)}"
-
-        # 7. Применение изменений AI и сохранение
-        logger.info("6/7 Applying AI state changes...")
-        final_state_dict = deep_merge_dicts(ai_changes, intermediate_state_dict)
-        final_state = GameState(**final_state_dict)
+                attempt_span.set(valid=is_valid, reason=reason)
+            return story_part, is_valid, reason
 
-        logger.info("7/7 Saving results...")
-        self.state_service.save_state(final_state)
+        feedback = None
+        attempts = 0
+        while attempts < budget:
+            count = min(width, budget - attempts)
+            first = attempts + 1
+            # Клиенту потоком показывается только первый черновик раунда
+            streamed = first if on_event is not None else None
+            stream_shown = streamed is not None
+            tasks = {
+                asyncio.create_task(
+                    candidate(first + i, feedback, stream=first + i == streamed)
+                ): first
+                + i
+                for i in range(count)
+            }
+            reasons: List[str] = []
+            try:
+                pending = set(tasks)
+                while pending:
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in sorted(done, key=tasks.get):
+                        attempt = tasks[task]
+                        story_part, is_valid, reason = task.result()
+                        attempts += 1
+                        if is_valid:
+                            logger.info(f"Story verified on attempt {attempt}")
+                            STORY_ATTEMPTS.observe(attempts, outcome="verified")
+                            if streamed is not None and attempt != streamed:
+                                # Показанный черновик заменяется выбранным
+                                if stream_shown:
+                                    await self._emit(
+                                        on_event,
+                                        "story_reset",
+                                        attempt=streamed,
+                                        reason="Another candidate was selected.",
+                                    )
+                                await self._emit(
+                                    on_event,
+                                    "story_token",
+                                    attempt=attempt,
+                                    text=story_part,
+                                )
+                            return story_part
 
-        # 8. Обновление хронологии
-        turn_summary = self.chronicle_service.create_turn_summary(
-            user_character_name, user_input, ai_character_name, story_part, motivation
-        )
+                        logger.warning(
+                            f"Verification failed (Attempt {attempt}): {reason}"
+                        )
+                        reasons.append(reason)
+                        if attempt == streamed:
+                            # Клиент должен отбросить уже показанный черновик
+                            await self._emit(
+                                on_event, "story_reset", attempt=attempt, reason=reason
+                            )
+                            stream_shown = False
+            finally:
+                # Остальные черновики раунда больше не нужны
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
 
-        # Асинхронно или просто после ответа можно сжать хронологию
-        self.chronicle_service.summarize_if_needed()
+            feedback = reasons[0]
+            if attempts < budget:
+                STORY_RETRIES.inc()
 
-        return TurnResponse(
-            ai_character_name=ai_character_name,
-            motivation=motivation,
-            story_part=story_part,
-            completed_actions=completed_actions,
-            is_success=True,
-        )
+        logger.error(f"Story generation failed after {attempts} attempts.")
+        STORY_ATTEMPTS.observe(attempts, outcome="failed")
+        # Fallback: просто перечисляем действия
+        return f"(System: Story generation failed) Actions taken: {', '.join(completed_actions)}"
@@ -1,60 +1,248 @@
-import json
+import asyncio
 import logging
-import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Sequence
 from app.core.config import settings
+from app.core.state_delta import DeltaOp
+from app.core.tracing import span
 from app.models.game_state import GameState
+from app.storage import Storage
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class _CachedSession:
+    state: GameState
+    last_access: float
+    seq: int = 0  # номер последней записи журнала, отраженной в state
+    snapshot_seq: int = 0  # номер записи, отраженной в снимке state.json
+    # Номер последней записи, поставленной в журнал (может быть еще не записана)
+    queued_seq: int = 0
+
+    def __post_init__(self):
+        self.queued_seq = max(self.queued_seq, self.seq)
+
+    @property
+    def dirty(self) -> bool:
+        return self.seq > self.snapshot_seq
+
+
 class GameStateService:
     """
     Сервис для управления персистентностью состояния игры.
-    Отвечает за чтение и запись state.json, используя Pydantic модели.
+    Держит состояния активных сессий в LRU-кэше в памяти:
+    ход читает состояние из словаря, а не парсит state.json с диска.
+
+    Каждое сохранение — запись в журнале сессии с операциями дельты хода;
+    save_state возвращается, когда запись надежно сохранена, так что
+    стоимость записи хода пропорциональна дельте, а не размеру мира.
+    Периодически пишется снимок состояния с номером последней вошедшей
+    в него записи. Восстановление: снимок + повтор хвоста журнала.
+    Формат хранения определяет Storage (файлы или SQLite).
     """
 
-    def __init__(self):
-        self.file_path = settings.STATE_FILE_PATH
+    def __init__(
+        self,
+        storage: Storage,
+        max_sessions: Optional[int] = None,
+        idle_ttl: Optional[float] = None,
+        flush_interval: Optional[float] = None,
+        snapshot_every: Optional[int] = None,
+    ):
+        self.max_sessions = max_sessions or settings.SESSION_CACHE_SIZE
+        self.idle_ttl = idle_ttl if idle_ttl is not None else settings.SESSION_IDLE_TTL
+        self.flush_interval = flush_interval or settings.STATE_FLUSH_INTERVAL
+        self.snapshot_every = snapshot_every or settings.STATE_SNAPSHOT_EVERY
+        self.storage = storage
+        self._cache: "OrderedDict[str, _CachedSession]" = OrderedDict()
+        self._lock = asyncio.Lock()
+        # Снимки одной сессии пишутся строго по одному (выгрузка, фоновый
+        # цикл и flush() могут начать снимок одновременно)
+        self._snapshot_locks: Dict[str, asyncio.Lock] = {}
+        self._flush_task: Optional[asyncio.Task] = None
 
-    def load_state(self) -> GameState:
+    # --- Lifecycle ---
+
+    def start(self) -> None:
+        """Запускает фоновый цикл снимков и выгрузки сессий."""
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self) -> None:
+        """Останавливает фоновый цикл и пишет снимки всех измененных сессий."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    # --- Public API ---
+
+    async def load_state(self, session_id: str) -> GameState:
         """
-        Читает state.json и возвращает валидированный объект GameState.
+        Возвращает состояние сессии из кэша или загружает его с диска.
         """
-        if not os.path.exists(self.file_path):
-            error_msg = f"State file not found at: {self.file_path}"
-            logger.error(error_msg)
-            raise FileNotFoundError(error_msg)
+        entry = self._cache.get(session_id)
+        if entry is not None:
+            entry.last_access = time.monotonic()
+            self._cache.move_to_end(session_id)
+            return entry.state
 
-        try:
-            with open(self.file_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
+        state, seq, snapshot_seq = await asyncio.to_thread(
+            self.storage.load_state, session_id
+        )
+        async with self._lock:
+            # Пока читали с диска, сессию мог загрузить параллельный запрос
+            entry = self._cache.get(session_id)
+            if entry is None:
+                entry = _CachedSession(
+                    state=state,
+                    last_access=time.monotonic(),
+                    seq=seq,
+                    snapshot_seq=snapshot_seq,
+                )
+                self._cache[session_id] = entry
+            self._cache.move_to_end(session_id)
+        await self._evict()
+        return entry.state
 
-            # Валидация через Pydantic
-            game_state = GameState(**data)
-            logger.info("GameState successfully loaded and validated.")
-            return game_state
+    async def save_state(
+        self,
+        session_id: str,
+        state: GameState,
+        ops: Optional[Sequence[DeltaOp]] = None,
+        turn: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """
+        Обновляет состояние сессии и дожидается записи хода в журнал.
+        ops — операции дельты, которые привели к state; без них в журнал
+        пишется состояние целиком. turn — запись истории хода, сохраняется
+        в той же транзакции (если хранилище ведет историю).
+        """
+        with span(
+            "state.save",
+            session_id=session_id,
+            ops=len(ops) if ops is not None else None,
+        ):
+            await self._save_state(session_id, state, ops, turn)
 
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to decode JSON from {self.file_path}: {e}")
-            raise
-        except Exception as e:
-            logger.error(f"Unexpected error loading state: {e}")
+    async def _save_state(
+        self,
+        session_id: str,
+        state: GameState,
+        ops: Optional[Sequence[DeltaOp]],
+        turn: Optional[Dict[str, Any]],
+    ) -> None:
+        if ops is not None:
+            record = {"ops": [op.to_record() for op in ops]}
+        else:
+            record = {"state": state.model_dump(mode="json", exclude_none=True)}
+
+        async with self._lock:
+            entry = self._cache.get(session_id)
+            if entry is None:
+                # Номер записи должен продолжать журнал, поэтому сессию
+                # сначала поднимаем с диска
+                stored, seq, snapshot_seq = await asyncio.to_thread(
+                    self.storage.load_state, session_id
+                )
+                entry = _CachedSession(
+                    state=stored,
+                    last_access=time.monotonic(),
+                    seq=seq,
+                    snapshot_seq=snapshot_seq,
+                )
+                self._cache[session_id] = entry
+            entry.queued_seq += 1
+            seq = entry.queued_seq
+            entry.last_access = time.monotonic()
+            self._cache.move_to_end(session_id)
+            record["seq"] = seq
+            # Постановка в очередь под блокировкой сохраняет порядок seq в журнале
+            committed = self.storage.append_state(session_id, record, turn)
+        try:
+            await committed
+        except BaseException:
+            # Ход не сохранен: кэш остается на последнем записанном состоянии,
+            # а номер освобождается, если после него ничего не поставлено
+            async with self._lock:
+                if entry.queued_seq == seq:
+                    entry.queued_seq = seq - 1
             raise
+        # Состояние публикуется только после надежной записи: иначе следующий
+        # ход и снимок построились бы на ходе, о сбое которого сообщил клиент
+        async with self._lock:
+            if seq > entry.seq:
+                entry.state = state
+                entry.seq = seq
+        await self._evict()
 
-    def save_state(self, state: GameState) -> None:
+    async def flush(self) -> None:
+        """Пишет снимки всех сессий, у которых журнал опережает снимок."""
+        for session_id, entry in list(self._cache.items()):
+            if entry.dirty:
+                await self._flush_session(session_id, entry)
+
+    # --- Internals ---
+
+    async def _flush_session(self, session_id: str, entry: _CachedSession) -> None:
         """
-        Сохраняет объект GameState обратно в state.json.
+        Пишет снимок состояния сессии. Снимки сессии сериализуются, а снимок,
+        который не новее уже записанного, пропускается: иначе старый снимок
+        мог бы лечь поверх нового, чей журнал уже усечен.
         """
-        try:
-            # Преобразуем модель обратно в словарь/json
-            # mode='json' обеспечивает сериализацию в формат, совместимый с JSON
-            json_str = state.model_dump_json(indent=2, exclude_none=True)
+        lock = self._snapshot_locks.setdefault(session_id, asyncio.Lock())
+        async with lock:
+            # Состояние берется под блокировкой: за время ожидания оно могло
+            # уйти вперед или уже попасть в снимок
+            state, seq = entry.state, entry.seq
+            if seq <= entry.snapshot_seq:
+                return
+            try:
+                await self.storage.write_snapshot(session_id, state, seq)
+            except Exception as e:
+                logger.error(f"Snapshot failed for session '{session_id}': {e}")
+                return
+            entry.snapshot_seq = max(entry.snapshot_seq, seq)
 
-            with open(self.file_path, "w", encoding="utf-8") as f:
-                f.write(json_str)
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                # Снимок — когда журнал сессии вырос достаточно
+                for session_id, entry in list(self._cache.items()):
+                    if entry.seq - entry.snapshot_seq >= self.snapshot_every:
+                        await self._flush_session(session_id, entry)
+                await self._evict()
+            except Exception as e:
+                logger.error(f"State flush loop error: {e}", exc_info=True)
 
-            logger.info(f"GameState successfully saved to {self.file_path}")
+    async def _evict(self) -> None:
+        """Выгружает сессии сверх лимита кэша и простаивающие дольше idle_ttl."""
+        now = time.monotonic()
+        overflow = len(self._cache) - self.max_sessions
+        victims = []
+        for session_id, entry in list(self._cache.items()):
+            idle = self.idle_ttl > 0 and now - entry.last_access > self.idle_ttl
+            if overflow > 0 or idle:
+                victims.append((session_id, entry, entry.last_access))
+                overflow -= 1
 
-        except Exception as e:
-            logger.error(f"Failed to save state to {self.file_path}: {e}")
-            raise
+        for session_id, entry, last_access in victims:
+            # Несохраненную сессию сначала пишем на диск, иначе ее нельзя выгружать
+            if entry.dirty:
+                await self._flush_session(session_id, entry)
+            async with self._lock:
+                still_idle = entry.last_access == last_access and not entry.dirty
+                if self._cache.get(session_id) is entry and still_idle:
+                    del self._cache[session_id]
+                    lock = self._snapshot_locks.get(session_id)
+                    if lock is not None and not lock.locked():
+                        del self._snapshot_locks[session_id]
+                    logger.info(f"Session '{session_id}' evicted from state cache.")
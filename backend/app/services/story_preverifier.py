@@ -0,0 +1,271 @@
+import logging
+import re
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+from app.core.render_cache import cached_render, render_state_json
+from app.core.text_stems import STOPWORDS, content_stems, stem
+from app.models.game_state import GameState
+
+logger = logging.getLogger(__name__)
+
+# --- Поиск несценарных предметов и действий (эвристики для английского текста) ---
+
+_TOKEN_RE = re.compile(r"[a-zа-яё]+(?:['’][a-z]+)?|[^\sa-zа-яё]", re.IGNORECASE)
+_CYRILLIC_RE = re.compile(r"[а-яё]", re.IGNORECASE)
+
+# Прямая речь в кавычках; текст вне нее — повествование
+_QUOTED_RE = re.compile(r'"[^"]*"|“[^”]*”|«[^»]*»')
+_LETTER_RE = re.compile(r"[a-zа-яё]", re.IGNORECASE)
+
+# После этих слов идет группа существительного — предмет
+_DETERMINERS = {
+    "a", "an", "the", "his", "her", "my", "your", "their", "its", "our",
+    "this", "that", "these", "those", "some", "another",
+}  # fmt: skip
+
+# После подлежащего (или имени персонажа) и союза идет сказуемое — действие
+_SUBJECTS = {"i", "he", "she", "they", "we", "you"}
+_CONJUNCTIONS = {"and", "then"}
+
+# Вспомогательные глаголы и отрицания перед сказуемым
+_AUXILIARIES = {
+    "is", "are", "was", "were", "be", "been", "am", "do", "does", "did", "don",
+    "doesn", "didn", "can", "could", "will", "would", "won", "shall", "should",
+    "may", "might", "must", "has", "have", "had", "not", "never", "also",
+    "still", "just", "slowly", "quickly",
+}  # fmt: skip
+
+# Слова повествования, которые не добавляют предметов мира
+# и значимых физических действий (речь, взгляды, жесты, чувства)
+_NARRATIVE_NOUNS = {
+    "hand", "hands", "face", "eye", "eyes", "head", "voice", "gaze", "smile",
+    "word", "words", "moment", "room", "floor", "wall", "air", "way", "time",
+    "breath", "attention", "question", "answer", "thought", "thoughts", "mind",
+    "heart", "shoulder", "shoulders", "arm", "arms", "finger", "fingers", "lip",
+    "lips", "hair", "side", "look", "expression", "tone", "nod", "silence",
+}  # fmt: skip
+_NARRATIVE_VERBS = {
+    "say", "says", "said", "ask", "asks", "asked", "reply", "replies", "answer",
+    "answers", "whisper", "whispers", "look", "looks", "glance", "glances",
+    "smile", "smiles", "nod", "nods", "sigh", "sighs", "laugh", "laughs",
+    "feel", "feels", "think", "thinks", "know", "knows", "see", "sees", "hear",
+    "hears", "notice", "notices", "watch", "watches", "wonder", "wonders",
+    "want", "wants", "seem", "seems", "begin", "begins", "start", "starts",
+    "try", "tries", "continue", "continues", "wait", "waits", "remain",
+    "remains", "stay", "stays", "let", "lets", "hope", "hopes", "remember",
+    "remembers", "realize", "realizes", "decide", "decides", "need", "needs",
+    "tell", "tells", "call", "calls", "add", "adds", "seen", "saw", "heard",
+    "knew", "thought", "felt", "told",
+}  # fmt: skip
+
+
+def _story_vocabulary(game_state: GameState) -> Set[str]:
+    """Основы всех слов состояния мира (один раз на версию состояния)."""
+    text = cached_render(
+        game_state,
+        "preverifier_vocabulary",
+        lambda state: " ".join(sorted(set(content_stems(render_state_json(state))))),
+    )
+    return set(text.split())
+
+
+class StoryPreVerifier:
+    """
+    Быстрая локальная проверка истории перед вызовом StoryVerifier (LLM).
+    Сопоставляет каждое действие из сценария с текстом истории и проверяет,
+    что упомянутые в действиях предметы из состояния (сцена, holding,
+    inventory, clothing) присутствуют в тексте. Локальный PASS возможен,
+    только если в истории нет и лишнего: предметов, которых нет в состоянии,
+    и действий вне сценария (см. _unscripted_terms).
+    Локальный FAIL — только по структуре: пустая история или одна прямая
+    речь без повествования. Слабое совпадение слов с действием не FAIL:
+    действие может быть пересказано другими словами, это решает LLM.
+    Уверенный результат возвращается сразу, спорные случаи уходят в LLM.
+    """
+
+    def __init__(self, pass_threshold: float):
+        self.pass_threshold = pass_threshold
+        self.short_circuit_pass = 0
+        self.short_circuit_fail = 0
+        self.escalated = 0
+        self._lock = threading.Lock()
+
+    def check(
+        self,
+        completed_actions: List[str],
+        story_text: str,
+        game_state: Optional[GameState],
+    ) -> Optional[Tuple[bool, str]]:
+        """
+        Возвращает (is_valid, reason) при уверенном решении или None,
+        если проверку должна выполнить LLM.
+        """
+        result = self._decide(completed_actions, story_text, game_state)
+        if result is None:
+            logger.debug("Story pre-verification is inconclusive, escalating.")
+        with self._lock:
+            if result is None:
+                self.escalated += 1
+            elif result[0]:
+                self.short_circuit_pass += 1
+            else:
+                self.short_circuit_fail += 1
+        return result
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.short_circuit_pass + self.short_circuit_fail + self.escalated
+            short_circuited = self.short_circuit_pass + self.short_circuit_fail
+            return {
+                "short_circuit_pass": self.short_circuit_pass,
+                "short_circuit_fail": self.short_circuit_fail,
+                "escalated": self.escalated,
+                "short_circuit_rate": (
+                    round(short_circuited / total, 3) if total else 0.0
+                ),
+            }
+
+    # --- Internals ---
+
+    def _decide(
+        self,
+        completed_actions: List[str],
+        story_text: str,
+        game_state: Optional[GameState],
+    ) -> Optional[Tuple[bool, str]]:
+        structural = self._structural_failure(story_text)
+        if structural:
+            return False, structural
+
+        actions = [a for a in completed_actions if a and a.strip()]
+        if not actions or game_state is None:
+            return None
+
+        story_stems = set(content_stems(story_text))
+        object_names = self._object_names(game_state)
+
+        all_covered = True
+        for action in actions:
+            stems = content_stems(action)
+            if not stems:
+                return None
+            coverage = sum(1 for s in stems if s in story_stems) / len(stems)
+
+            # Предметы из состояния, упомянутые в действии, должны быть и в истории.
+            # Их отсутствие не считается уверенным FAIL (в тексте может быть
+            # местоимение), но запрещает локальный PASS.
+            missing_objects = [
+                name
+                for name, name_stems in object_names.items()
+                if name_stems <= set(stems) and not name_stems <= story_stems
+            ]
+            if coverage < self.pass_threshold or missing_objects:
+                all_covered = False
+
+        if not all_covered:
+            return None
+        extra = self._unscripted_terms(actions, story_text, game_state)
+        if extra:
+            logger.debug(f"Story mentions unscripted terms {extra}, escalating.")
+            return None
+        return True, "Verified locally."
+
+    @staticmethod
+    def _structural_failure(story_text: str) -> Optional[str]:
+        """Причина FAIL, если в истории заведомо нет описания действия."""
+        story = story_text.replace("[STORY]", "")
+        if not _LETTER_RE.search(story):
+            return "The story is empty."
+        if not _LETTER_RE.search(_QUOTED_RE.sub("", story)):
+            return "The story contains only dialogue and describes no action."
+        return None
+
+    @staticmethod
+    def _unscripted_terms(
+        actions: List[str], story_text: str, game_state: GameState
+    ) -> List[str]:
+        """
+        Предметы и действия истории, которых нет ни в сценарии, ни в состоянии.
+        Предмет — слова группы после артикля или притяжательного слова
+        ("a hidden pistol"); они должны встречаться в состоянии мира или
+        в действиях. Действие — первое значимое слово после подлежащего
+        (местоимения, имени персонажа) или союза ("and shoots"); оно должно
+        быть в действиях сценария, текущих действиях персонажей или среди
+        слов речи, взглядов и жестов. Эвристики рассчитаны на английский:
+        текст с кириллицей целиком считается несценарным.
+        """
+        if _CYRILLIC_RE.search(story_text):
+            return ["<non-English story>"]
+
+        script = set(content_stems(" ".join(actions)))
+        names = {part for name in game_state.characters for part in content_stems(name)}
+        known_objects = script | names | _story_vocabulary(game_state)
+        known_objects |= {stem(w) for w in _NARRATIVE_NOUNS}
+        known_actions = script | names | {stem(w) for w in _NARRATIVE_VERBS}
+        for character in game_state.characters.values():
+            known_actions.update(content_stems(character.current_action))
+
+        extra: List[str] = []
+        tokens = [t.lower() for t in _TOKEN_RE.findall(story_text)]
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            word, _, suffix = token.replace("’", "'").partition("'")
+            i += 1
+            if not word.isalpha():
+                continue
+            if word in _DETERMINERS or (suffix == "s" and word not in _SUBJECTS):
+                # Группа существительного: до трех слов до служебного слова
+                # или знака препинания; наречия на -ly в нее не входят
+                run = 0
+                while i < len(tokens) and run < 3:
+                    noun = tokens[i]
+                    if (
+                        not noun.isalpha()
+                        or noun in STOPWORDS
+                        or noun in _DETERMINERS
+                        or noun in _CONJUNCTIONS
+                        or noun.endswith("ly")
+                    ):
+                        break
+                    if stem(noun) not in known_objects:
+                        extra.append(noun)
+                    run += 1
+                    i += 1
+            elif word in _SUBJECTS or word in _CONJUNCTIONS or stem(word) in names:
+                # Сказуемое: пропускаем вспомогательные глаголы и наречия
+                while i < len(tokens) and (
+                    tokens[i] in _AUXILIARIES
+                    or tokens[i].replace("’", "'").partition("'")[0] in _AUXILIARIES
+                    or tokens[i].endswith("ly")
+                ):
+                    i += 1
+                if i >= len(tokens):
+                    break
+                verb = tokens[i]
+                if (
+                    verb.isalpha()
+                    and verb not in STOPWORDS
+                    and verb not in _DETERMINERS
+                    and verb not in _SUBJECTS
+                    and verb not in _CONJUNCTIONS
+                    and stem(verb) not in known_actions
+                ):
+                    extra.append(verb)
+        return extra
+
+    @staticmethod
+    def _object_names(game_state: GameState) -> Dict[str, Set[str]]:
+        """Имена предметов мира -> множество их основ."""
+        names: List[str] = [obj.name for obj in game_state.scene.interactive_objects]
+        for character in game_state.characters.values():
+            names.extend(character.holding)
+            names.extend(character.inventory)
+            for items in character.clothing.model_dump().values():
+                names.extend(items)
+        result = {}
+        for name in names:
+            stems = set(content_stems(name))
+            if stems:
+                result[name] = stems
+        return result
@@ -1,5 +1,5 @@
 import logging
-from openai import OpenAI
+from openai import AsyncOpenAI
 
 logger = logging.getLogger(__name__)
 
@@ -20,10 +20,10 @@ You are an expert English-to-Russian translator. Your task is to translate the u
 Do not add any extra comments, greetings, or explanations like "Вот перевод:" or "Этот текст уже на русском:".
 """
 
-    def __init__(self, client: OpenAI):
+    def __init__(self, client: AsyncOpenAI):
         self.client = client
 
-    def translate(self, text_to_translate: str) -> str:
+    async def translate(self, text_to_translate: str) -> str:
         """
         Переводит предоставленный текст с английского на русский.
         Если текст пустой или возникла ошибка, возвращает оригинал.
@@ -32,7 +32,7 @@ Do not add any extra comments, greetings, or explanations like "Вот пере
             return text_to_translate
 
         try:
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model="local-model",
                 messages=[
                     {
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from app.core.metrics import SESSION_LOCK_WAIT_SECONDS, TURNS_COALESCED
+from app.models.api_dtos import TurnResponse
+
+logger = logging.getLogger(__name__)
+
+TurnFunc = Callable[[], Awaitable[TurnResponse]]
+
+
+class IdempotencyKeyConflictError(Exception):
+    """Ключ идемпотентности уже использован для другого запроса."""
+
+
+@dataclass
+class _InFlightTurn:
+    fingerprint: Any
+    task: asyncio.Task
+
+
+@dataclass
+class _CompletedTurn:
+    fingerprint: Any
+    response: TurnResponse
+    expires_at: float
+
+
+class TurnCoordinator:
+    """
+    Точка входа ходов перед GameEngineService.
+    Ходы одной сессии выполняются строго по одному (блокировка на сессию),
+    иначе два параллельных хода читают одно состояние и последнее сохранение
+    затирает первое. Ходы разных сессий идут параллельно.
+
+    Запросы с ключом идемпотентности объединяются: повтор клиента после
+    таймаута подключается к уже идущему ходу, а не запускает второй конвейер.
+    Такой ход выполняется защищенным от отмены (asyncio.shield), чтобы
+    обрыв первого соединения не терял работу LLM. Результат хранится
+    result_ttl секунд для поздних повторов.
+    """
+
+    def __init__(self, result_ttl: float, max_results: int):
+        self.result_ttl = result_ttl
+        self.max_results = max_results
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._lock_users: Dict[str, int] = {}
+        self._inflight: Dict[Tuple[str, str], _InFlightTurn] = {}
+        self._results: "OrderedDict[Tuple[str, str], _CompletedTurn]" = OrderedDict()
+
+    async def run(
+        self,
+        session_id: str,
+        turn: TurnFunc,
+        idempotency_key: Optional[str] = None,
+        fingerprint: Any = None,
+    ) -> TurnResponse:
+        """
+        Выполняет ход turn() в очереди сессии.
+        fingerprint — содержимое запроса: повтор с тем же ключом, но другим
+        содержимым отклоняется IdempotencyKeyConflictError.
+        """
+        if idempotency_key is None:
+            return await self._run_serialized(session_id, turn)
+
+        key = (session_id, idempotency_key)
+        self._purge_expired()
+        completed = self._results.get(key)
+        if completed is not None:
+            self._check_fingerprint(idempotency_key, completed.fingerprint, fingerprint)
+            logger.info(
+                f"Idempotency key '{idempotency_key}' replayed a completed turn "
+                f"of session '{session_id}'."
+            )
+            TURNS_COALESCED.inc(state="completed")
+            return completed.response
+
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            task = asyncio.create_task(self._run_serialized(session_id, turn))
+            inflight = _InFlightTurn(fingerprint, task)
+            self._inflight[key] = inflight
+            task.add_done_callback(lambda t: self._on_done(key, fingerprint, t))
+        else:
+            self._check_fingerprint(idempotency_key, inflight.fingerprint, fingerprint)
+            logger.info(
+                f"Idempotency key '{idempotency_key}' attached to the in-flight turn "
+                f"of session '{session_id}'."
+            )
+            TURNS_COALESCED.inc(state="in_flight")
+        return await asyncio.shield(inflight.task)
+
+    async def shutdown(self) -> None:
+        """Дожидается ходов, которые продолжают выполняться без клиента."""
+        tasks = [inflight.task for inflight in self._inflight.values()]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run_serialized(self, session_id: str, turn: TurnFunc) -> TurnResponse:
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        self._lock_users[session_id] = self._lock_users.get(session_id, 0) + 1
+        try:
+            started = time.perf_counter()
+            async with lock:
+                SESSION_LOCK_WAIT_SECONDS.observe(time.perf_counter() - started)
+                return await turn()
+        finally:
+            # Блокировка не нужна, когда у сессии нет ни выполняемых, ни ждущих ходов
+            self._lock_users[session_id] -= 1
+            if self._lock_users[session_id] == 0:
+                del self._lock_users[session_id]
+                del self._locks[session_id]
+
+    def _on_done(self, key: Tuple[str, str], fingerprint: Any, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        # Неудачный ход не запоминается: повтор выполнит его заново
+        if task.cancelled() or task.exception() is not None:
+            return
+        self._results[key] = _CompletedTurn(
+            fingerprint=fingerprint,
+            response=task.result(),
+            expires_at=time.monotonic() + self.result_ttl,
+        )
+        while len(self._results) > self.max_results:
+            self._results.popitem(last=False)
+
+    def _purge_expired(self) -> None:
+        # Результаты добавляются с одинаковым TTL, поэтому старые — в начале
+        now = time.monotonic()
+        while self._results:
+            key, completed = next(iter(self._results.items()))
+            if completed.expires_at > now:
+                break
+            del self._results[key]
+
+    @staticmethod
+    def _check_fingerprint(key: str, expected: Any, actual: Any) -> None:
+        if expected != actual:
+            raise IdempotencyKeyConflictError(
+                f"Idempotency key '{key}' was already used for a different turn."
+            )
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Sequence
+from app.core.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Функция этапа получает результаты уже выполненных этапов
+StageFunc = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+@dataclass
+class _Stage:
+    name: str
+    func: StageFunc
+    depends_on: Sequence[str]
+
+
+@dataclass
+class StageTiming:
+    name: str
+    started_at: float  # секунды от начала выполнения графа
+    duration: float
+    depends_on: List[str] = field(default_factory=list)
+
+
+class TurnGraph:
+    """
+    Граф зависимостей этапов хода.
+    Каждый этап запускается, как только готовы все его зависимости,
+    поэтому независимые вызовы LLM выполняются параллельно.
+    """
+
+    def __init__(self):
+        self._stages: Dict[str, _Stage] = {}
+        self.timings: Dict[str, StageTiming] = {}
+        self.total_duration: float = 0.0
+
+    def add(
+        self, name: str, func: StageFunc, depends_on: Sequence[str] = ()
+    ) -> "TurnGraph":
+        if name in self._stages:
+            raise ValueError(f"Stage '{name}' is already registered.")
+        for dep in depends_on:
+            if dep not in self._stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dep}'.")
+        self._stages[name] = _Stage(name, func, list(depends_on))
+        return self
+
+    async def run(self) -> Dict[str, Any]:
+        """
+        Выполняет граф и возвращает результаты всех этапов по имени.
+        При ошибке любого этапа остальные запущенные этапы отменяются.
+        """
+        results: Dict[str, Any] = {}
+        pending = dict(self._stages)
+        running: Dict[asyncio.Task, str] = {}
+        started: Dict[str, float] = {}
+        graph_start = time.perf_counter()
+
+        try:
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    if all(dep in results for dep in stage.depends_on):
+                        del pending[name]
+                        started[name] = time.perf_counter()
+                        running[
+                            asyncio.create_task(self._run_stage(stage, results))
+                        ] = name
+
+                if not running:
+                    raise RuntimeError(
+                        f"Unresolvable stage dependencies: {sorted(pending)}"
+                    )
+
+                done, _ = await asyncio.wait(
+                    running.keys(), return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    name = running.pop(task)
+                    finished = time.perf_counter()
+                    self.timings[name] = StageTiming(
+                        name=name,
+                        started_at=started[name] - graph_start,
+                        duration=finished - started[name],
+                        depends_on=list(self._stages[name].depends_on),
+                    )
+                    # Пробрасывает исключение этапа, если оно было
+                    results[name] = task.result()
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+            self.total_duration = time.perf_counter() - graph_start
+
+        return results
+
+    @staticmethod
+    async def _run_stage(stage: _Stage, results: Dict[str, Any]) -> Any:
+        # Задача наследует контекст, так что спан этапа — дочерний для спана хода
+        with span(f"stage.{stage.name}"):
+            return await stage.func(results)
+
+    def critical_path(self) -> float:
+        """Длина критического пути (сумма длительностей по самой длинной цепочке)."""
+        finish: Dict[str, float] = {}
+        for name in self._stages:
+            if name not in self.timings:
+                continue
+            timing = self.timings[name]
+            finish[name] = timing.duration + max(
+                (finish.get(dep, 0.0) for dep in timing.depends_on), default=0.0
+            )
+        return max(finish.values(), default=0.0)
+
+    def sequential_duration(self) -> float:
+        """Сколько занял бы ход при строго последовательном выполнении этапов."""
+        return sum(t.duration for t in self.timings.values())
+
+    def log_summary(self) -> None:
+        stages = ", ".join(
+            f"{t.name}={t.duration:.2f}s" for t in self.timings.values()
+        )
+        logger.info(
+            f"Turn stage timings: {stages}. "
+            f"Total {self.total_duration:.2f}s, critical path "
+            f"{self.critical_path():.2f}s, sequential sum "
+            f"{self.sequential_duration():.2f}s."
+        )
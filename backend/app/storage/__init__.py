@@ -0,0 +1,11 @@
+from app.core.config import settings
+from .base import Storage, ChronologyLog, CHRONICLE_TIERS
+from .file_storage import FileStorage
+from .sqlite_storage import SqliteStorage
+
+
+def create_storage() -> Storage:
+    """Создает хранилище сессий, выбранное в настройках (STORAGE_BACKEND)."""
+    if settings.STORAGE_BACKEND == "sqlite":
+        return SqliteStorage(settings.SQLITE_PATH)
+    return FileStorage(settings.STATE_WAL_GROUP_COMMIT_WINDOW)
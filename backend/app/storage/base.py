@@ -0,0 +1,176 @@
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Awaitable, Dict, List, Optional, Tuple
+from app.core.sessions import scenario_path
+from app.core.state_delta import replay_records
+from app.models.game_state import GameState
+
+logger = logging.getLogger(__name__)
+
+# Уровни хронологии сессии: записи ходов, сводки блоков, сводки эпох
+CHRONICLE_TIERS = ("entries", "chunks", "eras")
+
+
+def default_chronicle_meta() -> Dict[str, Any]:
+    return {"compacted_entries": 0, "merged_chunks": 0, "pending": None}
+
+
+def read_state_file(file_path: Path) -> GameState:
+    """Читает JSON-файл состояния и возвращает валидированный GameState."""
+    if not os.path.exists(file_path):
+        error_msg = f"State file not found at: {file_path}"
+        logger.error(error_msg)
+        raise FileNotFoundError(error_msg)
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        # Валидация через Pydantic
+        return GameState(**data)
+    except json.JSONDecodeError as e:
+        logger.error(f"Failed to decode JSON from {file_path}: {e}")
+        raise
+    except Exception as e:
+        logger.error(f"Unexpected error loading state: {e}")
+        raise
+
+
+def load_scenario() -> GameState:
+    """Начальное состояние мира для новой сессии."""
+    return read_state_file(scenario_path())
+
+
+def replay_log(game_state: GameState, records: List[Dict[str, Any]]) -> GameState:
+    """
+    Применяет записи журнала состояния по порядку.
+    Запись содержит либо операции дельты ("ops"), либо состояние целиком ("state").
+    """
+    for record in records:
+        if "state" in record:
+            game_state = GameState(**record["state"])
+        else:
+            game_state = replay_records(game_state, record["ops"])
+    return game_state
+
+
+class ChronologyLog(ABC):
+    """Последовательность записей одного уровня хронологии сессии."""
+
+    @abstractmethod
+    def count(self) -> int: ...
+
+    @abstractmethod
+    def word_count(self) -> int: ...
+
+    @abstractmethod
+    def words_since(self, start: int) -> int: ...
+
+    @abstractmethod
+    def entries(self, start: int, stop: int) -> List[str]: ...
+
+    @abstractmethod
+    def append(self, text: str) -> None: ...
+
+    @abstractmethod
+    def rewrite(self, entries: List[str]) -> None: ...
+
+    def tail(self, n: int) -> List[str]:
+        """Последние n записей (в хронологическом порядке)."""
+        total = self.count()
+        return self.entries(max(0, total - n), total)
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Запись хронологии — одна строка: переводы строк схлопываются."""
+        return " ".join(line.strip() for line in text.splitlines() if line.strip())
+
+
+class Storage(ABC):
+    """
+    Хранилище сессий: журнал и снимки состояния, история ходов и хронология.
+    Синхронные методы вызываются из потоков (asyncio.to_thread).
+    """
+
+    def start(self) -> None:
+        """Запускает фоновые задачи хранилища (вызывается внутри event loop)."""
+
+    async def close(self) -> None:
+        """Дописывает отложенные данные и освобождает ресурсы."""
+
+    # --- State ---
+
+    @abstractmethod
+    def load_state(self, session_id: str) -> Tuple[GameState, int, int]:
+        """
+        Восстанавливает состояние сессии: снимок (для новой сессии —
+        начальный сценарий) плюс записи журнала после него.
+        Возвращает (состояние, номер последней записи, номер записи снимка).
+        """
+
+    @abstractmethod
+    def append_state(
+        self,
+        session_id: str,
+        record: Dict[str, Any],
+        turn: Optional[Dict[str, Any]] = None,
+    ) -> Awaitable[None]:
+        """
+        Ставит запись журнала состояния (с полем seq) и, если передана,
+        запись истории хода на запись одной транзакцией. Порядок вызовов
+        сохраняется; результат завершается, когда данные надежно записаны.
+        История ходов хранится и после снимка, в отличие от журнала.
+        """
+
+    @abstractmethod
+    async def write_snapshot(self, session_id: str, state: GameState, seq: int) -> None:
+        """Сохраняет снимок состояния, включающий записи журнала до seq."""
+
+    @abstractmethod
+    def turns(self, session_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """Последние записи истории ходов сессии (от старых к новым)."""
+
+    # --- Chronicle ---
+
+    @abstractmethod
+    def chronology(self, session_id: str, tier: str = "entries") -> ChronologyLog:
+        """Уровень хронологии сессии (см. CHRONICLE_TIERS)."""
+
+    @abstractmethod
+    def read_chronicle_meta(self, session_id: str) -> Dict[str, Any]:
+        """Указатели сжатия хронологии: compacted_entries, merged_chunks."""
+
+    @abstractmethod
+    def commit_chronicle_step(
+        self,
+        session_id: str,
+        meta: Dict[str, Any],
+        tier: str,
+        summary: str,
+        field: str,
+        stop: int,
+    ) -> None:
+        """
+        Добавляет сводку в уровень tier и сдвигает указатель meta[field]
+        на stop так, что при сбое сводка не окажется записанной дважды.
+        """
+
+    # --- Pending turn summaries ---
+
+    @abstractmethod
+    def add_pending_summary(
+        self, session_id: str, entry: int, job: Dict[str, Any]
+    ) -> None:
+        """
+        Сохраняет данные для саммари хода, которое станет записью номер entry,
+        до его записи: после сбоя саммари будет сгенерировано заново.
+        """
+
+    @abstractmethod
+    def remove_pending_summary(self, session_id: str, entry: int) -> None:
+        """Удаляет данные саммари, запись которого уже в хронологии."""
+
+    @abstractmethod
+    def pending_summaries(self, session_id: str) -> List[Tuple[int, Dict[str, Any]]]:
+        """Незаписанные саммари сессии (номер записи, данные) по порядку."""
@@ -0,0 +1,170 @@
+import logging
+import os
+import struct
+import threading
+from pathlib import Path
+from typing import Dict, List, Tuple
+from app.storage.base import ChronologyLog
+
+logger = logging.getLogger(__name__)
+
+# Запись индекса: начало записи, конец записи (байтовые смещения в chronology.txt)
+# и накопленное число слов по всем записям до текущей включительно.
+_RECORD = struct.Struct("<QQQ")
+
+# Блокировки по файлу хронологии: экземпляры хранилища создаются на каждое
+# обращение, а дозапись и проверка индекса одного файла не должны пересекаться
+_FILE_LOCKS: Dict[Path, threading.Lock] = {}
+_FILE_LOCKS_GUARD = threading.Lock()
+
+
+def _file_lock(path: Path) -> threading.Lock:
+    with _FILE_LOCKS_GUARD:
+        return _FILE_LOCKS.setdefault(path.resolve(), threading.Lock())
+
+
+class ChronologyStore(ChronologyLog):
+    """
+    Хранилище хронологии: текстовый файл (одна запись на строку) плюс
+    бинарный индекс смещений рядом с ним (chronology.idx).
+    Последние N записей и текущий размер хронологии читаются из хвоста
+    индекса без сканирования всего файла.
+    Если индекса нет или он не совпадает с файлом (старый chronology.txt,
+    сбой между записью текста и индекса), индекс перестраивается один раз.
+    """
+
+    def __init__(self, file_path: Path):
+        self.file_path = Path(file_path)
+        self.index_path = self.file_path.with_suffix(".idx")
+        self._lock = _file_lock(self.file_path)
+        self._ensure_index()
+
+    # --- Public API ---
+
+    def count(self) -> int:
+        """Количество записей в хронологии."""
+        return self._index_size() // _RECORD.size
+
+    def word_count(self) -> int:
+        """Суммарное число слов во всех записях."""
+        last = self._read_records(self.count() - 1, self.count())
+        return last[0][2] if last else 0
+
+    def words_since(self, start: int) -> int:
+        """Число слов в записях, начиная с записи номер start."""
+        if start <= 0:
+            return self.word_count()
+        before = self._read_records(start - 1, start)
+        return self.word_count() - (before[0][2] if before else 0)
+
+    def entries(self, start: int, stop: int) -> List[str]:
+        """Записи с номерами [start, stop)."""
+        records = self._read_records(start, stop)
+        if not records:
+            return []
+        with open(self.file_path, "rb") as f:
+            f.seek(records[0][0])
+            blob = f.read(records[-1][1] - records[0][0])
+        base = records[0][0]
+        return [
+            blob[begin - base : end - base].decode("utf-8").rstrip("\r\n")
+            for begin, end, _ in records
+        ]
+
+    def read_all(self) -> str:
+        if not self.file_path.exists():
+            return ""
+        with open(self.file_path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def append(self, text: str) -> None:
+        """Добавляет запись в конец хронологии (переводы строк внутри записи схлопываются)."""
+        entry = self.normalize(text)
+        if not entry:
+            return
+        data = (entry + "\n").encode("utf-8")
+        with self._lock:
+            self.file_path.parent.mkdir(parents=True, exist_ok=True)
+            words = self.word_count() + len(entry.split())
+            with open(self.file_path, "ab") as f:
+                start = f.tell()
+                f.write(data)
+            with open(self.index_path, "ab") as f:
+                f.write(_RECORD.pack(start, start + len(data), words))
+
+    def rewrite(self, entries: List[str]) -> None:
+        """Полностью заменяет хронологию указанными записями."""
+        data = "".join(
+            e + "\n" for e in (self.normalize(x) for x in entries) if e
+        ).encode("utf-8")
+        with self._lock:
+            self.file_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.file_path, "wb") as f:
+                f.write(data)
+            self._rebuild_index()
+
+    # --- Internals ---
+
+    def _index_size(self) -> int:
+        try:
+            return os.path.getsize(self.index_path)
+        except OSError:
+            return 0
+
+    def _read_records(self, start: int, stop: int) -> List[Tuple[int, int, int]]:
+        start = max(0, start)
+        stop = min(stop, self.count())
+        if start >= stop:
+            return []
+        with open(self.index_path, "rb") as f:
+            f.seek(start * _RECORD.size)
+            blob = f.read((stop - start) * _RECORD.size)
+        return [rec for rec in _RECORD.iter_unpack(blob)]
+
+    def _ensure_index(self) -> None:
+        """Проверяет согласованность индекса с файлом за O(1)."""
+        with self._lock:
+            text_size = (
+                os.path.getsize(self.file_path) if self.file_path.exists() else 0
+            )
+            index_size = self._index_size()
+            if index_size % _RECORD.size == 0:
+                last = self._read_records(self.count() - 1, self.count())
+                expected_end = last[0][1] if last else 0
+                if expected_end == text_size:
+                    return
+            logger.info(f"Rebuilding chronology index for {self.file_path}")
+            self._rebuild_index()
+
+    def _rebuild_index(self) -> None:
+        """Однократная миграция: сканирует chronology.txt и пишет индекс заново."""
+        records = []
+        words = 0
+        end_of_last = 0
+        if self.file_path.exists():
+            offset = 0
+            with open(self.file_path, "rb") as f:
+                for raw in f:
+                    line = raw.decode("utf-8", errors="replace")
+                    if line.strip():
+                        words += len(line.split())
+                        records.append([offset, offset + len(raw), words])
+                        end_of_last = offset + len(raw)
+                    offset += len(raw)
+            if records and end_of_last == offset and not line.endswith("\n"):
+                # Последняя запись без перевода строки: дописываем его,
+                # чтобы новые записи начинались с новой строки
+                with open(self.file_path, "ab") as f:
+                    f.write(b"\n")
+                records[-1][1] += 1
+                end_of_last += 1
+                offset += 1
+            if offset != end_of_last:
+                # Хвостовые пустые строки отрезаем, чтобы конец последней
+                # записи совпадал с концом файла
+                with open(self.file_path, "r+b") as f:
+                    f.truncate(end_of_last)
+        tmp_path = self.index_path.with_suffix(".idx.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(b"".join(_RECORD.pack(*rec) for rec in records))
+        os.replace(tmp_path, self.index_path)
@@ -0,0 +1,247 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Dict, List, Optional, Tuple
+from app.core.sessions import session_chronology_path, session_state_path
+from app.models.game_state import GameState
+from app.storage.base import (
+    Storage,
+    default_chronicle_meta,
+    load_scenario,
+    read_state_file,
+    replay_log,
+)
+from app.storage.chronology_store import ChronologyStore
+from app.storage.state_wal import WriteAheadLog, write_atomic
+
+logger = logging.getLogger(__name__)
+
+
+def _log_path(state_path: Path) -> Path:
+    return state_path.with_suffix(".wal")
+
+
+def _meta_path(state_path: Path) -> Path:
+    return state_path.with_suffix(".meta.json")
+
+
+def _turns_path(state_path: Path) -> Path:
+    return state_path.with_suffix(".turns.jsonl")
+
+
+def _read_snapshot_seq(meta_path: Path) -> int:
+    """Номер последней записи журнала, вошедшей в снимок (0 — снимка нет)."""
+    if not meta_path.exists():
+        return 0
+    with open(meta_path, "r", encoding="utf-8") as f:
+        return json.load(f).get("seq", 0)
+
+
+class FileStorage(Storage):
+    """
+    Файловое хранилище (по умолчанию): у каждой сессии свой каталог.
+      state.json        — снимок состояния (пишется атомарно через os.replace);
+      state.meta.json   — номер последней записи журнала в снимке;
+      state.wal         — журнал дельт ходов (group commit, fsync);
+      state.turns.jsonl — история ходов (пишется в той же пачке, что и
+                          журнал, и при снимке не усекается);
+      chronology.txt    — записи хроники + chronology.idx (индекс смещений);
+      chronology.chunks.txt, chronology.eras.txt, chronology.meta.json —
+                          уровни сжатия хронологии;
+      chronology.pending.json — саммари ходов, еще не записанные в хронику.
+    Файлы разные, поэтому запись хода и журнала не атомарна: после сбоя
+    в истории может не хватать последнего хода.
+    """
+
+    def __init__(self, group_commit_window: float = 0.0):
+        self.wal = WriteAheadLog(group_commit_window)
+        self._pending_lock = threading.Lock()
+        self._snapshot_locks: Dict[Path, threading.Lock] = {}
+
+    def start(self) -> None:
+        self.wal.start()
+
+    async def close(self) -> None:
+        await self.wal.close()
+
+    # --- State ---
+
+    def load_state(self, session_id: str) -> Tuple[GameState, int, int]:
+        state_path = session_state_path(session_id)
+        snapshot_seq = _read_snapshot_seq(_meta_path(state_path))
+
+        if state_path.exists():
+            game_state = read_state_file(state_path)
+        else:
+            game_state = load_scenario()
+        records = [
+            r
+            for r in WriteAheadLog.recover(_log_path(state_path))
+            if r["seq"] > snapshot_seq
+        ]
+        # Повтор записей, уже вошедших в снимок (сбой до обновления meta),
+        # безопасен: операции журнала — установки значений
+        game_state = replay_log(game_state, records)
+        if records:
+            logger.info(
+                f"Replayed {len(records)} state log records for session '{session_id}'."
+            )
+        seq = records[-1]["seq"] if records else snapshot_seq
+        return game_state, seq, snapshot_seq
+
+    def append_state(
+        self,
+        session_id: str,
+        record: Dict[str, Any],
+        turn: Optional[Dict[str, Any]] = None,
+    ) -> Awaitable[None]:
+        state_path = session_state_path(session_id)
+        committed = self.wal.enqueue(_log_path(state_path), record)
+        if not turn:
+            return committed
+        turn_record = {"seq": record["seq"], "created_at": time.time(), **turn}
+        return asyncio.gather(
+            committed, self.wal.enqueue(_turns_path(state_path), turn_record)
+        )
+
+    async def write_snapshot(self, session_id: str, state: GameState, seq: int) -> None:
+        state_path = session_state_path(session_id)
+        written = await asyncio.to_thread(self._write_snapshot, state_path, state, seq)
+        if written:
+            await self.wal.truncate(_log_path(state_path), seq)
+
+    def _write_snapshot(self, state_path: Path, state: GameState, seq: int) -> bool:
+        """
+        Пишет снимок, если он новее снимка на диске. Проверка и запись идут
+        под блокировкой файла: снимок, опоздавший за более новым (чей журнал
+        уже усечен), не должен его перезаписать. Возвращает True, если записан.
+        """
+        meta_path = _meta_path(state_path)
+        with self._snapshot_lock(state_path):
+            if seq <= _read_snapshot_seq(meta_path):
+                logger.info(f"Skipping stale snapshot {seq} of {state_path}")
+                return False
+            # mode='json' обеспечивает сериализацию в формат, совместимый с JSON
+            json_str = state.model_dump_json(indent=2, exclude_none=True)
+            write_atomic(state_path, json_str)
+            write_atomic(meta_path, json.dumps({"seq": seq}))
+        logger.info(f"GameState successfully saved to {state_path}")
+        return True
+
+    def turns(self, session_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+        records = WriteAheadLog.recover(_turns_path(session_state_path(session_id)))
+        return records[-limit:] if limit > 0 else []
+
+    def _snapshot_lock(self, state_path: Path) -> threading.Lock:
+        with self._pending_lock:
+            return self._snapshot_locks.setdefault(state_path, threading.Lock())
+
+    # --- Chronicle ---
+
+    def chronology(self, session_id: str, tier: str = "entries") -> ChronologyStore:
+        # Открытие хранилища дешевое: проверка индекса читает только его хвост
+        base = session_chronology_path(session_id)
+        if tier == "entries":
+            return ChronologyStore(base)
+        return ChronologyStore(base.with_name(f"{base.stem}.{tier}{base.suffix}"))
+
+    def _chronicle_meta_path(self, session_id: str) -> Path:
+        base = session_chronology_path(session_id)
+        return base.with_name(f"{base.stem}.meta.json")
+
+    def read_chronicle_meta(self, session_id: str) -> Dict[str, Any]:
+        meta_path = self._chronicle_meta_path(session_id)
+        meta = default_chronicle_meta()
+        if meta_path.exists():
+            try:
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    meta.update(json.load(f))
+            except (OSError, json.JSONDecodeError) as e:
+                logger.error(f"Failed to read chronology meta {meta_path}: {e}")
+        if self._recover_pending(session_id, meta):
+            write_atomic(meta_path, json.dumps(meta))
+        return meta
+
+    def _recover_pending(self, session_id: str, meta: Dict[str, Any]) -> bool:
+        """
+        Завершает шаг, прерванный между записью сводки и обновлением meta.
+        Возвращает True, если meta была изменена.
+        """
+        pending = meta.get("pending")
+        if not pending:
+            return False
+        tier = "chunks" if pending["kind"] == "chunk" else "eras"
+        if self.chronology(session_id, tier).count() > pending["count_before"]:
+            meta[pending["field"]] = pending["stop"]
+        meta["pending"] = None
+        return True
+
+    def commit_chronicle_step(
+        self,
+        session_id: str,
+        meta: Dict[str, Any],
+        tier: str,
+        summary: str,
+        field: str,
+        stop: int,
+    ) -> None:
+        meta_path = self._chronicle_meta_path(session_id)
+        target = self.chronology(session_id, tier)
+        # Сначала фиксируем намерение, затем пишем сводку и только потом сдвигаем
+        # указатель: при сбое между шагами сводка не будет записана дважды.
+        meta["pending"] = {
+            "kind": "chunk" if tier == "chunks" else "era",
+            "field": field,
+            "stop": stop,
+            "count_before": target.count(),
+        }
+        write_atomic(meta_path, json.dumps(meta))
+        target.append(summary)
+        meta[field] = stop
+        meta["pending"] = None
+        write_atomic(meta_path, json.dumps(meta))
+
+    # --- Pending turn summaries ---
+
+    def _pending_path(self, session_id: str) -> Path:
+        base = session_chronology_path(session_id)
+        return base.with_name(f"{base.stem}.pending.json")
+
+    def _read_pending(self, path: Path) -> Dict[str, Any]:
+        if not path.exists():
+            return {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"Failed to read pending summaries {path}: {e}")
+            return {}
+
+    def add_pending_summary(
+        self, session_id: str, entry: int, job: Dict[str, Any]
+    ) -> None:
+        path = self._pending_path(session_id)
+        with self._pending_lock:
+            pending = self._read_pending(path)
+            pending[str(entry)] = job
+            write_atomic(path, json.dumps(pending, ensure_ascii=False))
+
+    def remove_pending_summary(self, session_id: str, entry: int) -> None:
+        path = self._pending_path(session_id)
+        with self._pending_lock:
+            pending = self._read_pending(path)
+            if pending.pop(str(entry), None) is None:
+                return
+            if pending:
+                write_atomic(path, json.dumps(pending, ensure_ascii=False))
+            else:
+                os.remove(path)
+
+    def pending_summaries(self, session_id: str) -> List[Tuple[int, Dict[str, Any]]]:
+        with self._pending_lock:
+            pending = self._read_pending(self._pending_path(session_id))
+        return sorted((int(entry), job) for entry, job in pending.items())
@@ -0,0 +1,321 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Awaitable, Dict, Iterator, List, Optional, Tuple
+from app.core.sessions import validate_session_id
+from app.models.game_state import GameState
+from app.storage.base import (
+    ChronologyLog,
+    Storage,
+    default_chronicle_meta,
+    load_scenario,
+    replay_log,
+)
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id     TEXT PRIMARY KEY,
+    snapshot       TEXT,
+    snapshot_seq   INTEGER NOT NULL DEFAULT 0,
+    chronicle_meta TEXT,
+    created_at     REAL NOT NULL,
+    updated_at     REAL NOT NULL
+);
+-- Журнал дельт и история ходов: строки не удаляются после снимка
+CREATE TABLE IF NOT EXISTS state_log (
+    session_id TEXT NOT NULL,
+    seq        INTEGER NOT NULL,
+    record     TEXT NOT NULL,
+    turn       TEXT,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (session_id, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS chronicle (
+    session_id TEXT NOT NULL,
+    tier       TEXT NOT NULL,
+    idx        INTEGER NOT NULL,
+    text       TEXT NOT NULL,
+    cum_words  INTEGER NOT NULL,
+    PRIMARY KEY (session_id, tier, idx)
+) WITHOUT ROWID;
+-- Саммари ходов, еще не записанные в хронику (idx — номер будущей записи)
+CREATE TABLE IF NOT EXISTS chronicle_pending (
+    session_id TEXT NOT NULL,
+    idx        INTEGER NOT NULL,
+    job        TEXT NOT NULL,
+    PRIMARY KEY (session_id, idx)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions (updated_at);
+"""
+
+
+class SqliteStorage(Storage):
+    """
+    Хранилище в одном файле SQLite (journal_mode=WAL).
+    Все сессии, их журналы состояния, история ходов и хронология — в
+    таблицах с составными первичными ключами, так что чтение хвоста
+    журнала или последних записей хроники — поиск по индексу.
+    Запись хода (дельта состояния + история хода) — одна транзакция.
+    Соединение одно на процесс, обращения сериализуются блокировкой
+    и выполняются в потоках (asyncio.to_thread).
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(
+            self.db_path, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.RLock()
+
+    async def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def query(self, sql: str, params: Tuple = ()) -> List[Tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _ensure_session(self, conn: sqlite3.Connection, session_id: str) -> None:
+        now = time.time()
+        conn.execute(
+            "INSERT OR IGNORE INTO sessions (session_id, created_at, updated_at) "
+            "VALUES (?, ?, ?)",
+            (validate_session_id(session_id), now, now),
+        )
+
+    # --- State ---
+
+    def load_state(self, session_id: str) -> Tuple[GameState, int, int]:
+        rows = self.query(
+            "SELECT snapshot, snapshot_seq FROM sessions WHERE session_id = ?",
+            (session_id,),
+        )
+        snapshot, snapshot_seq = rows[0] if rows else (None, 0)
+        game_state = GameState(**json.loads(snapshot)) if snapshot else load_scenario()
+        records = [
+            json.loads(record)
+            for (record,) in self.query(
+                "SELECT record FROM state_log WHERE session_id = ? AND seq > ? "
+                "ORDER BY seq",
+                (session_id, snapshot_seq),
+            )
+        ]
+        game_state = replay_log(game_state, records)
+        seq = records[-1]["seq"] if records else snapshot_seq
+        return game_state, seq, snapshot_seq
+
+    def append_state(
+        self,
+        session_id: str,
+        record: Dict[str, Any],
+        turn: Optional[Dict[str, Any]] = None,
+    ) -> Awaitable[None]:
+        # Строки ключуются seq, поэтому порядок завершения потоков не важен
+        return asyncio.ensure_future(
+            asyncio.to_thread(self._append_state, session_id, record, turn)
+        )
+
+    def _append_state(
+        self,
+        session_id: str,
+        record: Dict[str, Any],
+        turn: Optional[Dict[str, Any]],
+    ) -> None:
+        now = time.time()
+        with self.transaction() as conn:
+            self._ensure_session(conn, session_id)
+            conn.execute(
+                "INSERT OR REPLACE INTO state_log "
+                "(session_id, seq, record, turn, created_at) VALUES (?, ?, ?, ?, ?)",
+                (
+                    session_id,
+                    record["seq"],
+                    json.dumps(record, ensure_ascii=False),
+                    json.dumps(turn, ensure_ascii=False) if turn else None,
+                    now,
+                ),
+            )
+            conn.execute(
+                "UPDATE sessions SET updated_at = ? WHERE session_id = ?",
+                (now, session_id),
+            )
+
+    async def write_snapshot(self, session_id: str, state: GameState, seq: int) -> None:
+        await asyncio.to_thread(self._write_snapshot, session_id, state, seq)
+
+    def _write_snapshot(self, session_id: str, state: GameState, seq: int) -> None:
+        snapshot = state.model_dump_json(exclude_none=True)
+        with self.transaction() as conn:
+            self._ensure_session(conn, session_id)
+            # Снимок не откатывается назад, если параллельно записан более новый
+            conn.execute(
+                "UPDATE sessions SET snapshot = ?, snapshot_seq = ?, updated_at = ? "
+                "WHERE session_id = ? AND snapshot_seq <= ?",
+                (snapshot, seq, time.time(), session_id, seq),
+            )
+
+    def turns(self, session_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """Последние записи истории ходов сессии (от старых к новым)."""
+        rows = self.query(
+            "SELECT seq, turn, created_at FROM state_log "
+            "WHERE session_id = ? AND turn IS NOT NULL ORDER BY seq DESC LIMIT ?",
+            (session_id, limit),
+        )
+        return [
+            {"seq": seq, "created_at": created_at, **json.loads(turn)}
+            for seq, turn, created_at in reversed(rows)
+        ]
+
+    # --- Chronicle ---
+
+    def chronology(self, session_id: str, tier: str = "entries") -> "SqliteChronology":
+        return SqliteChronology(self, session_id, tier)
+
+    def read_chronicle_meta(self, session_id: str) -> Dict[str, Any]:
+        meta = default_chronicle_meta()
+        rows = self.query(
+            "SELECT chronicle_meta FROM sessions WHERE session_id = ?", (session_id,)
+        )
+        if rows and rows[0][0]:
+            meta.update(json.loads(rows[0][0]))
+        return meta
+
+    def commit_chronicle_step(
+        self,
+        session_id: str,
+        meta: Dict[str, Any],
+        tier: str,
+        summary: str,
+        field: str,
+        stop: int,
+    ) -> None:
+        # Сводка и сдвиг указателя — одна транзакция, протокол pending не нужен
+        with self.transaction() as conn:
+            self.chronology(session_id, tier).append_in(conn, summary)
+            meta[field] = stop
+            meta["pending"] = None
+            self._ensure_session(conn, session_id)
+            conn.execute(
+                "UPDATE sessions SET chronicle_meta = ?, updated_at = ? "
+                "WHERE session_id = ?",
+                (json.dumps(meta), time.time(), session_id),
+            )
+
+    # --- Pending turn summaries ---
+
+    def add_pending_summary(
+        self, session_id: str, entry: int, job: Dict[str, Any]
+    ) -> None:
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO chronicle_pending (session_id, idx, job) "
+                "VALUES (?, ?, ?)",
+                (session_id, entry, json.dumps(job, ensure_ascii=False)),
+            )
+
+    def remove_pending_summary(self, session_id: str, entry: int) -> None:
+        with self.transaction() as conn:
+            conn.execute(
+                "DELETE FROM chronicle_pending WHERE session_id = ? AND idx = ?",
+                (session_id, entry),
+            )
+
+    def pending_summaries(self, session_id: str) -> List[Tuple[int, Dict[str, Any]]]:
+        rows = self.query(
+            "SELECT idx, job FROM chronicle_pending WHERE session_id = ? ORDER BY idx",
+            (session_id,),
+        )
+        return [(idx, json.loads(job)) for idx, job in rows]
+
+
+class SqliteChronology(ChronologyLog):
+    """Уровень хронологии сессии в таблице chronicle (idx — 0, 1, 2, ...)."""
+
+    def __init__(self, storage: SqliteStorage, session_id: str, tier: str):
+        self.storage = storage
+        self.session_id = session_id
+        self.tier = tier
+
+    def _last(self) -> Optional[Tuple[int, int]]:
+        rows = self.storage.query(
+            "SELECT idx, cum_words FROM chronicle WHERE session_id = ? AND tier = ? "
+            "ORDER BY idx DESC LIMIT 1",
+            (self.session_id, self.tier),
+        )
+        return rows[0] if rows else None
+
+    def count(self) -> int:
+        last = self._last()
+        return last[0] + 1 if last else 0
+
+    def word_count(self) -> int:
+        last = self._last()
+        return last[1] if last else 0
+
+    def words_since(self, start: int) -> int:
+        if start <= 0:
+            return self.word_count()
+        rows = self.storage.query(
+            "SELECT cum_words FROM chronicle "
+            "WHERE session_id = ? AND tier = ? AND idx = ?",
+            (self.session_id, self.tier, start - 1),
+        )
+        return self.word_count() - (rows[0][0] if rows else 0)
+
+    def entries(self, start: int, stop: int) -> List[str]:
+        rows = self.storage.query(
+            "SELECT text FROM chronicle WHERE session_id = ? AND tier = ? "
+            "AND idx >= ? AND idx < ? ORDER BY idx",
+            (self.session_id, self.tier, max(0, start), stop),
+        )
+        return [text for (text,) in rows]
+
+    def append(self, text: str) -> None:
+        with self.storage.transaction() as conn:
+            self.append_in(conn, text)
+
+    def append_in(self, conn: sqlite3.Connection, text: str) -> None:
+        """Добавляет запись в рамках уже открытой транзакции."""
+        entry = self.normalize(text)
+        if not entry:
+            return
+        self.storage._ensure_session(conn, self.session_id)
+        last = self._last()
+        idx, words = (last[0] + 1, last[1]) if last else (0, 0)
+        conn.execute(
+            "INSERT INTO chronicle (session_id, tier, idx, text, cum_words) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (self.session_id, self.tier, idx, entry, words + len(entry.split())),
+        )
+
+    def rewrite(self, entries: List[str]) -> None:
+        with self.storage.transaction() as conn:
+            conn.execute(
+                "DELETE FROM chronicle WHERE session_id = ? AND tier = ?",
+                (self.session_id, self.tier),
+            )
+            for text in entries:
+                self.append_in(conn, text)
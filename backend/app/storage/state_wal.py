@@ -0,0 +1,187 @@
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import uuid
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def fsync_dir(path: Path) -> None:
+    """Сбрасывает на диск запись каталога (после os.replace). На Windows не нужно."""
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_atomic(path: Path, data: str) -> None:
+    """
+    Пишет файл целиком через временный файл, fsync и os.replace.
+    Имя временного файла уникально, так что параллельные записи одного
+    файла не пишут в общий временный файл.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, "x", encoding="utf-8") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+    fsync_dir(path.parent)
+
+
+class WriteAheadLog:
+    """
+    Журнал изменений состояния: JSON-строка на запись, только дозапись.
+    Записи всех сессий, пришедшие за короткое окно, пишутся одной пачкой
+    и сбрасываются на диск одним fsync на файл (group commit): append()
+    возвращается, когда запись уже надежно на диске.
+    """
+
+    def __init__(self, group_commit_window: float = 0.0):
+        self.group_commit_window = group_commit_window
+        self.commits = 0
+        self.records = 0
+        self._pending: List[Tuple[Path, str, asyncio.Future]] = []
+        self._wakeup = asyncio.Event()
+        # Дозапись и усечение одного файла не должны пересекаться
+        self._io_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    # --- Lifecycle ---
+
+    def start(self) -> None:
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.create_task(self._commit_loop())
+
+    async def close(self) -> None:
+        """Дописывает все ожидающие записи и останавливает цикл group commit."""
+        if self._task is not None:
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        while self._pending:
+            await self._commit_batch()
+
+    # --- Public API ---
+
+    def enqueue(self, path: Path, record: Dict[str, Any]) -> asyncio.Future:
+        """
+        Ставит запись в очередь на запись. Порядок записей одного файла
+        совпадает с порядком вызовов. Возвращает future, который
+        завершается после fsync.
+        """
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((Path(path), _encode(record), future))
+        self._wakeup.set()
+        return future
+
+    async def append(self, path: Path, record: Dict[str, Any]) -> None:
+        """Добавляет запись в журнал и ждет ее fsync."""
+        await self.enqueue(path, record)
+
+    async def truncate(self, path: Path, after_seq: int) -> None:
+        """Оставляет в журнале только записи с seq больше after_seq."""
+        async with self._io_lock:
+            await asyncio.to_thread(self._truncate, Path(path), after_seq)
+
+    @staticmethod
+    def recover(path: Path) -> List[Dict[str, Any]]:
+        """
+        Читает записи журнала. Недописанная последняя строка (сбой во время
+        записи) не была подтверждена: она отбрасывается и отрезается от файла,
+        чтобы новые записи не склеились с ней.
+        """
+        records, torn = _read(Path(path))
+        if torn:
+            logger.warning(f"Dropping torn tail of state log {path}")
+            write_atomic(Path(path), "".join(_encode(r) for r in records))
+        return records
+
+    # --- Internals ---
+
+    async def _commit_loop(self) -> None:
+        while not self._closing:
+            await self._wakeup.wait()
+            if self.group_commit_window > 0:
+                # Даем параллельным сессиям присоединиться к пачке
+                await asyncio.sleep(self.group_commit_window)
+            self._wakeup.clear()
+            try:
+                await self._commit_batch()
+            except Exception as e:
+                logger.error(f"State log commit loop error: {e}", exc_info=True)
+
+    async def _commit_batch(self) -> None:
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        try:
+            async with self._io_lock:
+                await asyncio.to_thread(self._write_batch, batch)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.commits += 1
+        self.records += len(batch)
+        for _, _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+    @staticmethod
+    def _write_batch(batch: List[Tuple[Path, str, asyncio.Future]]) -> None:
+        by_path: Dict[Path, List[str]] = defaultdict(list)
+        for path, line, _ in batch:
+            by_path[path].append(line)
+        for path, lines in by_path.items():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("".join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+
+    @staticmethod
+    def _truncate(path: Path, after_seq: int) -> None:
+        if not path.exists():
+            return
+        records, _ = _read(path)
+        write_atomic(path, "".join(_encode(r) for r in records if r["seq"] > after_seq))
+
+
+def _encode(record: Dict[str, Any]) -> str:
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def _read(path: Path) -> Tuple[List[Dict[str, Any]], bool]:
+    """Возвращает подтвержденные записи и признак поврежденного хвоста."""
+    if not path.exists():
+        return [], False
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                return records, True
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                return records, True
+    return records, False
@@ -0,0 +1,6 @@
+"""
+Pipeline benchmarks with an in-process mock of the OpenAI-compatible API.
+
+Run from `backend/`:
+    python -m benchmarks --sizes 2 10 50 200 500 --output results.json
+"""
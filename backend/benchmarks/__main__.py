@@ -0,0 +1,139 @@
+"""
+Command line entry point: `python -m benchmarks [options]` (run from backend/).
+
+Examples:
+    python -m benchmarks
+    python -m benchmarks --suite engine --latency lognormal:0.3:0.5 \
+        --tokens-per-second 40 --turns 5
+    python -m benchmarks --output new.json --baseline old.json --threshold 0.25
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import sys
+import time
+from pathlib import Path
+from benchmarks.mock_llm import LatencyModel, MockLLM
+from benchmarks.suites import (
+    bench_chronology,
+    bench_engine,
+    bench_merge,
+    bench_state_io,
+    compare,
+    load_results,
+)
+
+SUITES = ("engine", "merge", "state_io", "chronology")
+BACKENDS = ("file", "sqlite")
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument(
+        "--suite", nargs="+", choices=SUITES, default=list(SUITES), dest="suites"
+    )
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        type=int,
+        default=[2, 10, 50, 200, 500],
+        help="world sizes (characters = objects)",
+    )
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=3, help="turns per engine run")
+    parser.add_argument(
+        "--chronology-entries", nargs="+", type=int, default=[100, 1000, 5000]
+    )
+    parser.add_argument(
+        "--backend", nargs="+", choices=BACKENDS, default=list(BACKENDS)
+    )
+    parser.add_argument(
+        "--latency",
+        default="fixed:0",
+        help="mock time to first token: fixed:A | uniform:A:B | normal:MU:SD "
+        "| lognormal:MEDIAN:SIGMA (seconds)",
+    )
+    parser.add_argument("--tokens-per-second", type=float, default=0.0)
+    parser.add_argument("--preverify", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="write JSON results here")
+    parser.add_argument("--baseline", type=Path, help="previous results to compare")
+    parser.add_argument(
+        "--threshold", type=float, default=0.2, help="allowed slowdown vs baseline"
+    )
+    return parser.parse_args(argv)
+
+
+async def run(args: argparse.Namespace) -> list:
+    results = []
+    if "merge" in args.suites:
+        results += await bench_merge(args.sizes, args.repeat)
+    if "state_io" in args.suites:
+        results += await bench_state_io(args.sizes, args.repeat, args.backend)
+    if "chronology" in args.suites:
+        results += await bench_chronology(
+            args.chronology_entries, args.repeat, args.backend
+        )
+    if "engine" in args.suites:
+        mock = MockLLM(
+            latency=LatencyModel.parse(args.latency),
+            tokens_per_second=args.tokens_per_second,
+            seed=args.seed,
+        )
+        for backend in args.backend:
+            results += await bench_engine(
+                args.sizes, args.turns, mock, backend, args.preverify
+            )
+    return results
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    started = time.time()
+    results = asyncio.run(run(args))
+    report = {
+        "meta": {
+            "timestamp": started,
+            "duration": round(time.time() - started, 3),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "args": {
+                k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()
+            },
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        args.output.write_text(text, encoding="utf-8")
+    else:
+        print(text)
+
+    for r in results:
+        s = r["stats"]
+        params = " ".join(f"{k}={v}" for k, v in r["params"].items())
+        print(
+            f"{r['suite']:<11} {r['name']:<22} {params:<60} "
+            f"mean={s['mean']:.3f}ms p95={s['p95']:.3f}ms",
+            file=sys.stderr,
+        )
+
+    if args.baseline:
+        regressions = compare(results, load_results(args.baseline), args.threshold)
+        for reg in regressions:
+            print(
+                f"REGRESSION {reg['suite']}/{reg['name']} {reg['params']}: "
+                f"{reg['baseline_mean']}ms -> {reg['mean']}ms (x{reg['ratio']})",
+                file=sys.stderr,
+            )
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
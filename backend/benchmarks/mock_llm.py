@@ -0,0 +1,264 @@
+"""
+In-process mock of an OpenAI-compatible `/v1/chat/completions` endpoint.
+
+The mock plugs into AsyncOpenAI through httpx.MockTransport, so no sockets
+or local model are needed. Each request is routed to an agent by matching
+its system message against the agents' own prompt constants. The reply is
+a canned, agent-specific output (static text or a callable). Time is
+spent as `latency` (time to first token, drawn from a distribution) plus
+`completion_tokens / tokens_per_second`. Streaming requests receive SSE
+chunks paced at the same token rate.
+"""
+
+import asyncio
+import json
+import random
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Union
+import httpx
+from openai import AsyncOpenAI
+from app.services.agent_services import (
+    ActionConsequenceService,
+    ActionSelectorService,
+    MotivationGeneratorService,
+    StoryVerifierService,
+    StoryWriterService,
+    WorldDescriptorService,
+)
+from app.services.chronicle_service import ChronicleService
+
+# Agent key -> the system prompt its requests start with
+AGENT_PROMPTS: Dict[str, str] = {
+    "world_descriptor": WorldDescriptorService.SYSTEM_PROMPT,
+    "action_selector": ActionSelectorService.SYSTEM_PROMPT,
+    "motivation": MotivationGeneratorService.SYSTEM_PROMPT,
+    "action_consequence": ActionConsequenceService.SYSTEM_PROMPT,
+    "story_writer": StoryWriterService.SYSTEM_PROMPT,
+    "story_verifier": StoryVerifierService.SYSTEM_PROMPT,
+    "chronicler": ChronicleService.SYSTEM_PROMPT_CHRONICLER,
+    "summarizer": ChronicleService.SYSTEM_PROMPT_SUMMARIZER,
+    "era_merger": ChronicleService.SYSTEM_PROMPT_ERA_MERGER,
+}
+
+_ACTOR_RE = re.compile(r"\[PLANNED ACTION FOR (.+?)\]")
+
+Reply = Union[str, Callable[[Dict[str, Any]], str]]
+
+
+def _consequence_reply(body: Dict[str, Any]) -> str:
+    """A small, valid state delta for whichever character is acting."""
+    match = _ACTOR_RE.search(body["messages"][-1]["content"])
+    actor = match.group(1) if match else "Unknown"
+    return json.dumps(
+        {
+            "state_changes": {
+                "characters": {
+                    actor: {
+                        "current_action": "smiling warmly",
+                        "current_emotion": ["calm", "friendly"],
+                    }
+                }
+            },
+            "completed_actions": [f"{actor} smiles warmly."],
+        }
+    )
+
+
+DEFAULT_REPLIES: Dict[str, Reply] = {
+    "world_descriptor": "The kitchen is quiet. Wearing: apron. Holding: nothing.",
+    "action_selector": "Smile warmly and greet the other character.",
+    "motivation": "I want to make them feel welcome.",
+    "action_consequence": _consequence_reply,
+    "story_writer": (
+        "I look up as they speak, and I smile warmly, letting the moment settle "
+        "between us before I answer. The room feels a little brighter."
+    ),
+    "story_verifier": '{"result": "PASS"}',
+    "chronicler": "The two characters greeted each other warmly in the kitchen.",
+    "summarizer": "Earlier, the characters spent a quiet evening together.",
+    "era_merger": "Long ago, the characters met and became friends.",
+    "unknown": "OK.",
+}
+
+
+@dataclass
+class LatencyModel:
+    """
+    Time to first token, in seconds.
+    kind: "fixed" (a), "uniform" (a..b), "normal" (mean a, stdev b),
+    "lognormal" (median a, sigma b) — the last one has the long tail
+    typical of a loaded local server.
+    """
+
+    kind: str = "fixed"
+    a: float = 0.0
+    b: float = 0.0
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyModel":
+        """Parses "kind:a[:b]", e.g. "lognormal:0.2:0.5"."""
+        parts = spec.split(":")
+        values = [float(x) for x in parts[1:]] + [0.0, 0.0]
+        return cls(parts[0], values[0], values[1])
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "fixed":
+            value = self.a
+        elif self.kind == "uniform":
+            value = rng.uniform(self.a, self.b)
+        elif self.kind == "normal":
+            value = rng.gauss(self.a, self.b)
+        elif self.kind == "lognormal":
+            value = self.a * rng.lognormvariate(0.0, self.b)
+        else:
+            raise ValueError(f"Unknown latency distribution '{self.kind}'")
+        return max(0.0, value)
+
+
+@dataclass
+class MockLLM:
+    latency: LatencyModel = field(default_factory=LatencyModel)
+    tokens_per_second: float = 0.0  # 0 disables generation time
+    replies: Dict[str, Reply] = field(default_factory=dict)
+    seed: int = 0
+    calls: Counter = field(default_factory=Counter)
+    # Simulated LLM time, to separate engine overhead from model latency
+    simulated_seconds: float = 0.0
+
+    def __post_init__(self):
+        self._rng = random.Random(self.seed)
+        self.replies = {**DEFAULT_REPLIES, **self.replies}
+
+    def client(self) -> AsyncOpenAI:
+        return AsyncOpenAI(
+            api_key="mock",
+            base_url="http://mock-llm/v1",
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(self.handle)),
+            max_retries=0,
+        )
+
+    def reset(self) -> None:
+        self.calls.clear()
+        self.simulated_seconds = 0.0
+
+    # --- Request handling ---
+
+    @staticmethod
+    def agent_for(body: Dict[str, Any]) -> str:
+        system = body["messages"][0]["content"].strip() if body.get("messages") else ""
+        for agent, prompt in AGENT_PROMPTS.items():
+            if system.startswith(prompt.strip()):
+                return agent
+        return "unknown"
+
+    def reply_for(self, agent: str, body: Dict[str, Any]) -> str:
+        reply = self.replies.get(agent, self.replies["unknown"])
+        return reply(body) if callable(reply) else reply
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        if not request.url.path.endswith("/chat/completions"):
+            return httpx.Response(404, json={"error": "not found"})
+        body = json.loads(request.content)
+        agent = self.agent_for(body)
+        self.calls[agent] += 1
+        text = self.reply_for(agent, body)
+        tokens = _split_tokens(text)
+        ttft = self.latency.sample(self._rng)
+        per_token = 1.0 / self.tokens_per_second if self.tokens_per_second else 0.0
+        self.simulated_seconds += ttft + per_token * len(tokens)
+
+        if body.get("stream"):
+            return httpx.Response(
+                200,
+                headers={"content-type": "text/event-stream"},
+                content=self._stream(
+                    tokens,
+                    ttft,
+                    per_token,
+                    (
+                        _usage(body, tokens, 1)
+                        if (body.get("stream_options") or {}).get("include_usage")
+                        else None
+                    ),
+                ),
+            )
+
+        await _sleep(ttft + per_token * len(tokens))
+        n = body.get("n") or 1
+        return httpx.Response(
+            200,
+            json={
+                "id": f"mock-{sum(self.calls.values())}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [
+                    {
+                        "index": i,
+                        "message": {"role": "assistant", "content": text},
+                        "finish_reason": "stop",
+                    }
+                    for i in range(n)
+                ],
+                "usage": _usage(body, tokens, n),
+            },
+        )
+
+    async def _stream(
+        self,
+        tokens: List[str],
+        ttft: float,
+        per_token: float,
+        usage: Optional[Dict[str, int]],
+    ):
+        await _sleep(ttft)
+        for token in tokens:
+            await _sleep(per_token)
+            chunk = {
+                "id": "mock-stream",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": "mock",
+                "choices": [
+                    {"index": 0, "delta": {"content": token}, "finish_reason": None}
+                ],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n".encode()
+        if usage is not None:
+            # stream_options.include_usage: a final chunk without choices
+            chunk = {
+                "id": "mock-stream",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": "mock",
+                "choices": [],
+                "usage": usage,
+            }
+            yield f"data: {json.dumps(chunk)}\n\n".encode()
+        yield b"data: [DONE]\n\n"
+
+
+def _split_tokens(text: str) -> List[str]:
+    """Word-level pseudo tokens that concatenate back to the original text."""
+    return re.findall(r"\S+\s*|\s+", text) or [""]
+
+
+def _count_prompt_tokens(body: Dict[str, Any]) -> int:
+    return sum(len(m.get("content") or "") for m in body.get("messages", [])) // 4
+
+
+def _usage(body: Dict[str, Any], tokens: List[str], n: int) -> Dict[str, int]:
+    prompt = _count_prompt_tokens(body)
+    return {
+        "prompt_tokens": prompt,
+        "completion_tokens": len(tokens) * n,
+        "total_tokens": prompt + len(tokens) * n,
+    }
+
+
+async def _sleep(seconds: float) -> None:
+    if seconds > 0:
+        await asyncio.sleep(seconds)
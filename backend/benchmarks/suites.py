@@ -0,0 +1,361 @@
+"""
+Benchmark suites. Each suite is an async function returning a list of
+result rows: {"suite", "name", "params", "unit", "stats"}.
+"""
+
+import json
+import shutil
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Sequence
+from app.core.config import settings
+from app.core.state_delta import StateDelta
+from app.core.utils import deep_merge_dicts
+from app.models.game_state import GameState
+from app.services.agent_services import (
+    ActionConsequenceService,
+    ActionSelectorService,
+    MotivationGeneratorService,
+    StoryVerifierService,
+    StoryWriterService,
+)
+from app.services.chronicle_memory import ChronicleMemory
+from app.services.chronicle_queue import ChronicleJobQueue
+from app.services.chronicle_service import ChronicleService
+from app.services.game_engine_service import GameEngineService
+from app.services.state_service import GameStateService
+from app.services.story_preverifier import StoryPreVerifier
+from app.storage import FileStorage, SqliteStorage, Storage
+from benchmarks.mock_llm import MockLLM
+from benchmarks.worlds import AI_CHARACTER, USER_CHARACTER, make_world
+
+Row = Dict[str, Any]
+
+_PATH_SETTINGS = (
+    "SESSIONS_DIR",
+    "STATE_FILE_PATH",
+    "CHRONOLOGY_FILE_PATH",
+    "SCENARIO_FILE_PATH",
+    "SQLITE_PATH",
+)
+
+
+@contextmanager
+def isolated_storage_paths() -> Iterator[Path]:
+    """Points every storage setting at a fresh temporary directory."""
+    tmp = Path(tempfile.mkdtemp(prefix="rp-bench-"))
+    saved = {name: getattr(settings, name) for name in _PATH_SETTINGS}
+    settings.SESSIONS_DIR = tmp / "sessions"
+    settings.STATE_FILE_PATH = tmp / "state.json"
+    settings.CHRONOLOGY_FILE_PATH = tmp / "chronology.txt"
+    settings.SCENARIO_FILE_PATH = tmp / "scenario.json"
+    settings.SQLITE_PATH = tmp / "bench.db"
+    try:
+        yield tmp
+    finally:
+        for name, value in saved.items():
+            setattr(settings, name, value)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def write_scenario(state: GameState) -> None:
+    settings.SCENARIO_FILE_PATH.write_text(
+        state.model_dump_json(indent=2), encoding="utf-8"
+    )
+
+
+def make_storage(backend: str) -> Storage:
+    if backend == "sqlite":
+        return SqliteStorage(settings.SQLITE_PATH)
+    return FileStorage(settings.STATE_WAL_GROUP_COMMIT_WINDOW)
+
+
+def summarize(samples: Sequence[float]) -> Dict[str, float]:
+    """Timing statistics in milliseconds."""
+    ordered = sorted(samples)
+    n = len(ordered)
+
+    def pct(q: float) -> float:
+        return ordered[min(n - 1, int(round(q * (n - 1))))]
+
+    return {
+        "n": n,
+        "mean": round(statistics.fmean(ordered) * 1000, 4),
+        "stdev": round(statistics.stdev(ordered) * 1000, 4) if n > 1 else 0.0,
+        "min": round(ordered[0] * 1000, 4),
+        "p50": round(pct(0.5) * 1000, 4),
+        "p95": round(pct(0.95) * 1000, 4),
+        "max": round(ordered[-1] * 1000, 4),
+    }
+
+
+def row(suite: str, name: str, params: Dict[str, Any], samples: Sequence[float]) -> Row:
+    return {
+        "suite": suite,
+        "name": name,
+        "params": params,
+        "unit": "ms",
+        "stats": summarize(samples),
+    }
+
+
+def typical_changes(state: GameState) -> Dict[str, Any]:
+    """A state_changes payload shaped like a real ActionConsequence answer."""
+    objects = [o.model_dump() for o in state.scene.interactive_objects]
+    if objects:
+        objects[0]["state"] = "open"
+    return {
+        "characters": {
+            AI_CHARACTER: {
+                "current_action": "opening the cupboard",
+                "current_emotion": ["focused"],
+                "holding": ["small key"],
+            }
+        },
+        "scene": {"interactive_objects": objects},
+    }
+
+
+# --- Suites ---
+
+
+async def bench_merge(sizes: Sequence[int], repeat: int) -> List[Row]:
+    """Applying state_changes: the old dict merge vs. the typed delta."""
+    rows = []
+    for size in sizes:
+        state = make_world(size, size)
+        changes = typical_changes(state)
+        params = {"characters": size, "objects": size}
+
+        samples = []
+        dumped = state.model_dump()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            deep_merge_dicts(changes, dumped)
+            samples.append(time.perf_counter() - start)
+        rows.append(row("merge", "deep_merge_dicts", params, samples))
+
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            GameState(**deep_merge_dicts(changes, state.model_dump()))
+            samples.append(time.perf_counter() - start)
+        rows.append(row("merge", "deep_merge_roundtrip", params, samples))
+
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            StateDelta.from_changes(state, changes).apply(state)
+            samples.append(time.perf_counter() - start)
+        rows.append(row("merge", "state_delta", params, samples))
+    return rows
+
+
+async def bench_state_io(
+    sizes: Sequence[int], repeat: int, backends: Sequence[str]
+) -> List[Row]:
+    """Per-turn save (delta log), snapshot write and cold load."""
+    rows = []
+    for backend in backends:
+        for size in sizes:
+            params = {"backend": backend, "characters": size, "objects": size}
+            with isolated_storage_paths():
+                world = make_world(size, size)
+                write_scenario(world)
+                storage = make_storage(backend)
+                storage.start()
+                service = GameStateService(storage, snapshot_every=10**9)
+                state = await service.load_state("bench")
+
+                save_samples = []
+                for i in range(repeat):
+                    changes = {"scene": {"time": f"tick {i}"}}
+                    result = StateDelta.from_changes(state, changes).apply(state)
+                    start = time.perf_counter()
+                    await service.save_state("bench", result.state, result.ops)
+                    save_samples.append(time.perf_counter() - start)
+                    state = result.state
+                rows.append(row("state_io", "save_turn", params, save_samples))
+
+                load_samples = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    storage.load_state("bench")
+                    load_samples.append(time.perf_counter() - start)
+                rows.append(
+                    row("state_io", f"load_replay_{repeat}", params, load_samples)
+                )
+
+                snapshot_samples = []
+                for i in range(repeat):
+                    start = time.perf_counter()
+                    await storage.write_snapshot("bench", state, repeat + i)
+                    snapshot_samples.append(time.perf_counter() - start)
+                rows.append(row("state_io", "snapshot", params, snapshot_samples))
+
+                load_samples = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    storage.load_state("bench")
+                    load_samples.append(time.perf_counter() - start)
+                rows.append(row("state_io", "load_snapshot", params, load_samples))
+                await storage.close()
+    return rows
+
+
+async def bench_chronology(
+    checkpoints: Sequence[int], repeat: int, backends: Sequence[str]
+) -> List[Row]:
+    """Append and tail-read cost as the chronology grows."""
+    rows = []
+    text = "The two characters talk quietly in the kitchen about the night. " * 3
+    for backend in backends:
+        with isolated_storage_paths():
+            storage = make_storage(backend)
+            log = storage.chronology("bench")
+            count = 0
+            for checkpoint in sorted(checkpoints):
+                while count < checkpoint:
+                    log.append(text)
+                    count += 1
+                params = {"backend": backend, "entries": checkpoint}
+
+                samples = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    log.append(text)
+                    samples.append(time.perf_counter() - start)
+                count += repeat
+                rows.append(row("chronology", "append", params, samples))
+
+                samples = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    storage.chronology("bench").tail(1)
+                    samples.append(time.perf_counter() - start)
+                rows.append(row("chronology", "open_and_tail_1", params, samples))
+
+                samples = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    log.words_since(checkpoint // 2)
+                    samples.append(time.perf_counter() - start)
+                rows.append(row("chronology", "words_since", params, samples))
+            await storage.close()
+    return rows
+
+
+def build_engine(mock: MockLLM, storage: Storage, preverify: bool) -> GameEngineService:
+    client = mock.client()
+    preverifier = (
+        StoryPreVerifier(
+            settings.STORY_PREVERIFY_PASS_THRESHOLD,
+        )
+        if preverify
+        else None
+    )
+    memory = (
+        ChronicleMemory(storage, settings.CHRONICLE_INDEX_MAX_SESSIONS)
+        if settings.CHRONICLE_RECALL_TOP_K > 0
+        else None
+    )
+    return GameEngineService(
+        state_service=GameStateService(storage),
+        chronicle_service=ChronicleService(client, storage, memory),
+        action_selector=ActionSelectorService(client),
+        motivation_generator=MotivationGeneratorService(client),
+        action_consequence=ActionConsequenceService(client),
+        story_writer=StoryWriterService(client),
+        story_verifier=StoryVerifierService(client, None, preverifier),
+        chronicle_queue=ChronicleJobQueue(),
+    )
+
+
+async def bench_engine(
+    sizes: Sequence[int],
+    turns: int,
+    mock: MockLLM,
+    backend: str,
+    preverify: bool,
+) -> List[Row]:
+    """
+    Full GameEngineService.process_turn against the mock LLM.
+    With zero mock latency the wall time is pure engine overhead;
+    with latency, `llm_simulated` shows how much of a turn the model took.
+    """
+    rows = []
+    for size in sizes:
+        params = {
+            "characters": size,
+            "objects": size,
+            "backend": backend,
+            "preverify": preverify,
+            "latency": f"{mock.latency.kind}:{mock.latency.a}:{mock.latency.b}",
+            "tokens_per_second": mock.tokens_per_second,
+        }
+        with isolated_storage_paths():
+            write_scenario(make_world(size, size))
+            storage = make_storage(backend)
+            storage.start()
+            engine = build_engine(mock, storage, preverify)
+            engine.state_service.start()
+            mock.reset()
+
+            wall, llm, critical = [], [], []
+            for i in range(turns):
+                simulated_before = mock.simulated_seconds
+                start = time.perf_counter()
+                response = await engine.process_turn(
+                    USER_CHARACTER, f"I wave hello ({i}).", session_id="bench"
+                )
+                wall.append(time.perf_counter() - start)
+                llm.append(mock.simulated_seconds - simulated_before)
+                critical.append(response.timings.critical_path)
+            await engine.chronicle_queue.shutdown()
+            await engine.state_service.close()
+            await storage.close()
+
+            rows.append(row("engine", "process_turn", params, wall))
+            rows.append(row("engine", "llm_simulated", params, llm))
+            rows.append(row("engine", "critical_path", params, critical))
+            rows[-1]["calls_per_turn"] = {
+                agent: round(count / turns, 2) for agent, count in mock.calls.items()
+            }
+    return rows
+
+
+def load_results(path: Path) -> List[Row]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["results"]
+
+
+def compare(
+    current: List[Row], baseline: List[Row], threshold: float
+) -> List[Dict[str, Any]]:
+    """Rows whose mean got slower than the baseline by more than `threshold`."""
+
+    def key(r: Row) -> str:
+        return json.dumps([r["suite"], r["name"], r["params"]], sort_keys=True)
+
+    base = {key(r): r for r in baseline}
+    regressions = []
+    for r in current:
+        old = base.get(key(r))
+        if old is None or old["stats"]["mean"] <= 0:
+            continue
+        ratio = r["stats"]["mean"] / old["stats"]["mean"]
+        if ratio > 1 + threshold:
+            regressions.append(
+                {
+                    "suite": r["suite"],
+                    "name": r["name"],
+                    "params": r["params"],
+                    "baseline_mean": old["stats"]["mean"],
+                    "mean": r["stats"]["mean"],
+                    "ratio": round(ratio, 3),
+                }
+            )
+    return regressions
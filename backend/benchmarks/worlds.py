@@ -0,0 +1,57 @@
+"""Synthetic worlds of a given size for the benchmarks."""
+
+from app.models.game_state import GameState
+
+USER_CHARACTER = "Player"
+AI_CHARACTER = "Companion"
+
+
+def make_world(n_characters: int, n_objects: int) -> GameState:
+    """
+    A world with `n_characters` characters (the first two are the player
+    and the AI companion) and `n_objects` interactive scene objects, each
+    character carrying clothing, inventory and relationships like the
+    bundled scenario does.
+    """
+    names = [USER_CHARACTER, AI_CHARACTER] + [
+        f"Extra{i:03d}" for i in range(max(0, n_characters - 2))
+    ]
+    characters = {}
+    for i, name in enumerate(names):
+        characters[name] = {
+            "age": 20 + i % 50,
+            "description": f"{name} is a resident of the old house, tall and quiet.",
+            "personality": "Curious, patient, a little stubborn.",
+            "current_action": "standing by the window",
+            "current_emotion": ["calm"],
+            "goal": "Find out what happened last night.",
+            "knowledge": [f"{name} knows the house well.", "The door creaks."],
+            "relationships": [
+                {"target": other, "type": "acquaintance"}
+                for other in names[max(0, i - 2) : i]
+            ],
+            "location_in_scene": f"spot {i % 10}",
+            "clothing": {
+                "torso": ["linen shirt"],
+                "legs": ["dark trousers"],
+                "feet": ["leather boots"],
+            },
+            "inventory": [f"note {i}", "small key"],
+            "holding": [],
+        }
+    return GameState(
+        scene={
+            "location": "The kitchen of an old house",
+            "time": "Late evening",
+            "description": "A warm kitchen with a long wooden table.",
+            "interactive_objects": [
+                {
+                    "name": f"object {i}",
+                    "location": f"shelf {i % 7}",
+                    "state": "closed" if i % 2 else "open",
+                }
+                for i in range(n_objects)
+            ],
+        },
+        characters=characters,
+    )
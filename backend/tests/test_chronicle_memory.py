@@ -0,0 +1,69 @@
+import threading
+from typing import Dict, List
+
+from app.services.chronicle_memory import ChronicleMemory
+
+
+class _Log:
+    def __init__(self, entries: List[str], gate: threading.Event = None):
+        self._entries = entries
+        self._gate = gate
+
+    def count(self) -> int:
+        return len(self._entries)
+
+    def entries(self, start: int, stop: int) -> List[str]:
+        if self._gate is not None:
+            # Slow storage read during a cold index rebuild
+            self._gate.wait(5)
+        return self._entries[start:stop]
+
+    def tail(self, n: int) -> List[str]:
+        return self._entries[-n:]
+
+
+class _Storage:
+    def __init__(self, logs: Dict[str, _Log]):
+        self.logs = logs
+
+    def chronology(self, session_id: str) -> _Log:
+        return self.logs[session_id]
+
+
+ENTRIES = [
+    "Alice found a rusty key under the mat.",
+    "Bob lit the fireplace in the hall.",
+    "Alice and Bob talked about the weather.",
+]
+
+
+def test_cold_rebuild_does_not_block_other_sessions():
+    gate = threading.Event()
+    memory = ChronicleMemory(
+        _Storage({"slow": _Log(ENTRIES, gate), "fast": _Log(ENTRIES)}),
+        max_sessions=8,
+    )
+    slow = threading.Thread(target=memory.sync, args=("slow",))
+    slow.start()
+    try:
+        fast = []
+        worker = threading.Thread(
+            target=lambda: fast.extend(memory.recall("fast", "rusty key", 3, 1000))
+        )
+        worker.start()
+        worker.join(2)
+        assert not worker.is_alive()
+        assert fast == [ENTRIES[0]]
+    finally:
+        gate.set()
+        slow.join()
+    assert memory.recall("slow", "fireplace", 3, 1000) == [ENTRIES[1]]
+
+
+def test_rewritten_chronology_rebuilds_index():
+    log = _Log(list(ENTRIES))
+    memory = ChronicleMemory(_Storage({"s": log}), max_sessions=8)
+    memory.sync("s")
+    log._entries[:] = ["Carol opened the window.", "Carol closed the door."]
+    assert memory.recall("s", "window", 3, 1000) == ["Carol opened the window."]
+    assert memory.stats() == {"sessions": 1, "entries": 2}
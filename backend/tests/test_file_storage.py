@@ -0,0 +1,25 @@
+import asyncio
+
+from app.core.config import settings
+from app.storage.file_storage import FileStorage
+
+
+def test_turn_history_survives_snapshots(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "SESSIONS_DIR", tmp_path)
+
+    async def scenario():
+        storage = FileStorage()
+        state, _, _ = storage.load_state("s1")
+        for seq in (1, 2, 3):
+            await storage.append_state(
+                "s1", {"seq": seq, "ops": []}, {"user_input": f"turn {seq}"}
+            )
+        await storage.write_snapshot("s1", state, 2)
+        await storage.close()
+        return storage
+
+    storage = asyncio.run(scenario())
+    turns = storage.turns("s1")
+    assert [t["seq"] for t in turns] == [1, 2, 3]
+    assert turns[-1]["user_input"] == "turn 3"
+    assert [t["seq"] for t in storage.turns("s1", limit=1)] == [3]
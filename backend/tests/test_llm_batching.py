@@ -0,0 +1,160 @@
+import asyncio
+from typing import Any, Dict, List
+
+from openai.types.chat import ChatCompletion
+
+from app.core.llm_batching import LLMBatchDispatcher
+
+
+def _completion(contents: List[str]) -> ChatCompletion:
+    return ChatCompletion.model_validate(
+        {
+            "id": "fake",
+            "object": "chat.completion",
+            "created": 0,
+            "model": "local-model",
+            "choices": [
+                {
+                    "index": i,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": content},
+                }
+                for i, content in enumerate(contents)
+            ],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+        }
+    )
+
+
+class _FakeClient:
+    def __init__(self, delay: float = 0.05, max_choices: int = 16):
+        self.delay = delay
+        self.max_choices = max_choices
+        self.calls: List[Dict[str, Any]] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.chat = type("Chat", (), {})()
+        self.chat.completions = self
+
+    async def create(self, **params: Any) -> ChatCompletion:
+        self.calls.append(params)
+        number = len(self.calls)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        n = min(params.get("n", 1), self.max_choices)
+        prompt = params["messages"][-1]["content"]
+        return _completion([f"{prompt}#{number}.{i}" for i in range(n)])
+
+
+def _params(prompt: str, temperature: float = 0.0) -> Dict[str, Any]:
+    return {
+        "model": "local-model",
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": temperature,
+    }
+
+
+def _content(completion: ChatCompletion) -> str:
+    return completion.choices[0].message.content
+
+
+def test_follower_gets_result_after_first_caller_is_cancelled():
+    async def scenario():
+        client = _FakeClient()
+        dispatcher = LLMBatchDispatcher(client, window=0, max_batch_size=8)
+        first = asyncio.create_task(dispatcher.create(**_params("same")))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(dispatcher.create(**_params("same")))
+        await asyncio.sleep(0)
+        first.cancel()
+
+        result = await follower
+        assert len(client.calls) == 1
+        assert _content(result) == "same#1.0"
+        # Only the caller that started the request reports its usage
+        assert result.usage is None
+
+    asyncio.run(scenario())
+
+
+def test_sampled_requests_are_not_shared_in_flight():
+    async def scenario():
+        client = _FakeClient()
+        dispatcher = LLMBatchDispatcher(client, window=0, max_batch_size=8)
+        results = await asyncio.gather(
+            *(dispatcher.create(**_params("same", 0.7)) for _ in range(3))
+        )
+        assert len(client.calls) == 3
+        assert len({_content(r) for r in results}) == 3
+
+    asyncio.run(scenario())
+
+
+def test_identical_sampled_requests_use_n_and_route_choices():
+    async def scenario():
+        client = _FakeClient()
+        dispatcher = LLMBatchDispatcher(client, window=0.01, max_batch_size=8)
+        results = await asyncio.gather(
+            *(dispatcher.create(**_params("same", 0.7)) for _ in range(3))
+        )
+        assert [call.get("n") for call in client.calls] == [3]
+        assert [_content(r) for r in results] == [f"same#1.{i}" for i in range(3)]
+        assert all(len(r.choices) == 1 and r.choices[0].index == 0 for r in results)
+        assert [r.usage is not None for r in results] == [True, False, False]
+
+    asyncio.run(scenario())
+
+
+def test_missing_choices_are_requested_separately():
+    async def scenario():
+        client = _FakeClient(max_choices=1)
+        dispatcher = LLMBatchDispatcher(client, window=0.01, max_batch_size=8)
+        results = await asyncio.gather(
+            *(dispatcher.create(**_params("same", 0.7)) for _ in range(3))
+        )
+        assert len(results) == 3 and len(client.calls) == 3
+        assert not dispatcher.use_n
+
+    asyncio.run(scenario())
+
+
+def test_same_model_requests_in_window_are_sent_together():
+    async def scenario():
+        client = _FakeClient()
+        dispatcher = LLMBatchDispatcher(client, window=0.02, max_batch_size=8)
+        prompts = ["a", "b", "a", "c"]
+        tasks = []
+        for prompt in prompts:
+            tasks.append(asyncio.create_task(dispatcher.create(**_params(prompt))))
+            await asyncio.sleep(0.002)
+        results = await asyncio.gather(*tasks)
+
+        # Identical requests share a call; different ones go out concurrently
+        assert sorted(c["messages"][0]["content"] for c in client.calls) == [
+            "a",
+            "b",
+            "c",
+        ]
+        assert client.max_in_flight == 3
+        assert [_content(r).split("#")[0] for r in results] == prompts
+
+    asyncio.run(scenario())
+
+
+def test_full_batch_is_sent_without_waiting_for_the_window():
+    async def scenario():
+        client = _FakeClient(delay=0)
+        dispatcher = LLMBatchDispatcher(client, window=10, max_batch_size=2)
+        results = await asyncio.wait_for(
+            asyncio.gather(
+                dispatcher.create(**_params("a")), dispatcher.create(**_params("b"))
+            ),
+            timeout=1,
+        )
+        assert [_content(r)[0] for r in results] == ["a", "b"]
+
+    asyncio.run(scenario())
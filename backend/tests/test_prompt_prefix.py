@@ -0,0 +1,160 @@
+"""
+Prompt layout for KV prefix caching: the stable part of every agent's prompt
+must be byte-identical across turns, and a story retry must extend the first
+attempt's prompt instead of rewriting it.
+"""
+
+import asyncio
+import json
+from typing import Any, Dict, List
+
+import pytest
+from openai.types.chat import ChatCompletion
+
+from app.core.config import settings
+from app.models.game_state import GameState
+from app.services.agent_services import (
+    ActionConsequenceService,
+    ActionSelectorService,
+    MotivationGeneratorService,
+    StoryVerifierService,
+    StoryWriterService,
+)
+from benchmarks.worlds import AI_CHARACTER, USER_CHARACTER, make_world
+
+
+class _FakeCompletions:
+    def __init__(self, reply: str):
+        self.reply = reply
+        self.calls: List[Dict[str, Any]] = []
+
+    async def create(self, **params: Any) -> ChatCompletion:
+        self.calls.append(params)
+        return ChatCompletion.model_validate(
+            {
+                "id": "fake",
+                "object": "chat.completion",
+                "created": 0,
+                "model": params["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": self.reply},
+                    }
+                ],
+            }
+        )
+
+
+class _FakeClient:
+    """Captures the messages of every chat.completions.create call."""
+
+    base_url = "http://fake/v1"
+
+    def __init__(self, reply: str = "ok"):
+        self.chat = type("Chat", (), {})()
+        self.chat.completions = _FakeCompletions(reply)
+
+    @property
+    def messages(self) -> List[List[Dict[str, str]]]:
+        return [call["messages"] for call in self.chat.completions.calls]
+
+
+@pytest.fixture(autouse=True)
+def _plain_completions(monkeypatch):
+    # JSON agents would otherwise stream their answer; the fake is non-streaming
+    monkeypatch.setattr(settings, "LLM_JSON_EARLY_STOP", False)
+    monkeypatch.setattr(settings, "LLM_STRUCTURED_OUTPUT", False)
+
+
+@pytest.fixture
+def world() -> GameState:
+    # Large enough for relevance pruning (CONTEXT_PRUNING_MIN_ENTITIES)
+    return make_world(20, 20)
+
+
+def _next_turn(state: GameState) -> GameState:
+    """The world one turn later: an action and an object state changed."""
+    data = state.model_dump()
+    data["characters"][AI_CHARACTER]["current_action"] = "opening the drawer"
+    data["scene"]["interactive_objects"][0]["state"] = "broken"
+    return GameState(**data)
+
+
+async def _run_agent(agent: str, client: _FakeClient, state: GameState, turn: int):
+    user_input = f"turn {turn}: I wave at {AI_CHARACTER}"
+    chronicle = f"Chronicle entry of turn {turn}."
+    if agent == "selector":
+        await ActionSelectorService(client).select_action(
+            state, AI_CHARACTER, user_input, "waits", chronicle
+        )
+    elif agent == "motivation":
+        await MotivationGeneratorService(client).generate_motivation(
+            state, AI_CHARACTER, f"wave back ({turn})", user_input
+        )
+    elif agent == "consequence":
+        await ActionConsequenceService(client).determine_consequences(
+            state, f"wave back ({turn})", AI_CHARACTER
+        )
+    elif agent == "writer":
+        await StoryWriterService(client).write_story(
+            state,
+            AI_CHARACTER,
+            USER_CHARACTER,
+            [f"{AI_CHARACTER} waves back."],
+            "Politeness.",
+            user_input,
+            chronicle,
+        )
+    elif agent == "verifier":
+        await StoryVerifierService(client).verify(
+            [f"{AI_CHARACTER} waves back."], f"I wave back ({turn}).", state
+        )
+
+
+@pytest.mark.parametrize(
+    "agent", ["selector", "motivation", "consequence", "writer", "verifier"]
+)
+def test_stable_sections_identical_across_turns(agent, world):
+    reply = json.dumps({"state_changes": {}, "completed_actions": []})
+    if agent == "verifier":
+        reply = json.dumps({"result": "PASS"})
+    client = _FakeClient(reply)
+
+    asyncio.run(_run_agent(agent, client, world, 1))
+    asyncio.run(_run_agent(agent, client, _next_turn(world), 2))
+
+    first, second = client.messages
+    # STATIC and SESSION sections form the system message
+    assert first[0]["role"] == "system"
+    assert first[0]["content"] == second[0]["content"]
+    # ...and the turn-level sections really did change
+    assert first[1]["content"] != second[1]["content"]
+
+
+def test_story_retry_extends_first_attempt(world):
+    client = _FakeClient("I wave back.")
+    writer = StoryWriterService(client)
+    other = next(name for name in world.characters if name.startswith("Extra"))
+    obj = world.scene.interactive_objects[-1].name
+    args = (
+        world,
+        AI_CHARACTER,
+        USER_CHARACTER,
+        [f"{AI_CHARACTER} waves back."],
+        "Politeness.",
+        f"I wave at {AI_CHARACTER}",
+        "The evening was quiet.",
+    )
+
+    asyncio.run(writer.write_story(*args))
+    # Feedback that names entities outside the pruned view
+    feedback = f"The story mentions {other} and the {obj}, which are not in the script."
+    asyncio.run(writer.write_story(*args, revision_feedback=feedback))
+
+    initial, retry = client.messages
+    assert initial[0] == retry[0]
+    # The retry only appends the revision section to the first attempt's prompt
+    assert retry[1]["content"].startswith(initial[1]["content"] + "\n\n")
+    assert retry[1]["content"].endswith(feedback)
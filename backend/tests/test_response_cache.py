@@ -0,0 +1,20 @@
+import threading
+
+from app.core.response_cache import ResponseCache
+
+
+def test_concurrent_disk_writes_of_one_key(tmp_path):
+    cache = ResponseCache(4, tmp_path, 1024 * 1024)
+    values = [str(i) * 100_000 for i in range(8)]
+    threads = [
+        threading.Thread(target=cache._write_disk, args=("ab" * 32, value))
+        for value in values
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # One whole value wins and no temporary files are left behind
+    assert cache._read_disk("ab" * 32) in values
+    assert [p.suffix for p in tmp_path.rglob("*")] == ["", ".txt"]
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from app.services.state_service import GameStateService
+from benchmarks.worlds import make_world
+
+
+class _Storage:
+    """Storage stub whose journal writes can be made to fail."""
+
+    def __init__(self):
+        self.world = make_world(2, 2)
+        self.fail = False
+        self.records = []
+        self.snapshots = []
+
+    def load_state(self, session_id):
+        return self.world, 0, 0
+
+    def append_state(self, session_id, record, turn=None):
+        future = asyncio.get_running_loop().create_future()
+        if self.fail:
+            future.set_exception(OSError("disk full"))
+        else:
+            self.records.append(record)
+            future.set_result(None)
+        return future
+
+    async def write_snapshot(self, session_id, state, seq):
+        self.snapshots.append((state, seq))
+
+
+def _changed(state):
+    data = state.model_dump()
+    data["scene"]["time"] = "midnight"
+    return type(state)(**data)
+
+
+def test_failed_write_is_not_published():
+    async def scenario():
+        storage = _Storage()
+        service = GameStateService(storage, max_sessions=4, idle_ttl=0)
+        original = await service.load_state("s")
+
+        storage.fail = True
+        with pytest.raises(OSError):
+            await service.save_state("s", _changed(original))
+        assert await service.load_state("s") is original
+        await service.flush()
+        assert storage.snapshots == []
+
+        # The next successful write reuses the sequence number
+        storage.fail = False
+        saved = _changed(original)
+        await service.save_state("s", saved)
+        assert [r["seq"] for r in storage.records] == [1]
+        assert await service.load_state("s") is saved
+
+    asyncio.run(scenario())
@@ -0,0 +1,29 @@
+from app.models.game_state import GameState
+from app.services.story_preverifier import StoryPreVerifier
+from benchmarks.worlds import AI_CHARACTER, make_world
+
+
+def _check(actions, story):
+    world: GameState = make_world(2, 2)
+    return StoryPreVerifier(pass_threshold=0.85).check(actions, story, world)
+
+
+def test_paraphrased_action_is_escalated():
+    # Few shared words is not evidence of a failure: the LLM decides
+    assert _check(["picks up the cup of tea"], "I lift the mug to my lips.") is None
+
+
+def test_non_english_story_is_escalated():
+    assert _check(["opens the door"], "Я открываю дверь.") is None
+
+
+def test_empty_story_fails_locally():
+    valid, reason = _check(["opens the door"], "[STORY] ...")
+    assert not valid and "empty" in reason
+
+
+def test_dialogue_only_story_fails_locally():
+    valid, reason = _check(
+        [f"{AI_CHARACTER} opens the door"], '"Shall I open the door?"'
+    )
+    assert not valid and "dialogue" in reason
@@ -0,0 +1,57 @@
+import json
+
+import pytest
+
+from app.core.config import settings
+from app.core.token_budget import (
+    BudgetSection,
+    PromptBudgetError,
+    ShrinkPolicy,
+    fit_prompt,
+)
+from app.services.agent_services import SHRINK_STATE_JSON, SHRINK_TEXT
+
+
+@pytest.fixture(autouse=True)
+def _small_context(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_MAX_CONTEXT", 600)
+    monkeypatch.setattr(settings, "LLM_GENERATION_RESERVE", 100)
+
+
+def _state_json(n: int) -> str:
+    data = {f"object_{i}": {"state": "closed", "location": "room"} for i in range(n)}
+    return "[CURRENT JSON]\n" + json.dumps(data, indent=2)
+
+
+def test_shrink_policy_is_abstract():
+    with pytest.raises(TypeError):
+        ShrinkPolicy()
+
+
+def test_state_json_is_compacted_and_stays_valid():
+    texts = fit_prompt(
+        "test",
+        [
+            BudgetSection("instructions", "Answer in JSON."),
+            BudgetSection("state", _state_json(12), shrink=SHRINK_STATE_JSON),
+            BudgetSection("notes", "word " * 300, shrink=SHRINK_TEXT),
+        ],
+    )
+    header, body = texts["state"].split("\n", 1)
+    assert json.loads(body) == json.loads(_state_json(12).split("\n", 1)[1])
+
+
+def test_prompt_that_cannot_fit_raises():
+    with pytest.raises(PromptBudgetError):
+        fit_prompt(
+            "test",
+            [
+                BudgetSection("instructions", "Answer in JSON."),
+                BudgetSection("state", _state_json(200), shrink=SHRINK_STATE_JSON),
+            ],
+        )
+
+
+def test_budget_error_names_agent_and_overflow():
+    error = PromptBudgetError("story_writer", 600, 500)
+    assert "story_writer" in str(error) and "by 100 tokens" in str(error)